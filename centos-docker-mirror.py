@@ -1,5 +1,5 @@
 #! /usr/bin/python3
-# pylint: disable=unused-variable,unused-argument,line-too-long,too-many-lines,too-many-locals,too-many-return-statements,too-many-branches
+# pylint: disable=unused-variable,unused-argument,line-too-long,too-many-lines,too-many-locals,too-many-return-statements,too-many-branches,too-many-statements
 # pylint: disable=consider-using-from-import,consider-using-get,consider-using-generator,consider-using-with,consider-using-in,no-else-return
 """ sync packages repo to disk and make docker mirror images from it.
     Try to run 'sync' followed be 'repo'. If a command starts with a
@@ -31,6 +31,7 @@ NIX = ""
 NEVER = False
 NOBASE = False
 IMAGESREPO = os.environ.get("IMAGESREPO", "localhost:5000/mirror-packages")
+LABELS = "com.github.gdraheim.docker-mirror"  # prefix of the labels on the repo images
 REPODATADIR = os.environ.get("REPODATADIR", "")
 REPODIR = os.environ.get("REPODIR", "repo.d")
 
@@ -40,6 +41,7 @@ MIRRORDEF = os.environ.get("DOCKER_MIRROR_PY", os.environ.get("DOCKER_MIRROR",
 RSYNCDEF= os.environ.get("DOCKER_RSYNC", os.environ.get("DOCKER_RSYNC3", "rsync"))
 
 DISTROPYTHON = NIX # default for repo containers depends on centos version
+THREADS = 8 # worker threads of the scripts in the repo containers
 PYTHON = PYTHONDEF
 MIRROR = MIRRORDEF
 DOCKER = DOCKERDEF
@@ -556,6 +558,8 @@ def distro_epelrepos(distro: str, centos: str, dists: Dict[str, List[str]]) -> N
     addhosts = out.strip()
     PORT = centos_epel_port(distro, centos)
     CMD = str(centos_epel_cmd(distro, centos)).replace("'", '"')
+    INDEX = " ".join(centos_epel_cmd(distro, centos) + ["--makeindex"])
+    MAKECERT = " ".join(centos_epel_cmd(distro, centos) + ["--makecert"])
     sx___(F"{docker} rm --force {cname}")
     sh___(F"{docker} run --name={cname} {addhosts} --detach {baseimage} sleep 9999")
     if PORT != 80:
@@ -563,6 +567,8 @@ def distro_epelrepos(distro: str, centos: str, dists: Dict[str, List[str]]) -> N
         sh___(F"{docker} exec {cname} yum install -y openssl")
     sh___(F"{docker} exec {cname} mkdir -p /srv/repo/epel/{epel}")
     sh___(F"{docker} cp {scripts} {cname}:/srv/scripts")
+    if PORT != 80:
+        sh___(F"{docker} exec {cname} {MAKECERT}")
     if NEVER:
         # instead we use an explicit epelrepo8_CMD
         for script in os.listdir(F"{scripts}/."):
@@ -572,7 +578,10 @@ def distro_epelrepos(distro: str, centos: str, dists: Dict[str, List[str]]) -> N
     repo = IMAGESREPO
     latest = centos_epelupdated(distro, centos) or datetime.date.today()
     yymm = latest.strftime("%y%m")
-    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {repo}/{distro}-repo/{base}:{version}.x.{yymm}")
+    labels: Dict[str, Union[str, int]] = {"distro": distro, "version": F"{version}.x.{yymm}", "baseimage": baseimage, "refdate": yymm,
+                                          "hosts": centos_epel_hosts(distro, centos), "port": PORT, "data": "/srv/repo/epel"}
+    LABEL = commit_labels(layer=base, **labels)
+    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {repo}/{distro}-repo/{base}:{version}.x.{yymm}")
     for dist in dists:
         sx___(F"{docker} rm --force {cname}")
         sh___(F"{docker} run --name={cname} --detach {repo}/{distro}-repo/{base}:{version}.x.{yymm} sleep 9999")
@@ -580,7 +589,9 @@ def distro_epelrepos(distro: str, centos: str, dists: Dict[str, List[str]]) -> N
             sh___(F"{docker} cp {repodir}/{distro}.{epel}/{epel}/{subdir} {cname}:/srv/repo/epel/{epel}/")
             base = dist  # !!
         if base == dist:
-            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {repo}/{distro}-repo/{base}:{version}.x.{yymm}")
+            sh___(F"{docker} exec {cname} {INDEX}")
+            LABEL = commit_labels(layer=base, **labels)
+            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {repo}/{distro}-repo/{base}:{version}.x.{yymm}")
     sx___(F"{docker} rm --force {cname}")
     if base != BASELAYER:
         sh___(F"{docker} tag {repo}/{distro}-repo/{base}:{version}.x.{yymm} {repo}/{distro}-repo:{version}.x.{yymm}")
@@ -588,11 +599,14 @@ def distro_epelrepos(distro: str, centos: str, dists: Dict[str, List[str]]) -> N
             sh___(F"{docker} rmi {repo}/{distro}-repo/{BASELAYER}:{version}.x.{yymm}")
         PORT2 = centos_epel_http_port(distro, centos)
         CMD2 = str(centos_epel_http_cmd(distro, centos)).replace("'", '"')
+        INDEX2 = " ".join(centos_epel_http_cmd(distro, centos) + ["--makeindex"])
         if PORT != PORT2:
             # the upstream epel repository runs on https by default but we don't have their certificate anyway
             base2 = "http"  # !!
             sh___(F"{docker} run --name={cname} --detach {repo}/{distro}-repo:{version}.x.{yymm} sleep 9999")
-            sh___(F"{docker} commit -c 'CMD {CMD2}' -c 'EXPOSE {PORT2}' -m {base2} {cname} {repo}/{distro}-repo/{base2}:{version}.x.{yymm}")
+            sh___(F"{docker} exec {cname} {INDEX2}")
+            LABEL = commit_labels(layer=base2, **{**labels, "port": PORT2})
+            sh___(F"{docker} commit -c 'CMD {CMD2}' -c 'EXPOSE {PORT2}' {LABEL} -m {base2} {cname} {repo}/{distro}-repo/{base2}:{version}.x.{yymm}")
             sx___(F"{docker} rm --force {cname}")
 
 def centos_epelrepo7(distro: str = NIX, centos: str = NIX) -> None:
@@ -606,6 +620,8 @@ def centos_epelrepo7(distro: str = NIX, centos: str = NIX) -> None:
     cname = F"{distro}-repo-{epel}"  # container name
     PORT = centos_epel_port(distro, centos)
     CMD = str(centos_epel_cmd(distro, centos)).replace("'", '"')
+    INDEX = " ".join(centos_epel_cmd(distro, centos) + ["--makeindex"])
+    MAKECERT = " ".join(centos_epel_cmd(distro, centos) + ["--makecert"])
     sx___(F"{docker} rm --force {cname}")
     sh___(F"{docker} run --name={cname} --detach centos:{centos} sleep 9999")
     sh___(F"{docker} exec {cname} mkdir -p /srv/repo/epel")
@@ -614,31 +630,44 @@ def centos_epelrepo7(distro: str = NIX, centos: str = NIX) -> None:
     sh___(F"{docker} cp {scripts} {cname}:/srv/scripts")
     for script in os.listdir(f"{scripts}/."):
         sh___(F"{docker} exec {cname} chmod +x /srv/scripts/{script}")
+    if PORT != 80:
+        sh___(F"{docker} exec {cname} {MAKECERT}")
     #
     repo = IMAGESREPO
     latest = centos_epelupdated(distro, centos) or datetime.date.today()
     yymm = latest.strftime("%y%m")
     sh___(F"{docker} cp {repodir}/{distro}.{epel}/{epel} {cname}:/srv/repo/epel/")
-    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {cname} {repo}/{distro}-repo:{version}.x.{yymm}")
+    sh___(F"{docker} exec {cname} {INDEX}")
+    labels: Dict[str, Union[str, int]] = {"distro": distro, "version": F"{version}.x.{yymm}", "baseimage": F"centos:{centos}", "refdate": yymm,
+                                          "hosts": centos_epel_hosts(distro, centos), "port": PORT, "data": "/srv/repo/epel"}
+    LABEL = commit_labels(**labels)
+    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} {cname} {repo}/{distro}-repo:{version}.x.{yymm}")
     sh___(F"{docker} rm --force {cname}")
     if MAKE_EPEL_HTTP:
         PORT2 = centos_epel_http_port(distro, centos)
         CMD2 = str(centos_epel_http_cmd(distro, centos)).replace("'", '"')
+        INDEX2 = " ".join(centos_epel_http_cmd(distro, centos) + ["--makeindex"])
         base2 = "http"  # !!
         # the upstream epel repository runs on https by default but we don't have their certificate anyway
         sh___(F"{docker} run --name={cname} --detach {repo}/{distro}-repo:{version}.x.{yymm} sleep 999")
-        sh___(F"{docker} commit -c 'CMD {CMD2}' -c 'EXPOSE {PORT2}' {cname} {repo}/{distro}-repo/{base2}:{version}.x.{yymm}")
+        sh___(F"{docker} exec {cname} {INDEX2}")
+        LABEL = commit_labels(layer=base2, **{**labels, "port": PORT2})
+        sh___(F"{docker} commit -c 'CMD {CMD2}' -c 'EXPOSE {PORT2}' {LABEL} {cname} {repo}/{distro}-repo/{base2}:{version}.x.{yymm}")
         sh___(F"{docker} rm --force {cname}")
 
 def centos_epel_port(distro: str = NIX, centos: str = NIX) -> int:
     distro = distro or DISTRO
     centos = centos or CENTOS
     return 443
+def centos_epel_hosts(distro: str = NIX, centos: str = NIX) -> str:
+    distro = distro or DISTRO
+    centos = centos or CENTOS
+    return "mirrors.fedoraproject.org"
 def centos_epel_cmd(distro: str = NIX, centos: str = NIX) -> List[str]:
     distro = distro or DISTRO
     centos = centos or CENTOS
     python = centos_python(distro, centos)
-    return [python, "/srv/scripts/mirrors.fedoraproject.org.py", "--data", "/srv/repo/epel", "--ssl", "https://mirrors.fedoraproject.org"]
+    return [python, "/srv/scripts/mirrors.fedoraproject.org.py", "--data", "/srv/repo/epel", "--ssl", "https://mirrors.fedoraproject.org", "--threads", str(THREADS)]
 def centos_epel_http_port(distro: str = NIX, centos: str = NIX) -> int:
     distro = distro or DISTRO
     centos = centos or CENTOS
@@ -647,7 +676,7 @@ def centos_epel_http_cmd(distro: str = NIX, centos: str = NIX) -> List[str]:
     distro = distro or DISTRO
     centos = centos or CENTOS
     python = centos_python(distro, centos)
-    return [python, "/srv/scripts/mirrors.fedoraproject.org.py", "--data", "/srv/repo/epel"]
+    return [python, "/srv/scripts/mirrors.fedoraproject.org.py", "--data", "/srv/repo/epel", "--threads", str(THREADS)]
 
 def centos_main_port(distro: str = NIX, centos: str = NIX) -> int:
     distro = distro or DISTRO
@@ -655,14 +684,20 @@ def centos_main_port(distro: str = NIX, centos: str = NIX) -> int:
     if distro == "almalinux":
         return 443
     return 80
+def centos_main_hosts(distro: str = NIX, centos: str = NIX) -> str:
+    distro = distro or DISTRO
+    centos = centos or CENTOS
+    if distro == "almalinux":
+        return "mirrors.almalinux.org"
+    return "mirrorlist.centos.org"
 def centos_main_cmd(distro: str = NIX, centos: str = NIX) -> List[str]:
     distro = distro or DISTRO
     centos = centos or CENTOS
     python = centos_python(distro, centos)
     if distro == "almalinux":
-        return [python, "/srv/scripts/mirrorlist.py", "--data", "/srv/repo", "--ssl", "https://mirrors.almalinux.org"]
+        return [python, "/srv/scripts/mirrorlist.py", "--data", "/srv/repo", "--ssl", "https://mirrors.almalinux.org", "--threads", str(THREADS)]
     else:
-        return [python, "/srv/scripts/mirrorlist.py", "--data", "/srv/repo"]
+        return [python, "/srv/scripts/mirrorlist.py", "--data", "/srv/repo", "--threads", str(THREADS)]
 
 def centos_http_port(distro: str = NIX, centos: str = NIX) -> int:
     distro = distro or DISTRO
@@ -672,7 +707,7 @@ def centos_http_cmd(distro: str = NIX, centos: str = NIX) -> List[str]:
     distro = distro or DISTRO
     centos = centos or CENTOS
     python = centos_python(distro, centos)
-    return [python, "/srv/scripts/mirrorlist.py", "--data", "/srv/repo"]
+    return [python, "/srv/scripts/mirrorlist.py", "--data", "/srv/repo", "--threads", str(THREADS)]
 
 def centos_python(distro: str = NIX, centos: str = NIX) -> str:
     distro = distro or DISTRO
@@ -722,6 +757,7 @@ def distro_repos(distro: str, centos: str, dists: Dict[str, List[str]]) -> str:
     cname = F"{distro}-repo-{centos}"
     PORT = centos_main_port(distro, centos)
     CMD = str(centos_main_cmd(distro, centos)).replace("'", '"')
+    MAKECERT = " ".join(centos_main_cmd(distro, centos) + ["--makecert"])
     sx___(F"{docker} rm --force {cname}")
     sh___(F"{docker} run --name={cname} --detach {baseimage} sleep 9999")
     if PORT != 80:
@@ -732,9 +768,14 @@ def distro_repos(distro: str, centos: str, dists: Dict[str, List[str]]) -> str:
     if R != centos and centos != rel:
         sh___(F"{docker} exec {cname} ln -sv {R} /srv/repo/{centos}")
     sh___(F"{docker} cp {scripts} {cname}:/srv/scripts")
+    if PORT != 80:
+        sh___(F"{docker} exec {cname} {MAKECERT}")
     base = BASELAYER
     repo = IMAGESREPO
-    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {repo}/{distro}-repo/{base}:{version}")
+    labels: Dict[str, Union[str, int]] = {"distro": distro, "version": version, "baseimage": baseimage,
+                                          "hosts": centos_main_hosts(distro, centos), "port": PORT, "data": "/srv/repo"}
+    LABEL = commit_labels(layer=base, **labels)
+    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {repo}/{distro}-repo/{base}:{version}")
     for dist in dists:
         sx___(F"{docker} rm --force {cname}")
         sh___(F"{docker} run --name={cname} --detach {repo}/{distro}-repo/{base}:{version} sleep 9999")
@@ -744,7 +785,8 @@ def distro_repos(distro: str, centos: str, dists: Dict[str, List[str]]) -> str:
                 sh___(F"{docker} cp {pooldir} {cname}:/srv/repo/{R}/")
                 base = dist
         if base == dist:
-            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {repo}/{distro}-repo/{base}:{version}")
+            LABEL = commit_labels(layer=base, **labels)
+            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {repo}/{distro}-repo/{base}:{version}")
     sh___(F"{docker} rm --force {cname}")
     if base != BASELAYER:
         sh___(F"{docker} tag {repo}/{distro}-repo/{base}:{version} {repo}/{distro}-repo:{version}")
@@ -756,7 +798,8 @@ def distro_repos(distro: str, centos: str, dists: Dict[str, List[str]]) -> str:
             # the upstream almalinux repository runs on https by default but we don't have their certificate anyway
             base2 = "http"  # !!
             sh___(F"{docker} run --name={cname} --detach {repo}/{distro}-repo:{version} sleep 9999")
-            sh___(F"{docker} commit -c 'CMD {CMD2}' -c 'EXPOSE {PORT2}' -m {base2} {cname} {repo}/{distro}-repo/{base2}:{version}")
+            LABEL = commit_labels(layer=base2, **{**labels, "port": PORT2})
+            sh___(F"{docker} commit -c 'CMD {CMD2}' -c 'EXPOSE {PORT2}' {LABEL} -m {base2} {cname} {repo}/{distro}-repo/{base2}:{version}")
             sx___(F"{docker} rm --force {cname}")
     centos_restore()
     return F"\n[{baseimage}]\nimage = {repo}/{distro}-repo/{base}:{version}\n"
@@ -826,10 +869,19 @@ def distro_epeldisk(distro: str, centos: str, dists: Dict[str, List[str]]) -> st
     for dist in dists:
         for subdir in dists[dist]:
             sh___(F"cp -r --link --no-clobber {repodir}/{distro}.{epel}/{epel}/{subdir} {srv}/repo/epel/{epel}/")
+    centos_epel_makeindex(F"{srv}/repo/epel", distro, centos)
     path_srv = os.path.realpath(srv)
     return F"\nmount = {path_srv}/repo\n"
 
 
+def centos_epel_makeindex(datadir: str, distro: str = NIX, centos: str = NIX) -> None:
+    """ precompute the metalink answers of a disk, for both the https and the http image """
+    scripts = centos_scripts()
+    for cmd in [centos_epel_cmd(distro, centos), centos_epel_http_cmd(distro, centos)]:
+        args = cmd[2:]  # without the python and the script path of the container
+        args[args.index("--data") + 1] = datadir
+        sh___([PYTHON, F"{scripts}/mirrors.fedoraproject.org.py"] + args + ["--makeindex"], shell=False)
+
 def centos_diskpath(distro: str = NIX, centos: str = NIX) -> str:
     rootdir = centos_dir(variant=F"{VARIANT}{DISKSUFFIX}")
     srv = F"{rootdir}/srv"
@@ -964,6 +1016,11 @@ def centos_restore() -> None:
             if path.isdir(save):
                 shutil.move(save, orig)
 
+def commit_labels(**labels: Union[str, int]) -> str:
+    """ the 'docker commit' changes for the LABELS of a repo image, which let
+        docker_mirror.py find the mirror for an image without its version tables """
+    return " ".join([F"-c 'LABEL {LABELS}.{name}=\"{value}\"'" for name, value in labels.items()])
+
 def centos_scripts() -> str:
     me = os.path.dirname(sys.argv[0]) or "."
     dn = os.path.join(me, "scripts")
@@ -1165,6 +1222,7 @@ if __name__ == "__main__":
     cmdline.add_option("-D", "--docker", metavar="EXE", default=DOCKER,   help="alternative to [%default] (e.g. podman)")
     cmdline.add_option("--rsync", metavar="EXE", default=RSYNC, help="alternative to [%default]")
     cmdline.add_option("--distropython", metavar="EXE", default=DISTROPYTHON, help="alternative to ./scripts [%default] runner")
+    cmdline.add_option("--threads", metavar="NUM", default=THREADS, help="worker threads of ./scripts in the repo image [%default]")
     cmdline.add_option("-R", "--nobase", action="store_true", default=NOBASE,
                        help="rm */base when repo image is ready [%default]")
     cmdline.add_option("--repodir", metavar="DIR", default=REPODIR,
@@ -1200,6 +1258,7 @@ if __name__ == "__main__":
     DOCKER = opt.docker
     RSYNC = opt.rsync
     DISTROPYTHON = opt.distropython
+    THREADS = int(opt.threads)
     PYTHON = opt.python
     MIRROR = opt.mirror
     CENTOS_set(opt.ver)
@@ -129,6 +129,7 @@ def docker_local_build(cmdlist: List[str] = [], cyclic: Optional[List[str]] = No
         mirroroptions.append("--universe")
     if ADDEPEL:
         mirroroptions.append("--epel")
+    mirroroptions.append(F"--lease docker_image.{os.getpid()}")  # shared mirrors are stopped by the last build
     docker = DOCKER
     dockerfile = DOCKERFILE
     tagging: str = INTO
@@ -142,6 +143,7 @@ def docker_local_build(cmdlist: List[str] = [], cyclic: Optional[List[str]] = No
     search = NIX
     refresh = NIX
     distro = NIX
+    distros: List[str] = []  # with a mirror lease
     package = NIX
     envs = BUILDENVS.copy() + BUILDARGS.copy()
     logg.info("-- %s", cmdlist)
@@ -227,6 +229,8 @@ def docker_local_build(cmdlist: List[str] = [], cyclic: Optional[List[str]] = No
             taggingbase  = os.path.basename(tagging).replace(":","-").replace(".","-")
             into = F"build-{taggingbase}"
             addhosts = output(F"{mirror} start {distro} --add-hosts --no-detect " + " ".join(mirroroptions))
+            if distro not in distros:
+                distros.append(distro)
             if ADDHOST:
                 addhosts += "".join([F"--add-host {addhost}" for addhost in ADDHOST])
             sh____(F"{docker} rm -f {into}")
@@ -379,7 +383,8 @@ def docker_local_build(cmdlist: List[str] = [], cyclic: Optional[List[str]] = No
         sx____(F"{docker} rmi {tagging}")
         sh____(F"{docker} commit {cmds} {runs} {into} {tagging}")
         sh____(F"{docker} rm -f {into}")
-    addhosts = output(F"{mirror} stop {distro} --add-hosts --no-detect")
+    for started in distros or [distro]:
+        addhosts = output(F"{mirror} stop {started} --add-hosts --no-detect " + " ".join(mirroroptions))
     return 0
 
 if __name__ == "__main__":
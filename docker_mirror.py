@@ -16,11 +16,28 @@ import re
 import json
 import logging
 import subprocess
-import tempfile
-import shutil
 import socket
+import ssl
 import time
+import http.client
+import threading
+import tarfile
+import io
+import posixpath
+import shlex
 import configparser
+import socketserver
+import bisect
+import fcntl
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from urllib.request import urlopen
+    from urllib.parse import quote
+except ImportError:  # py2
+    from urllib2 import urlopen  # type: ignore
+    from urllib import quote  # type: ignore
 
 if sys.version_info < (3,0): # pragma: nocover
     range = xrange # pylint: disable=redefined-builtin, used-before-assignment, undefined-variable
@@ -30,6 +47,7 @@ else:
 
 logg = logging.getLogger("mirror")
 IMAGESREPO = "localhost:5000/mirror-packages"
+LABELS = "com.github.gdraheim.docker-mirror"  # prefix of the labels on the repo images
 DOCKER = "docker"
 
 NODETECT = False
@@ -40,7 +58,16 @@ UNIVERSE = False
 LOCAL = False
 
 MAXWAIT = 6
+STARTS = 4  # mirrors of an image started and probed at the same time
+PROBEFIRST = 0.01  # seconds before the readiness probe is repeated, doubled up to PROBEMAX
+PROBEMAX = 0.08
+PROBETIMEOUT = 2
+PROBEHTTP = False  # ready when METRICSPATH answers, not just the port
+BACKEND = "auto"  # cli|api|auto - the engine API on its unix socket, else the DOCKER command
+APITIMEOUT = 60
 WAXWAIT = ""
+METRICSPATH = "/-/metrics"
+SHARED = "mirror-shared"  # container name for the 'shared' command
 
 BASE = {}
 BASE["8.5.2111"] = "8.5"
@@ -134,6 +161,24 @@ OPENSUSE["16.0"] = "opensuse/leap"
 
 XDG_CONFIG_HOME = os.environ.get("XDG_CONFIG_HOME", "~/.config")
 DOCKER_MIRROR_CONFIG = os.environ.get("DOCKER_MIRROR_CONFIG", os.path.join(XDG_CONFIG_HOME, "docker_mirror.ini"))
+XDG_CACHE_HOME = os.environ.get("XDG_CACHE_HOME", "~/.cache")
+DOCKER_MIRROR_CACHE = os.environ.get("DOCKER_MIRROR_CACHE", os.path.join(XDG_CACHE_HOME, "docker_mirror"))
+DETECTCACHE = 1000  # image ids with their detected base image, the oldest are dropped
+REFRESH = False  # detect again and list the repo images, ignoring the caches
+RELEASEFILES = ["os-release", "redhat-release", "centos-release"]  # in /etc
+XDG_RUNTIME_DIR = os.environ.get("XDG_RUNTIME_DIR", DOCKER_MIRROR_CACHE)
+DOCKER_MIRROR_SOCKET = os.environ.get("DOCKER_MIRROR_SOCKET", os.path.join(XDG_RUNTIME_DIR, "docker_mirror.sock"))
+LEASE = ""  # lease id for start/stop, a container is only stopped when the last lease is released
+GRACE = 0  # seconds before the container of the last released lease is stopped
+LEASEMAX = 24 * 60 * 60  # seconds, an older lease is taken to be abandoned
+DOCKER_MIRROR_LEASES = os.path.join(DOCKER_MIRROR_CACHE, "leases")
+NODAEMON = False  # do not ask a running daemon ('serve') to run the command
+DAEMONOPTIONS = ["DOCKER", "BACKEND", "IMAGESREPO", "NODETECT", "ADDHOSTS", "ADDEPEL", "UNIVERSE", "LOCAL",
+                 "PROBEHTTP", "REFRESH", "LEASE", "GRACE", "DOCKER_MIRROR_CONFIG"]  # sent along with a command
+DAEMONCOMMANDS = ["detect", "image", "repo", "from", "repos", "for", "latest", "epel", "facts", "plan", "plans",
+                  "start", "starts", "stop", "stops", "show", "shows", "info", "infos",
+                  "addhost", "add-host", "addhosts", "add-hosts", "inspect", "containers", "stats", "metrics",
+                  "shared", "share", "shares", "unshare", "unshares", "unshared"]
 
 def decodes(text):
     if text is None: return None
@@ -157,6 +202,614 @@ def output3(cmd, shell=True, debug=True):
     out, err = run.communicate()
     return decodes_(out), decodes_(err), run.returncode
 
+def docker_socket(exe="docker"):
+    """ the unix socket of the engine API, from DOCKER_HOST (or CONTAINER_HOST
+        for podman) or else the usual places of a rootful or rootless daemon """
+    host = os.environ.get("CONTAINER_HOST" if exe == "podman" else "DOCKER_HOST", "")
+    if host:
+        return host[len("unix://"):] if host.startswith("unix://") else ""
+    runtime = os.environ.get("XDG_RUNTIME_DIR", "/run/user/%i" % os.getuid())
+    if exe == "podman":
+        candidates = [os.path.join(runtime, "podman/podman.sock"), "/run/podman/podman.sock"]
+    else:
+        candidates = ["/var/run/docker.sock", os.path.join(runtime, "docker.sock")]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return ""
+
+def docker_backend(backend=None):
+    """ the DockerAPI when its socket answers, otherwise the DockerCLI. With 'auto'
+        the API is only used when DOCKER is a plain docker or podman command. """
+    backend = backend or BACKEND
+    if backend != "cli":
+        exe = os.path.basename(shlex.split(DOCKER)[-1]) if DOCKER.strip() else ""
+        socketpath = docker_socket(exe)
+        if socketpath and (backend == "api" or exe in ["docker", "podman"]):
+            api = DockerAPI(socketpath)
+            if api.ping():
+                logg.debug("using the engine API on %s", socketpath)
+                return api
+            logg.debug("no engine API on %s, using %s", socketpath, DOCKER)
+    return DockerCLI()
+
+def json_value(value, *keys):
+    """ the value at the keys of nested json objects, None when one is missing """
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+def json_text(value, *keys):
+    """ the json_value if it is a string, else an empty one """
+    found = json_value(value, *keys)
+    return found if isinstance(found, stringtypes) else ""
+def json_list(value, *keys):
+    """ the json_value if it is a list, else an empty one """
+    found = json_value(value, *keys)
+    return found if isinstance(found, list) else []
+def json_dict(value, *keys):
+    """ the json_value if it is an object, else an empty one """
+    found = json_value(value, *keys)
+    return found if isinstance(found, dict) else {}
+def json_labels(value, *keys):
+    """ the json object at the keys as strings, like the Labels of an image """
+    return {name: str(label) for name, label in json_dict(value, *keys).items()}
+
+def inspected_name(value, names):
+    """ which of the names the 'docker inspect' value is for """
+    for name in names:
+        if json_text(value, "Name").lstrip("/") == name:
+            return name
+        tags = json_list(value, "RepoTags")
+        if name in tags or name + ":latest" in tags:
+            return name
+        if len(name) >= 12 and json_text(value, "Id").replace("sha256:", "").startswith(name.replace("sha256:", "")):
+            return name
+    return None
+
+def run_config(args):
+    """ the name and the create config for the 'docker run --detach' args used here, None for others """
+    name, image, cmd, binds, mounts = "", "", [], [], []
+    autoremove, detach = False, False
+    num = 0
+    while num < len(args):
+        arg = args[num]
+        if arg in ["--rm", "--rm=true"]:
+            autoremove = True
+        elif arg in ["-d", "--detach", "--detach=true"]:
+            detach = True
+        elif arg in ["-v", "--volume", "--mount", "--name"] and num + 1 < len(args):
+            num += 1
+            if arg == "--name":
+                name = args[num]
+            elif arg == "--mount":
+                spec = dict([item.split("=", 1) for item in args[num].split(",") if "=" in item])
+                mounts.append({"Type": spec.get("type", "bind"), "Source": spec.get("source", spec.get("src", "")),
+                               "Target": spec.get("destination", spec.get("target", spec.get("dst", "")))})
+            else:
+                binds.append(args[num])
+        elif arg.startswith("-"):
+            return None
+        else:
+            image, cmd = arg, args[num + 1:]
+            break
+        num += 1
+    if not image or not detach:
+        return None
+    hostconfig = {"AutoRemove": autoremove, "Binds": binds}
+    if mounts:
+        hostconfig["Mounts"] = mounts
+    config = {"Image": image, "HostConfig": hostconfig}
+    if cmd:
+        config["Cmd"] = cmd
+    return name, config
+
+def archive_texts(data, top, names):
+    """ the texts of the named files in the tar of the directory 'top' (or of a
+        single file in it), where symlinks within 'top' are followed. A symlink
+        going elsewhere is returned as its absolute target in the second dict. """
+    texts = {}
+    links = {}
+    try:
+        tar = tarfile.open(fileobj=io.BytesIO(data))
+    except tarfile.TarError as e:
+        logg.debug("no tar of %s: %s", top, e)
+        return texts, links
+    with tar:
+        members = {}
+        for member in tar.getmembers():
+            name = member.name.strip("/")
+            if "/" in name:
+                name = name.split("/", 1)[1]
+            if name and "/" not in name:
+                members[name] = member
+        for name in names:
+            member = members.get(name)
+            for _ in range(8):
+                if member is None or not member.issym():
+                    break
+                target = posixpath.normpath(posixpath.join(top, member.linkname))
+                if posixpath.dirname(target) != top:
+                    links[name] = target
+                    member = None
+                    break
+                member = members.get(posixpath.basename(target))
+            if member is not None and member.isfile():
+                content = tar.extractfile(member)
+                if content is not None:
+                    texts[name] = decodes_(content.read())
+    return texts, links
+
+def release_image(texts):
+    """ the distro and version from the texts of the release files in /etc """
+    distro, version = "", ""
+    if "os-release" in texts:
+        # rhel:7.4 # VERSION="7.4 (Maipo)" ID="rhel" VERSION_ID="7.4"
+        # centos:7.3  # VERSION="7 (Core)" ID="centos" VERSION_ID="7"
+        # centos:7.4  # VERSION="7 (Core)" ID="centos" VERSION_ID="7"
+        # centos:7.7.1908  # VERSION="7 (Core)" ID="centos" VERSION_ID="7"
+        # opensuse:42.3 # VERSION="42.3" ID=opensuse VERSION_ID="42.3"
+        # opensuse/leap:15.0 # VERSION="15.0" ID="opensuse-leap" VERSION_ID="15.0"
+        # ubuntu:16.04 # VERSION="16.04.3 LTS (Xenial Xerus)" ID=ubuntu VERSION_ID="16.04"
+        # ubuntu:18.04 # VERSION="18.04.1 LTS (Bionic Beaver)" ID=ubuntu VERSION_ID="18.04"
+        for line in texts["os-release"].splitlines():
+            key, value = "", ""
+            m = re.match('^([_\\w]+)=([^"].*).*', line.strip())
+            if m:
+                key, value = m.group(1), m.group(2)
+            m = re.match('^([_\\w]+)="([^"]*)".*', line.strip())
+            if m:
+                key, value = m.group(1), m.group(2)
+            # logg.debug("%s => '%s' '%s'", line.strip(), key, value)
+            if key in ["ID"]:
+                distro = value.replace("-", "/")
+            if key in ["VERSION_ID"]:
+                version = value
+    if "redhat-release" in texts:
+        for line in texts["redhat-release"].splitlines():
+            m = re.search("release (\\d+[.]\\d+).*", line)
+            if m:
+                distro = "rhel"
+                version = m.group(1)
+    if "centos-release" in texts:
+        # CentOS Linux release 7.5.1804 (Core)
+        for line in texts["centos-release"].splitlines():
+            m = re.search("release (\\d+[.]\\d+).*", line)
+            if m:
+                distro = "centos"
+                version = m.group(1)
+    return distro, version
+
+class DetectCache:
+    """ image id -> the detected base image, as a json file in DOCKER_MIRROR_CACHE """
+    def __init__(self, filename=None, maxsize=None):
+        self.filename = filename or os.path.join(os.path.expanduser(DOCKER_MIRROR_CACHE), "detect.json")
+        self.maxsize = DETECTCACHE if maxsize is None else maxsize
+    def read(self):
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, OSError, ValueError) as e:
+            logg.debug("no detect cache %s: %s", self.filename, e)
+        return {}
+    def get(self, imageid):
+        detected = json_value(self.read().get(imageid), "detected")
+        if isinstance(detected, stringtypes):
+            return detected
+        return None
+    def put(self, imageid, image, detected):
+        entries = self.read()
+        entries[imageid] = {"image": image, "detected": detected, "time": int(time.time())}
+        if len(entries) > self.maxsize:
+            for old in sorted(entries, key=lambda key: int(entries[key].get("time", 0)))[:len(entries) - self.maxsize]:
+                del entries[old]
+        try:
+            cachedir = os.path.dirname(self.filename)
+            if cachedir and not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            tmpfile = "%s.%i.tmp" % (self.filename, os.getpid())
+            with open(tmpfile, "w") as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmpfile, self.filename)
+        except (IOError, OSError) as e:
+            logg.warning("can not write detect cache %s: %s", self.filename, e)
+
+class RepoCatalog:
+    """ the local {IMAGESREPO}/*-repo images and the disk sections of the config,
+        sorted by repo, major version and date for a bisect lookup. It is kept as a
+        json file in DOCKER_MIRROR_CACHE along with the time it was listed, and with
+        the LABELS of the labelled repo images that were listed at the same time. """
+    def __init__(self, filename=None):
+        self.filename = filename or os.path.join(os.path.expanduser(DOCKER_MIRROR_CACHE), "catalog.json")
+        self.source = {}  # what the entries were listed from
+        self.entries = []  # [rep, major, created, tag, image, mount]
+        self.keys = []  # (rep, major, created, tag)
+        self.labels = {}  # repository:tag -> LABELS
+    def load(self, entries, source, labels=None):
+        self.entries = sorted([list(entry) for entry in entries])
+        self.keys = [tuple(entry[:4]) for entry in self.entries]
+        self.source = source
+        self.labels = labels or {}
+    def add(self, rep, tag, image, mount=""):
+        """ an image or a disk section, where a disk replaces the image with the same tag """
+        created = tag.split(".")[-1]
+        entry = [rep, major(tag), created, tag, image, mount]
+        key = tuple(entry[:4])
+        at = bisect.bisect_left(self.keys, key)
+        if at < len(self.keys) and self.keys[at] == key:
+            if mount or not self.entries[at][5]:
+                self.entries[at] = entry
+            return
+        self.keys.insert(at, key)
+        self.entries.insert(at, entry)
+    def nearest(self, rep, version, released):
+        """ the entry with the same major version that was created at the refdate or
+            the earliest after it, else the latest before it, else None """
+        ver = major(version)
+        at = bisect.bisect_left(self.keys, (rep, ver, released))
+        if at < len(self.keys) and self.keys[at][:2] == (rep, ver):
+            return self.entries[at]
+        if at > 0 and self.keys[at - 1][:2] == (rep, ver):
+            return self.entries[at - 1]
+        return None
+    def read(self):
+        """ the time and the source of the cached catalog, or None """
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            self.load(data["entries"], data["source"], data["labels"])
+            return int(data["time"])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            logg.debug("no repo catalog %s: %s", self.filename, e)
+        return None
+    def write(self, listed):
+        try:
+            cachedir = os.path.dirname(self.filename)
+            if cachedir and not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            tmpfile = "%s.%i.tmp" % (self.filename, os.getpid())
+            with open(tmpfile, "w") as f:
+                json.dump({"time": listed, "source": self.source, "entries": self.entries, "labels": self.labels}, f, indent=1)
+            os.replace(tmpfile, self.filename)
+        except (IOError, OSError) as e:
+            logg.warning("can not write repo catalog %s: %s", self.filename, e)
+
+class MirrorLeases:
+    """ lease id -> time for each container, in a json file per container in
+        DOCKER_MIRROR_LEASES that is only changed under a flock of the container """
+    def __init__(self, directory=None):
+        self.directory = os.path.expanduser(directory or DOCKER_MIRROR_LEASES)
+    @contextlib.contextmanager
+    def locked(self, container):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(os.path.join(self.directory, container + ".lock"), "a") as lockfile:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            yield lockfile
+    def read(self, container):
+        """ the leases (without the abandoned ones) and the time of the last release """
+        try:
+            with open(os.path.join(self.directory, container + ".json")) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            data = {}
+        oldest = time.time() - LEASEMAX
+        leases = {lease: float(since) for lease, since in json_dict(data, "leases").items()
+                  if isinstance(since, (int, float)) and since > oldest}
+        released = json_value(data, "released")
+        return leases, float(released) if isinstance(released, (int, float)) else 0.
+    def write(self, container, leases, released):
+        filename = os.path.join(self.directory, container + ".json")
+        tmpfile = "%s.%i.tmp" % (filename, os.getpid())
+        with open(tmpfile, "w") as f:
+            json.dump({"leases": leases, "released": released}, f, indent=1, sort_keys=True)
+        os.replace(tmpfile, filename)
+    def acquire(self, container, lease):
+        """ returns the number of leases now """
+        with self.locked(container):
+            leases, released = self.read(container)
+            leases[lease] = time.time()
+            self.write(container, leases, released)
+            return len(leases)
+    def others(self, container, lease=""):
+        """ the number of leases other than this one """
+        with self.locked(container):
+            leases, _ = self.read(container)
+            return len([other for other in leases if other != lease])
+
+class DockerCLI:
+    """ runs the DOCKER command (docker or podman) for each operation """
+    def __init__(self, docker=None):
+        self.docker = docker or DOCKER
+        self.calls = 0  # commands run
+    def command(self, args, debug=True):
+        self.calls += 1
+        return output3(shlex.split(self.docker) + list(args), shell=False, debug=debug)
+    def inspect(self, names, kind=""):
+        """ name -> the 'docker inspect' value or None, for all names in one call """
+        found = OrderedDict([(name, None) for name in names])
+        if not names:
+            return found
+        out, err, rc = self.command(["inspect"] + (["--type", kind] if kind else []) + list(names))
+        if rc:
+            logg.debug("inspect %s : %s", " ".join(names), err.strip())
+        try:
+            values = json.loads(out) if out.strip() else []
+        except ValueError:
+            values = []
+        for num, value in enumerate(values or []):
+            name = inspected_name(value, names)
+            if not name and len(values) == len(names):
+                name = names[num]
+            if name:
+                found[name] = value
+        return found
+    def remove(self, name):
+        out, err, rc = self.command(["rm", "--force", name])
+        if rc:
+            logg.debug("rm --force %s : %s", name, err.strip())
+        return not rc
+    def create(self, name, image):
+        """ an empty string, or else the error """
+        out, err, rc = self.command(["create", "--name=" + name, image])
+        return err.strip() or "failed" if rc else ""
+    def run(self, args):
+        return self.command(["run"] + list(args))
+    def archive(self, name, path, debug=True):
+        """ the tar of 'docker cp' to stdout, and an empty string or else the error """
+        cmd = shlex.split(self.docker) + ["cp", name + ":" + path, "-"]
+        self.calls += 1
+        if debug: logg.debug("run: %s", " ".join(["'%s'" % item for item in cmd]))
+        try:
+            run = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            return None, str(e)
+        out, err = run.communicate()
+        if run.returncode:
+            return None, decodes_(err).strip() or "failed"
+        return out, ""
+    def image_tags(self, reference=""):
+        """ repository:tag of the local images (matching the reference pattern), None on errors """
+        filters = ["--filter", "reference=" + reference] if reference else []
+        out, err, rc = self.command(["images", "--format", "{{.Repository}}:{{.Tag}}"] + filters)
+        if rc:
+            logg.error("docker images [%s]\n\t%s", rc, err)
+            return None
+        return [line.strip() for line in out.split("\n") if line.strip()]
+    def labelled_images(self, label):
+        """ repository:tag -> the labels, of the local images having the label (None on errors) """
+        out, err, rc = self.command(["images", "--filter", "label=" + label, "--format", "{{.Repository}}:{{.Tag}}"])
+        if rc:
+            logg.debug("images label=%s : %s", label, err.strip())
+            return None
+        names = [line.strip() for line in out.split("\n") if line.strip() and not line.strip().endswith(":<none>")]
+        found = OrderedDict()
+        for name, value in self.inspect(names, "image").items():
+            if value:
+                found[name] = json_labels(value, "Config", "Labels")
+        return found
+    def events(self, kinds):
+        """ the decoded events of these types as they happen, until 'docker events' ends """
+        filters = []
+        for kind in kinds:
+            filters += ["--filter", "type=" + kind]
+        cmd = shlex.split(self.docker) + ["events", "--format", "{{json .}}"] + filters
+        logg.debug("run: %s", " ".join(["'%s'" % item for item in cmd]))
+        run = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        try:
+            for line in run.stdout or []:
+                try:
+                    yield json.loads(decodes_(line))
+                except ValueError:
+                    continue
+        finally:
+            run.kill()
+            run.wait()
+    def image_events(self, since, until):
+        """ the number of image events (pull, tag, delete...) in the time range, None on errors """
+        out, err, rc = self.command(["events", "--since", str(since), "--until", str(until),
+                                     "--filter", "type=image", "--format", "{{.Action}}"])
+        if rc:
+            logg.debug("events : %s", err.strip())
+            return None
+        return len([line for line in out.split("\n") if line.strip()])
+    def container_names(self, name):
+        """ the names of all containers (even stopped ones) matching the name filter """
+        out, err, rc = self.command(["ps", "--all", "--format", "{{.Names}}", "--filter", "name=" + name])
+        return out.split()
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socketpath, timeout=APITIMEOUT):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socketpath = socketpath
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socketpath)
+        self.sock = sock
+
+class DockerAPI:
+    """ the docker (or podman) engine API on its unix socket, with a kept-alive
+        connection per thread. When the API fails, the DockerCLI is used instead. """
+    def __init__(self, socketpath, docker=None):
+        self.socketpath = socketpath
+        self.local = threading.local()
+        self.fallback = DockerCLI(docker)
+        self.calls = 0  # requests sent
+    def request(self, method, url, body=None, decode=True):
+        """ the http status and the content, which is decoded when it is json """
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        self.calls += 1
+        for attempt in range(2):
+            conn = getattr(self.local, "conn", None)
+            reused = conn is not None
+            if conn is None:
+                conn = UnixHTTPConnection(self.socketpath)
+                self.local.conn = conn
+            try:
+                logg.debug("api: %s %s", method, url)
+                conn.request(method, url, data, headers)
+                resp = conn.getresponse()
+                content = resp.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self.local.conn = None
+                if attempt or not reused or method not in ["GET", "DELETE"]:
+                    raise
+                continue  # the daemon had closed the kept-alive connection
+            if resp.will_close:
+                conn.close()
+                self.local.conn = None
+            if decode and "json" in (resp.getheader("Content-Type") or "") and content:
+                return resp.status, json.loads(decodes_(content))
+            return resp.status, content
+        raise http.client.HTTPException("no response")
+    def ping(self):
+        try:
+            status, content = self.request("GET", "/_ping")
+            return status == 200
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            logg.debug("api ping %s : %s", self.socketpath, e)
+            return False
+    def message(self, status, content):
+        if isinstance(content, dict) and content.get("message"):
+            return str(content["message"])
+        return "status %s" % status
+    def inspect(self, names, kind=""):
+        """ name -> the inspect value or None. Unlike the one 'docker inspect' of the
+            cli backend this is a request per name (two when the kind is not given,
+            container then image), as the engine API has no batch inspect and the
+            /containers/json and /images/json listings have less than the inspect
+            value. The requests go over the one kept-alive connection. """
+        found = OrderedDict()
+        try:
+            for name in names:
+                found[name] = None
+                for path in (["/%ss/" % kind] if kind else ["/containers/", "/images/"]):
+                    status, content = self.request("GET", path + quote(name, safe="/:@") + "/json")
+                    if status == 200 and isinstance(content, dict):
+                        found[name] = content
+                        break
+            return found
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            logg.warning("api: %s, using %s", e, self.fallback.docker)
+            return self.fallback.inspect(names, kind)
+    def remove(self, name):
+        try:
+            status, content = self.request("DELETE", "/containers/%s?force=1" % quote(name, safe=""))
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            logg.warning("api: %s, using %s", e, self.fallback.docker)
+            return self.fallback.remove(name)
+        if status >= 300:
+            logg.debug("rm --force %s : %s", name, self.message(status, content))
+        return status < 300
+    def create_container(self, name, config):
+        """ the id of the new container and an empty string, or else the error """
+        try:
+            status, content = self.request("POST", "/containers/create?name=%s" % quote(name, safe=""), config)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return "", str(e) or e.__class__.__name__
+        if status != 201 or not isinstance(content, dict):
+            return "", self.message(status, content)
+        return content.get("Id", ""), ""
+    def create(self, name, image):
+        cid, error = self.create_container(name, {"Image": image})
+        if error:
+            logg.debug("api: create %s : %s, using %s", name, error, self.fallback.docker)
+            return self.fallback.create(name, image)  # it may need to pull the image
+        return ""
+    def run(self, args):
+        parsed = run_config(args)
+        if not parsed:
+            return self.fallback.run(args)
+        name, config = parsed
+        cid, error = self.create_container(name, config)
+        if error:
+            logg.debug("api: create %s : %s, using %s", name, error, self.fallback.docker)
+            return self.fallback.run(args)
+        try:
+            status, content = self.request("POST", "/containers/%s/start" % cid)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return "", str(e) or e.__class__.__name__, 1
+        if status >= 300:
+            return "", self.message(status, content), 1
+        return cid, "", 0
+    def archive(self, name, path, debug=True):
+        """ the tar of the archive endpoint, and an empty string or else the error """
+        try:
+            status, content = self.request("GET", "/containers/%s/archive?path=%s" % (quote(name, safe=""), quote(path, safe="")))
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return self.fallback.archive(name, path, debug)
+        if status != 200 or not isinstance(content, bytes):
+            return None, self.message(status, content)
+        return content, ""
+    def image_tags(self, reference=""):
+        filters = "?filters=" + quote(json.dumps({"reference": [reference]}), safe="") if reference else ""
+        try:
+            status, content = self.request("GET", "/images/json" + filters)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return self.fallback.image_tags(reference)
+        if status != 200:
+            logg.error("api images : %s", self.message(status, content))
+            return None
+        return [str(tag) for image in json_list(content) for tag in json_list(image, "RepoTags") if tag != "<none>:<none>"]
+    def labelled_images(self, label):
+        filters = quote(json.dumps({"label": [label]}), safe="")
+        try:
+            status, content = self.request("GET", "/images/json?filters=" + filters)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return self.fallback.labelled_images(label)
+        if status != 200:
+            logg.debug("api images label=%s : %s", label, self.message(status, content))
+            return None
+        found = OrderedDict()
+        for image in json_list(content):
+            for tag in json_list(image, "RepoTags"):
+                if tag != "<none>:<none>":
+                    found[str(tag)] = json_labels(image, "Labels")
+        return found
+    def events(self, kinds):
+        conn = UnixHTTPConnection(self.socketpath, timeout=None)
+        try:
+            conn.request("GET", "/events?filters=%s" % quote(json.dumps({"type": list(kinds)}), safe=""))
+            resp = conn.getresponse()
+            if resp.status != 200:
+                logg.debug("api events : status %s", resp.status)
+                return
+            while True:
+                line = resp.readline()
+                if not line:
+                    break
+                try:
+                    yield json.loads(decodes_(line))
+                except ValueError:
+                    continue
+        finally:
+            conn.close()
+    def image_events(self, since, until):
+        filters = quote(json.dumps({"type": ["image"]}), safe="")
+        try:
+            status, content = self.request("GET", "/events?since=%s&until=%s&filters=%s" % (since, until, filters), decode=False)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return self.fallback.image_events(since, until)
+        if status != 200 or not isinstance(content, bytes):
+            logg.debug("api events : %s", self.message(status, content))
+            return None
+        return len([line for line in decodes_(content).split("\n") if line.strip()])
+    def container_names(self, name):
+        filters = quote(json.dumps({"name": [name]}), safe="")
+        try:
+            status, content = self.request("GET", "/containers/json?all=1&filters=%s" % filters)
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            return self.fallback.container_names(name)
+        if status != 200:
+            return []
+        return [str(found).lstrip("/") for container in json_list(content) for found in json_list(container, "Names")]
+
 def major(version):
     if len(version) > 2:
         if version[1] == ".":
@@ -177,6 +830,69 @@ def onlyversion(image):
         return image.split(":")[-1]
     return image
 
+def parse_metrics(text):
+    """ the prometheus text of a mirror script as {prefix: {name: value}}
+        where the unlabeled values like 'inflight' are under prefix '*' """
+    names = {"mirror_requests_total": "requests", "mirror_bytes_total": "bytes",
+             "mirror_notfound_total": "notfound", "mirror_inflight_requests": "inflight"}
+    quantiles = {"0.5": "p50", "0.99": "p99"}
+    found = OrderedDict()
+    for line in text.splitlines():
+        m = re.match(r"(mirror_\w+)(?:[{](.*)[}])?\s+(\S+)$", line)
+        if not m:
+            continue
+        name, labels, value = m.groups()
+        labelled = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or ""))
+        key = names.get(name)
+        if name == "mirror_request_seconds":
+            key = quantiles.get(labelled.get("quantile", ""))
+        if key:
+            prefix = labelled.get("prefix", "*")
+            found.setdefault(prefix, {})[key] = float(value)
+    return found
+def stats_table(stats):
+    """ the metrics of the mirror containers as one text table """
+    width = max([len("CONTAINER")] + [len(name) for name in stats])
+    fmt = "%-{width}s %-24s %9s %12s %6s %8s %8s".format(**locals())
+    lines = [fmt % ("CONTAINER", "PREFIX", "REQUESTS", "BYTES", "404", "P50MS", "P99MS")]
+    for name, metrics in stats.items():
+        if metrics is None:
+            lines.append(fmt % (name, "(no metrics)", "", "", "", "", ""))
+            continue
+        for prefix, values in metrics.items():
+            if prefix == "*":
+                continue
+            lines.append(fmt % (name, prefix, "%i" % values.get("requests", 0), "%i" % values.get("bytes", 0),
+                                "%i" % values.get("notfound", 0), "%.1f" % (values.get("p50", 0) * 1000),
+                                "%.1f" % (values.get("p99", 0) * 1000)))
+        inflight = metrics.get("*", {}).get("inflight", 0)
+        lines.append(fmt % (name, "(in flight)", "%i" % inflight, "", "", "", ""))
+    return "\n".join([line.rstrip() for line in lines])
+
+def exposed_ports(config):
+    """ the tcp ports in the ExposedPorts of a 'docker inspect' Config """
+    ports = []
+    for spec in json_dict(config, "ExposedPorts"):
+        port, _, proto = spec.partition("/")
+        if proto in ["", "tcp"] and port.isdigit():
+            ports.append(int(port))
+    return sorted(ports)
+
+def shared_groups(mirrors):
+    """ split the mirrors so that no hostname is used twice in a group, as one
+        shared container can only answer for a hostname once (like mirrorlist.centos.org
+        for two centos versions). Usually there is only one group. """
+    groups = []
+    for mirror in mirrors:
+        for group in groups:
+            used = [host for member in group for host in member.hosts]
+            if not [host for host in mirror.hosts if host in used]:
+                group.append(mirror)
+                break
+        else:
+            groups.append([mirror])
+    return groups
+
 class DockerMirror:
     def __init__(self, cname, image, hosts, mount=""):
         self.cname = cname  # name of running container
@@ -186,9 +902,105 @@ class DockerMirror:
     def __str__(self):
         return "(cname='%s',image='%s',hosts=%s,mount='%s')" % (self.cname, self.image, self.hosts, self.mount)
 
-class DockerMirrorPackagesRepo:
+class MirrorPlan:
+    """ the mirrors of an image, as resolved once from the version tables, the
+        epel images and the DOCKER_MIRROR_CONFIG overrides """
+    def __init__(self, image, version, mirrors):
+        self.image = image  # the detected image
+        self.version = version  # the latest version for the image
+        self.mirrors = mirrors  # the DockerMirror list
+    def __str__(self):
+        return "(image='%s',version='%s',mirrors=[%s])" % (self.image, self.version, ",".join([str(mirror) for mirror in self.mirrors]))
+    def data(self):
+        return {"image": self.image, "version": self.version,
+                "mirrors": [{"name": mirror.cname, "image": mirror.image, "hosts": mirror.hosts, "mount": mirror.mount}
+                            for mirror in self.mirrors]}
+
+class DockerMirrorPackagesRepo:  # pylint: disable=too-many-instance-attributes
     def __init__(self, image=None):
         self._image = image
+        self._ports = {}  # container name -> exposed ports of its image
+        self._docker = None  # the backend, see docker_backend()
+        self._docker_lock = threading.Lock()
+        self._config = None  # (filename, parsed DOCKER_MIRROR_CONFIG)
+        self._configreads = 0
+        self._plans = {}  # image -> MirrorPlan
+        self._catalog = None  # the RepoCatalog, loaded once
+        self._labelled = None  # repository:tag -> LABELS of the repo images, listed once
+        self._leases = MirrorLeases()
+        self.background = False  # the GRACE wait in a thread (for the daemon) instead of a forked process
+    def docker(self):
+        with self._docker_lock:
+            if self._docker is None:
+                self._docker = docker_backend()
+            return self._docker
+    def forget(self):
+        """ drop what was resolved, the next command will look at the config and images again """
+        self._config = None
+        self._plans = {}
+        self._catalog = None
+        self._labelled = None
+    def config(self):
+        """ the DOCKER_MIRROR_CONFIG, parsed once """
+        configfile = os.path.expanduser(DOCKER_MIRROR_CONFIG)
+        if self._config is None or self._config[0] != configfile:
+            config = configparser.ConfigParser()
+            if os.path.exists(configfile):
+                config.read(configfile)
+                self._configreads += 1
+            self._config = (configfile, config)
+        return self._config[1]
+    def catalog(self):
+        """ the RepoCatalog from the cache, unless there were image events since it
+            was listed or the config was changed """
+        if self._catalog is not None:
+            return self._catalog
+        configfile = os.path.expanduser(DOCKER_MIRROR_CONFIG)
+        source = {"imagesrepo": IMAGESREPO, "config": configfile,
+                  "mtime": os.path.getmtime(configfile) if os.path.exists(configfile) else 0}
+        catalog = RepoCatalog()
+        now = int(time.time())
+        listed = catalog.read() if not REFRESH else None
+        if listed is not None and catalog.source == source:
+            if self.docker().image_events(listed, now) == 0:
+                logg.debug("repo catalog from %s", catalog.filename)
+                self._catalog = catalog
+                return catalog
+        catalog.load([], source)
+        tags = self.docker().image_tags(IMAGESREPO + "/*-repo")
+        for line in tags or []:
+            name, tag = line.rsplit(":", 1)
+            if name.startswith(IMAGESREPO + "/") and name.endswith("-repo"):
+                catalog.add(name.rsplit("/", 1)[-1], tag, line)
+        config = self.config()
+        for sec in config.sections():
+            if sec.count(":") == 1 and sec.split(":")[0].endswith("-repo") and "mount" in config[sec]:
+                rep, tag = sec.split(":")
+                catalog.add(rep, tag, config[sec].get("image", ""), config[sec]["mount"])
+        prefix = LABELS + "."
+        labelled = self.docker().labelled_images(prefix + "distro")
+        for name, labels in (labelled or {}).items():
+            catalog.labels[name] = {key: value for key, value in labels.items() if key.startswith(prefix)}
+        if tags is not None and labelled is not None:
+            catalog.write(now)
+        self._catalog = catalog
+        return catalog
+    def labelled(self):
+        """ the labels of the repo images (without the LABELS prefix), listed along
+            with the catalog, so that they are only listed again after image events """
+        if self._labelled is None:
+            prefix = LABELS + "."
+            self._labelled = OrderedDict()
+            for name, labels in self.catalog().labels.items():
+                self._labelled[name] = {key[len(prefix):]: value for key, value in labels.items() if key.startswith(prefix)}
+        return self._labelled
+    def calls(self):
+        """ the config reads and the docker calls so far """
+        docker = self._docker
+        calls = docker.calls if docker is not None else 0
+        if isinstance(docker, DockerAPI):
+            calls += docker.fallback.calls
+        return self._configreads, calls
     def host_system_image(self):
         """ returns the docker image name which corresponds to the 
             operating system distribution of the host system. This
@@ -199,98 +1011,74 @@ class DockerMirrorPackagesRepo:
             return "%s:%s" % (distro, version)
         return ""
     def detect_etc_image(self, etc):
-        distro, version = "", ""
-        os_release = os.path.join(etc, "os-release")
-        if os.path.exists(os_release):
-            # rhel:7.4 # VERSION="7.4 (Maipo)" ID="rhel" VERSION_ID="7.4"
-            # centos:7.3  # VERSION="7 (Core)" ID="centos" VERSION_ID="7"
-            # centos:7.4  # VERSION="7 (Core)" ID="centos" VERSION_ID="7"
-            # centos:7.7.1908  # VERSION="7 (Core)" ID="centos" VERSION_ID="7"
-            # opensuse:42.3 # VERSION="42.3" ID=opensuse VERSION_ID="42.3"
-            # opensuse/leap:15.0 # VERSION="15.0" ID="opensuse-leap" VERSION_ID="15.0"
-            # ubuntu:16.04 # VERSION="16.04.3 LTS (Xenial Xerus)" ID=ubuntu VERSION_ID="16.04"
-            # ubuntu:18.04 # VERSION="18.04.1 LTS (Bionic Beaver)" ID=ubuntu VERSION_ID="18.04"
-            for line in open(os_release):
-                key, value = "", ""
-                m = re.match('^([_\\w]+)=([^"].*).*', line.strip())
-                if m:
-                    key, value = m.group(1), m.group(2)
-                m = re.match('^([_\\w]+)="([^"]*)".*', line.strip())
-                if m:
-                    key, value = m.group(1), m.group(2)
-                # logg.debug("%s => '%s' '%s'", line.strip(), key, value)
-                if key in ["ID"]:
-                    distro = value.replace("-", "/")
-                if key in ["VERSION_ID"]:
-                    version = value
-        redhat_release = os.path.join(etc, "redhat-release")
-        if os.path.exists(redhat_release):
-            for line in open(redhat_release):
-                m = re.search("release (\\d+[.]\\d+).*", line)
-                if m:
-                    distro = "rhel"
-                    version = m.group(1)
-        centos_release = os.path.join(etc, "centos-release")
-        if os.path.exists(centos_release):
-            # CentOS Linux release 7.5.1804 (Core)
-            for line in open(centos_release):
-                m = re.search("release (\\d+[.]\\d+).*", line)
-                if m:
-                    distro = "centos"
-                    version = m.group(1)
-        return distro, version
+        texts = {}
+        for name in RELEASEFILES:
+            filename = os.path.join(etc, name)
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    texts[name] = f.read()
+        return release_image(texts)
     def detect_base_image(self, image):
         """ returns the docker image name which corresponds to the 
             operating system distribution of the image provided. This
             image name is the key for the other mirror functions. """
-        docker = DOCKER
         distro, version = "", ""
+        cache = DetectCache()
+        imageid = self.image_id(image)
+        if imageid and not REFRESH:
+            detected = cache.get(imageid)
+            if detected:
+                logg.info(":%s base image cached for %s", detected, imageid)
+                return detected
         cname = "docker_mirror_detect." + os.path.basename(image).replace(":", ".")
-        cmd = "{docker} rm -f {cname}"
-        out, err, end = output3(cmd.format(**locals()))
-        cmd = "{docker} create --name={cname} {image}"
-        out, err, end = output3(cmd.format(**locals()))
-        if end:
-            logg.info("%s --name %s : %s", image, cname, err.strip())
-        tempdir = tempfile.mkdtemp("docker_mirror_detect")
+        self.docker().remove(cname)
+        err = self.docker().create(cname, image)
+        if err:
+            logg.info("%s --name %s : %s", image, cname, err)
         try:
-            distro, version = self.detect_base_image_from(cname, tempdir)
+            distro, version = self.detect_base_image_from(cname)
             logg.info(":%s:%s base image detected", distro, version)
             if distro and version:
+                imageid = imageid or self.image_id(image)  # it was pulled by create
+                if imageid:
+                    cache.put(imageid, image, "%s:%s" % (distro, version))
                 return "%s:%s" % (distro, version)
         finally:
-            shutil.rmtree(tempdir)
-            cmd = "{docker} rm {cname}"
-            out, err, end = output3(cmd.format(**locals()))
+            self.docker().remove(cname)
         return image
-    def detect_base_image_from(self, cname, tempdir):
-        debug = False
-        docker = DOCKER
-        cmd = "{docker} cp {cname}:/usr/lib/os-release {tempdir}/os-release"
-        out, err, end = output3(cmd.format(**locals()), debug=debug)
-        if not end:
-            logg.debug("get: /usr/lib/os-release copied")
-        else:
-            logg.debug("get: /usr/lib/os-release: %s", err.strip().replace(cname, "{cname}"))
-            cmd = "{docker} cp {cname}:/etc/os-release {tempdir}/os-release"
-            out, err, end = output3(cmd.format(**locals()), debug=debug)
-            if not end:
-                logg.debug("get: /etc/os-release copied")
-            else:
-                logg.debug("get: /etc/os-release: %s", err.strip().replace(cname, "{cname}"))
-        cmd = "{docker} cp {cname}:/etc/redhat-release {tempdir}/redhat-release"
-        out, err, end = output3(cmd.format(**locals()), debug=debug)
-        if not end:
-            logg.debug("get: /etc/redhat-release copied")
-        else:
-            logg.debug("get: /etc/redhat-release: %s", err.strip().replace(cname, "{cname}"))
-        cmd = "{docker} cp {cname}:/etc/centos-release {tempdir}/centos-release"
-        out, err, end = output3(cmd.format(**locals()), debug=debug)
-        if not end:
-            logg.debug("get: /etc/centos-release copied")
-        else:
-            logg.debug("get: /etc/centos-release: %s", err.strip().replace(cname, "{cname}"))
-        return self.detect_etc_image(tempdir)
+    def image_id(self, image):
+        """ the content id of a local image, empty if it is not there """
+        found = self.docker().inspect([image], "image")[image]
+        if found:
+            return json_text(found, "Id")
+        return ""
+    def detect_base_image_from(self, cname):
+        """ the release files from one tar stream of /etc in the created container,
+            parsed in memory. Only a symlink to another directory (like os-release
+            to /usr/lib/os-release) needs another archive of that file. """
+        docker = self.docker()
+        data, err = docker.archive(cname, "/etc", debug=False)
+        if err:
+            logg.debug("get: /etc: %s", err.replace(cname, "{cname}"))
+            data = None
+        texts, links = archive_texts(data, "/etc", RELEASEFILES) if data else ({}, {})
+        if not data or "os-release" not in texts and "os-release" not in links:
+            links["os-release"] = "/usr/lib/os-release"
+        for name, target in links.items():
+            for _ in range(4):
+                data, err = docker.archive(cname, target, debug=False)
+                if err or data is None:
+                    logg.debug("get: %s: %s", target, err.replace(cname, "{cname}"))
+                    break
+                found, more = archive_texts(data, posixpath.dirname(target), [posixpath.basename(target)])
+                if posixpath.basename(target) in found:
+                    texts[name] = found[posixpath.basename(target)]
+                    break
+                if posixpath.basename(target) not in more:
+                    break
+                target = more[posixpath.basename(target)]
+        logg.debug("get: %s", " ".join(sorted(texts)))
+        return release_image(texts)
     def get_docker_latest_image(self, image):
         """ converts a shorthand version into the version string used on an image name. """
         if not image:
@@ -356,14 +1144,19 @@ class DockerMirrorPackagesRepo:
             Effectivly when it is required to 'docker start centos:x.y' then do
             'docker start centos-repo:x.y' before and extend the original to 
             'docker start --add-host mirror...:centos-repo centos:x.y'. """
+        return list(self.plan(image).mirrors)
+    def plan(self, image):
+        """ the MirrorPlan of the image, resolved once for start/stop/info/addhosts """
+        if image not in self._plans:
+            self._plans[image] = MirrorPlan(image or "", self.get_docker_latest_version(image),
+                                            self.resolve_docker_mirrors(image))
+        return self._plans[image]
+    def resolve_docker_mirrors(self, image):
         logg.info("mirrors for %s", image)
         mirrors = []
         if not image:
             return mirrors
-        config = configparser.ConfigParser()
-        configfile = os.path.expanduser(DOCKER_MIRROR_CONFIG)
-        if os.path.exists(configfile):
-            config.read(configfile)
+        config = self.config()
         if image.startswith("centos:"):
             mirrors = self.get_centos_docker_mirrors(image)
             if ADDEPEL:
@@ -380,6 +1173,10 @@ class DockerMirrorPackagesRepo:
             mirrors = self.get_ubuntu_docker_mirrors(image)
         if image.startswith("debian:"):
             mirrors = self.get_debian_docker_mirrors(image)
+        labelled = self.get_labelled_docker_mirror(image)
+        if labelled:
+            logg.info("labelled image %s for %s", labelled.image, image)
+            mirrors = [labelled] + mirrors[1:]
         if ":" in image:
             if image in config.sections():
                 cname1 = config[image].get("cname", "")
@@ -404,6 +1201,30 @@ class DockerMirrorPackagesRepo:
                     mirrors = [DockerMirror(self.containername(image1), image1, hosts1)]
         logg.info("     mirrors for %s -> %s", image, " ".join([mirror.cname for mirror in mirrors]))
         return mirrors
+    def get_labelled_docker_mirror(self, image):
+        """ the local repo image whose labels say that it serves the image, where the
+            exact base image is preferred over the same major.minor version """
+        if ":" not in image:
+            return None
+        name, version = image.split(":", 1)
+        layer = "updates" if UPDATES else "universe" if UNIVERSE else ""
+        found, best = None, None
+        for tag, labels in self.labelled().items():
+            repository = tag.rsplit(":", 1)[0]
+            if not repository.startswith(IMAGESREPO + "/"):
+                continue
+            if not repository.endswith("-repo/" + layer if layer else "-repo"):
+                continue
+            basename, _, baseversion = labels.get("baseimage", "").partition(":")
+            if basename != name or labels.get("distro") != name.split("/")[0]:
+                continue
+            if baseversion != version and majorminor(baseversion) != majorminor(version):
+                continue
+            rank = (baseversion == version, labels.get("version", ""))
+            if best is None or rank > best:
+                hosts = [host.strip() for host in labels.get("hosts", "").split(",") if host.strip()]
+                found, best = DockerMirror(self.containername(tag), tag, hosts), rank
+        return found
     def get_ubuntu_latest(self, image, default=None):
         if image.startswith("ubuntu:"):
             distro = "ubuntu"
@@ -637,128 +1458,181 @@ class DockerMirrorPackagesRepo:
             logg.error("can not get epel refdate from %s", version)
             raise ValueError("can not get epel refdate")
         logg.debug("      detected %s -> epel refdate %s", version, released)
-        later = ""
-        before = ""
-        epelimages = self.get_epel_docker_mirror_images(rep)
-        diskrepos = self.get_epel_docker_mirror_disks(rep, "mirrors.fedoraproject.org")
-        epelrepos = epelimages + list(diskrepos.keys())
-        logg.debug("[%s] select %s from images %s", rep, released, epelrepos)
-        for epelrepo in epelrepos:
-            tagline = re.sub(".*:", "", epelrepo)
-            tagname = re.sub(" .*", "", tagline)
-            created = tagname.split(".")[-1]
-            accepts = tagname.startswith(major(version))
-            logg.debug(": %s (%s) (%s) %s:%s", epelrepo, created, released, major(version), accepts and "x" or "ignore")
-            if created >= released and accepts:
-                if not later or later > tagname:
-                    later = tagname
-            elif created < released and accepts:
-                if not before or before < tagname:
-                    before = tagname
-        if later:
-            ver = later
-        elif before:
-            ver = before
+        found = self.catalog().nearest(rep, version, released)
+        if found:
+            ver = found[3]
         logg.debug("image ver %s <- epel refdate %s", ver, released)
         mirror = self.docker_mirror(rmi, rep, ver, "mirrors.fedoraproject.org")
-        if F"{rep}:{ver}" in diskrepos:
-            mirror = diskrepos[ F"{rep}:{ver}"]
+        if found and found[5]:
+            mirror = DockerMirror(F"{rep}-{ver}", found[4], ["mirrors.fedoraproject.org"], found[5])
             logg.info("replace %s:%s by disk %s", rep, ver, mirror.mount)
         return mirror
     def get_epel_docker_mirror_images(self, rep):
-        docker = DOCKER
-        rmi = IMAGESREPO
-        cmd = docker + " images --format '{{.Repository}}:{{.Tag}}'"
-        out, err, end = output3(cmd)
-        if end:
-            logg.error("docker images [%s]\n\t%s", end, cmd)
-            return []
-        found = []
-        for line in out.split("\n"):
-            if not line.startswith(rmi):
-                continue
-            if F"/{rep}:" not in line:
-                continue
-            found.append(line.rstrip())
-        return found
+        return [entry[4] for entry in self.catalog().entries if entry[0] == rep and not entry[5]]
     def get_epel_docker_mirror_disks(self, rep, *hosts):
         rep = rep or "epel-repo"
         found = {}
-        config = configparser.ConfigParser()
-        configfile = os.path.expanduser(DOCKER_MIRROR_CONFIG)
-        if os.path.exists(configfile):
-            config.read(configfile)
-        for sec in config.sections():
-            if sec.startswith(rep+":"):
-                cname = sec.replace(":","-")
-                mirror = DockerMirror(cname, config[sec]["image"], list(hosts), config[sec]["mount"])
-                logg.info("found epel disk %s", mirror)
-                found[sec] = mirror
+        for entry in self.catalog().entries:
+            if entry[0] == rep and entry[5]:
+                found[F"{rep}:{entry[3]}"] = DockerMirror(F"{rep}-{entry[3]}", entry[4], list(hosts), entry[5])
         return found
 
     #
     def ip_container(self, name):
-        docker = DOCKER
-        cmd = "{docker} inspect {name}"
-        out, err, rc = output3(cmd.format(**locals()))
-        if rc:
-            logg.info("%s : %s", cmd, err)
-            logg.debug("no addr for %s", name)
-            return None
-        values = json.loads(out)
-        if not values or "NetworkSettings" not in values[0]:
-            logg.critical(" docker inspect %s => %s ", name, values)
-        addr = values[0]["NetworkSettings"]["IPAddress"]
-        assert isinstance(addr, stringtypes)
-        logg.debug("::::                %s -> %s", name, addr)
-        return addr
+        return self.ip_containers([name])[name]
+    def ip_containers(self, names):
+        """ the addresses of the containers, from one batch inspect """
+        done = OrderedDict()
+        for name, value in self.docker().inspect(names, "container").items():
+            if not value:
+                logg.debug("no addr for %s", name)
+                done[name] = None
+                continue
+            if "NetworkSettings" not in value:
+                logg.critical(" docker inspect %s => %s ", name, value)
+            addr = json_value(value, "NetworkSettings", "IPAddress")
+            assert isinstance(addr, stringtypes)
+            logg.debug("::::                %s -> %s", name, addr)
+            done[name] = addr
+        return done
     def start_containers(self, image):
         mirrors = self.get_docker_mirrors(image)
         done = {}
-        for mirror in mirrors:
-            logg.debug(" START --name %s %s [%s]", mirror.cname, mirror.image, mirror.mount)
-            addr = self.start_container(mirror.image, mirror.cname, mirror.mount)
+        if not mirrors:
+            return done
+        if LEASE:
+            for mirror in mirrors:
+                leases = self._leases.acquire(mirror.cname, LEASE)
+                logg.debug(" LEASE %s for %s (%i leases)", LEASE, mirror.cname, leases)
+        with ThreadPoolExecutor(max(1, min(STARTS, len(mirrors)))) as pool:
+            addrs = list(pool.map(self.start_mirror, mirrors))
+        for mirror, addr in zip(mirrors, addrs):
             done[mirror.cname] = addr
         return done
+    def start_mirror(self, mirror):
+        started = time.monotonic()
+        logg.debug(" START --name %s %s [%s]", mirror.cname, mirror.image, mirror.mount)
+        addr = self.start_container(mirror.image, mirror.cname, mirror.mount)
+        logg.debug(" START --name %s took %3.3f sec", mirror.cname, time.monotonic() - started)
+        return addr
     def start_container(self, image, container, mount):
-        docker = DOCKER
-        cmd = "{docker} inspect {image}"
-        out, err, ok = output3(cmd.format(**locals()))
-        image_found = json.loads(out)
+        docker = self.docker()
+        image_found = docker.inspect([image], "image")[image]
         if not image_found:
             logg.info("    image not found: %s", image)
             return None
-        cmd = "{docker} inspect {container}"
-        out, err, rc = output3(cmd.format(**locals()))
-        container_found = json.loads(out)
-        if not rc and container_found:
-            container_status = container_found[0]["State"]["Status"]
+        self._ports[container] = exposed_ports(image_found.get("Config"))
+        container_found = docker.inspect([container], "container")[container]
+        if container_found:
+            container_status = json_value(container_found, "State", "Status")
             logg.debug("::::                %s -> %s", container, container_status)
-            latest_image_id = image_found[0]["Id"]
-            container_image_id = container_found[0]["Image"]
-            if latest_image_id != container_image_id or container_status not in ["running"]:
-                cmd = "{docker} rm --force {container}"
-                out, err, rc = output3(cmd.format(**locals()))
-                if rc:
-                    logg.debug("%s : %s", cmd, err)
-                container_found = []
+            latest_image_id = image_found["Id"]
+            container_image_id = container_found["Image"]
+            if latest_image_id != container_image_id and container_status in ["running"] and self._leases.others(container, LEASE):
+                logg.warning("keeping %s with an older image, it is leased by other builds", container)
+            elif latest_image_id != container_image_id or container_status not in ["running"]:
+                docker.remove(container)
+                container_found = None
         if not container_found:
-            cmd = "{docker} run --rm=true --detach"
+            run = ["--rm=true", "--detach"]
             if mount and os.path.isdir(mount):
-                cmd += " -v {mount}:/srv/repo"
+                run += ["-v", F"{mount}:/srv/repo"]
             elif mount:
                 logg.warning("no such volume %s", mount)
             else:
                 logg.debug("no extra volume given")
-            cmd += " --name {container} {image}"
-            out, err, rc = output3(cmd.format(**locals()))
+            run += ["--name", container, image]
+            out, err, rc = docker.run(run)
             if rc:
-                logg.error("%s : %s", cmd, err)
+                logg.error("run %s : %s", " ".join(run), err)
             else:
-                logg.info("%s : %s", cmd, "OK")
+                logg.info("run %s : %s", " ".join(run), "OK")
         addr = self.ip_container(container)
         logg.info(" ---> %s : %s", container, addr)
         return addr
+    def start_shared_containers(self, images):
+        mirrors = []
+        for image in images:
+            for mirror in self.get_docker_mirrors(image):
+                if mirror.cname not in [known.cname for known in mirrors]:
+                    mirrors.append(mirror)
+        done = OrderedDict()
+        for num, group in enumerate(shared_groups(mirrors)):
+            container = SHARED if not num else "%s-%i" % (SHARED, num + 1)
+            logg.debug(" SHARED --name %s %s", container, " ".join([mirror.cname for mirror in group]))
+            addr = self.start_shared_container(container, group)
+            for mirror in group:
+                done[mirror.cname] = addr
+        return done
+    def start_shared_container(self, container, mirrors):  # pylint: disable=too-many-statements
+        """ one container running scripts/mirrorhosts.py with a route for each mirror,
+            taken from the CMD of its image. The first image is the base, with its own
+            /srv/repo and python. The others are attached with their mount directory,
+            or else the image itself is mounted (needs docker 28 or podman). """
+        docker = self.docker()
+        base, baseid, python = "", "", ""
+        volumes = []
+        routes = []
+        images = docker.inspect(list(OrderedDict([(mirror.image, None) for mirror in mirrors])), "image")
+        for mirror in mirrors:
+            image_found = images[mirror.image]
+            if not image_found:
+                logg.info("    image not found: %s", mirror.image)
+                continue
+            cmd = [str(arg) for arg in json_list(image_found, "Config", "Cmd")]
+            if len(cmd) < 2 or not cmd[1].endswith(".py"):
+                logg.warning("    no mirror script in %s: %s", mirror.image, cmd)
+                continue
+            self._ports[mirror.cname] = exposed_ports(image_found.get("Config"))
+            if not base:
+                base, baseid, python = mirror.image, json_text(image_found, "Id"), cmd[0]
+                root = "/srv/repo"
+                if mirror.mount and os.path.isdir(mirror.mount):
+                    volumes += ["-v", "%s:%s" % (mirror.mount, root)]
+            elif mirror.mount and os.path.isdir(mirror.mount):
+                root = "/srv/shared/%s" % mirror.cname
+                volumes += ["-v", "%s:%s" % (mirror.mount, root)]
+            else:
+                volumes += ["--mount", "type=image,source=%s,destination=/srv/images/%s" % (mirror.image, mirror.cname)]
+                root = "/srv/images/%s/srv/repo" % mirror.cname
+            options = list(cmd[2:])
+            if "--data" in options and options.index("--data") + 1 < len(options):
+                data = options.index("--data") + 1
+                if options[data].startswith("/srv/repo"):
+                    options[data] = root + options[data][len("/srv/repo"):]
+            route = [mirror.cname, ",".join(mirror.hosts), os.path.basename(cmd[1])] + options
+            routes += ["--route", " ".join([shlex.quote(arg) for arg in route])]
+        if not base:
+            return None
+        scripts = os.path.abspath(repo_scripts())
+        mirrorhosts = "/srv/scripts/mirrorhosts.py"
+        if os.path.isfile(os.path.join(scripts, "mirrorhosts.py")):
+            volumes += ["-v", "%s:/srv/shared-scripts:ro" % scripts]
+            mirrorhosts = "/srv/shared-scripts/mirrorhosts.py"
+        cmd = [python, mirrorhosts] + routes
+        container_found = docker.inspect([container], "container")[container]
+        if container_found:
+            container_status = json_value(container_found, "State", "Status")
+            container_command = json_value(container_found, "Config", "Cmd")
+            if container_found.get("Image") != baseid or container_status not in ["running"] or container_command != cmd:
+                docker.remove(container)
+                container_found = None
+        if not container_found:
+            run = ["--rm=true", "--detach"] + volumes + ["--name", container, base] + cmd
+            out, err, rc = docker.run(run)
+            if rc:
+                logg.error("%s : %s", " ".join(run), err)
+            else:
+                logg.info("%s : %s", " ".join(run), "OK")
+        addr = self.ip_container(container)
+        logg.info(" ---> %s : %s", container, addr)
+        return addr
+    def stop_shared_containers(self):
+        done = {}
+        for name in self.docker().container_names(SHARED):
+            if name == SHARED or name.startswith(SHARED + "-"):
+                done[name] = self.stop_container("", name)
+        return done
     def stop_containers(self, image):
         mirrors = self.get_docker_mirrors(image)
         done = {}
@@ -767,25 +1641,61 @@ class DockerMirrorPackagesRepo:
             done[mirror.cname] = info
         return done
     def stop_container(self, image, container):  # pylint: disable=unused-argument
-        docker = DOCKER
-        cmd = "{docker} inspect {container}"
-        out, err, rc = output3(cmd.format(**locals()))
-        container_found = json.loads(out)
-        if not rc and container_found:
-            cmd = "{docker} rm --force {container}"
-            out, err, ok = output3(cmd.format(**locals()))
-            status = container_found[0].get("State", {})
-            started = status.get("StartedAt", "(was not started)")
+        """ releases the LEASE, the container is removed when no leases are left
+            (after GRACE). The removal is done under the lock of the leases. """
+        with self._leases.locked(container):
+            leases, released = self._leases.read(container)
+            if LEASE and LEASE in leases:
+                del leases[LEASE]
+                if not leases:
+                    released = time.time()
+                self._leases.write(container, leases, released)
+            if leases:
+                logg.info("not stopping %s, it has %i leases", container, len(leases))
+                return "(leased %i)" % len(leases)
+            if not LEASE or GRACE <= 0:
+                return self.remove_container(container)
+        self.linger(container, released)  # outside of the lock, a forked process would keep it
+        return "(stops in %is)" % GRACE
+    def linger(self, container, released):
+        """ remove the container after GRACE, unless it was leased again """
+        if self.background:
+            timer = threading.Timer(GRACE, self.linger_remove, (container, released))
+            timer.daemon = True
+            timer.start()
+            return
+        if os.fork():
+            return
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in [0, 1, 2]:
+                os.dup2(devnull, fd)  # the caller may wait for our output to end
+            self._docker = None  # not the connection of the parent
+            time.sleep(GRACE)
+            self.linger_remove(container, released)
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    def linger_remove(self, container, released):
+        with self._leases.locked(container):
+            leases, last = self._leases.read(container)
+            if leases or last != released:
+                logg.info("not stopping %s, it was leased again", container)
+                return
+            logg.info("stopping %s, released %is ago", container, time.time() - released)
+            self.remove_container(container)
+    def remove_container(self, container):
+        docker = self.docker()
+        container_found = docker.inspect([container], "container")[container]
+        if container_found:
+            docker.remove(container)
+            started = json_value(container_found, "State", "StartedAt") or "(was not started)"
             assert isinstance(started, stringtypes)
             return started
         return "(did not exist)"
     def info_containers(self, image):
         mirrors = self.get_docker_mirrors(image)
-        done = {}
-        for mirror in mirrors:
-            info = self.info_container(mirror.image, mirror.cname)
-            done[mirror.cname] = info
-        return done
+        return dict(self.ip_containers([mirror.cname for mirror in mirrors]))
     def info_container(self, image, container): # pylint: disable=unused-argument
         addr = self.ip_container(container)
         return addr
@@ -797,11 +1707,28 @@ class DockerMirrorPackagesRepo:
         return done
     def inspect_containers(self, image):
         mirrors = self.get_docker_mirrors(image)
-        docker = DOCKER
+        return self.ip_containers([mirror.cname for mirror in mirrors])
+    def metrics_container(self, name, addr):
+        """ the parsed METRICSPATH of a started mirror container, asked on
+            its first port with https for 443 like in probe_port """
+        port = self.mirror_ports(name)[0]
+        url = "%s://%s:%s%s" % ("https" if port == 443 else "http", addr, port, METRICSPATH)
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE  # the self-signed certificate of the container
+        try:
+            text = decodes_(urlopen(url, timeout=MAXWAIT, context=context).read())
+        except (IOError, OSError) as e:
+            logg.warning("no metrics from %s: %s", url, e)
+            return None
+        return parse_metrics(text)
+    def stats_containers(self, image):
+        mirrors = self.get_docker_mirrors(image)
+        self.inspect_ports(mirrors)
         done = OrderedDict()
-        for mirror in mirrors:
-            addr = self.ip_container(mirror.cname)
-            done[mirror.cname] = addr
+        for name, addr in self.ip_containers([mirror.cname for mirror in mirrors]).items():
+            if addr:
+                done[name] = self.metrics_container(name, addr)
         return done
     #
     def add_hosts(self, image, done=None):
@@ -822,9 +1749,14 @@ class DockerMirrorPackagesRepo:
         help             this help screen
         image|detect     the image name matching the local system
         facts [image]    the json data used to start or stop the containers
+        plan [image]     the mirrors as resolved from the versions and the config
         start [image]    starts the container(s) with the mirror-packages-repo
         stop  [image]    stops the containers(s) with the mirror-packages-repo
         addhosts [image] shows the --add-hosts string for the client container
+        stats [image]    shows the request counters of the running containers
+        shared [image..] starts one container serving the mirrors for all images
+        unshare          stops the shared container(s)
+        serve            answers the commands above on DOCKER_MIRROR_SOCKET
 """
     def detect(self, image=None):
         if not image and self._image:
@@ -875,6 +1807,12 @@ class DockerMirrorPackagesRepo:
             data[mirror.cname] = {"image": mirror.image, "name": mirror.cname,
                                   "hosts": mirror.hosts}
         return json.dumps(data, indent=2)
+    def plans(self, image=None):
+        image = self.detect(image)
+        data = self.plan(image).data()
+        reads, calls = self.calls()
+        data["calls"] = {"config": reads, "docker": calls}
+        return json.dumps(data, indent=2)
     def starts(self, image=None):
         if not NODETECT:
             image = self.detect(image)
@@ -893,6 +1831,38 @@ class DockerMirrorPackagesRepo:
             return " ".join(self.add_hosts(image, mirrors))
         else:
             return json.dumps(mirrors, indent=2)
+    def shares(self, images=None):
+        requested = list(images or [None])
+        if not NODETECT:
+            requested = [self.detect(image) for image in requested]
+        found = [image for image in requested if image]
+        if not found:
+            logg.error("no image provided")
+            sys.exit(os.EX_USAGE)
+        logg.debug("shares images = %s", found)
+        mirrors = self.start_shared_containers(found)
+        if LOCAL:
+            notfound = [mirror for mirror, addr in mirrors.items() if addr is None]
+            if notfound:
+                logg.error("   no docker mirror image for %s", (" ".join(notfound)))
+                sys.exit(os.EX_OSFILE)
+        self.wait_mirrors(mirrors)
+        if ADDHOSTS:
+            args = []
+            for image in found:
+                hosts = self.add_hosts(image, mirrors)
+                for num in range(0, len(hosts), 2):
+                    if hosts[num + 1] not in args:
+                        args += hosts[num:num + 2]
+            return " ".join(args)
+        else:
+            return json.dumps(mirrors, indent=2)
+    def unshares(self):
+        mirrors = self.stop_shared_containers()
+        if ADDHOSTS:
+            return " ".join(sorted(mirrors.keys()))
+        else:
+            return json.dumps(mirrors, indent=2)
     def stops(self, image=None):
         if not NODETECT:
             image = self.detect(image)
@@ -906,44 +1876,79 @@ class DockerMirrorPackagesRepo:
         else:
             return json.dumps(mirrors, indent=2)
     def wait_mirrors(self, hosts):
-        results = {}
+        """ returns the number of mirrors that did not get ready in MAXWAIT """
         started = time.monotonic()
-        for url, addr in hosts.items():
-            if not addr:
-                continue
-            results[url] = 0
-            if "alma" in url or "epel" in url:
-                logg.debug("wait %s:443 (%ss)", url, MAXWAIT)
-                for attempt in range(max(1, MAXWAIT)):
-                    try:
-                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        sock.settimeout(2)
-                        sock.connect((addr, 443))
-                        results[url] = 0
-                        break
-                    except ConnectionRefusedError as e:
-                        logg.debug("wait %s:443 = %s", url, e)
-                        results[url] += 1
-                        time.sleep(1)
-            else:
-                logg.debug("wait %s:80 (%ss)", url, MAXWAIT)
-                for attempt in range(max(1, MAXWAIT - 2)):
-                    try:
-                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        sock.settimeout(2)
-                        sock.connect((addr, 80))
-                        results[url] = 0
-                        break
-                    except ConnectionRefusedError as e:
-                        logg.debug("wait %s:80 = %s", url, e)
-                        results[url] += 1
-                        time.sleep(1)
-            if attempt:
-                logg.debug("wait %s:80 - OK", url)
+        waiting = [(url, addr) for url, addr in hosts.items() if addr]
+        if not waiting:
+            return 0
+        with ThreadPoolExecutor(max(1, min(STARTS, len(waiting)))) as pool:
+            results = list(pool.map(lambda host: self.wait_mirror(*host), waiting))
+        took = time.monotonic() - started
+        logg.debug("wait %3.3f sec", took)
+        return len([result for result in results if result is None])
+    def inspect_ports(self, mirrors):
+        """ the exposed ports of the mirror images that were not started by this command """
+        unknown = [mirror for mirror in mirrors if mirror.cname not in self._ports]
+        if not unknown:
+            return
+        images = self.docker().inspect(list(OrderedDict([(mirror.image, None) for mirror in unknown])), "image")
+        for mirror in unknown:
+            self._ports[mirror.cname] = exposed_ports(json_value(images[mirror.image], "Config"))
+    def mirror_ports(self, url):
+        """ the ports that the image of the mirror EXPOSEs, else guessed by the name """
+        ports = self._ports.get(url)
+        if ports:
+            return ports
+        if "alma" in url or "epel" in url:
+            return [443]
+        return [80]
+    def wait_mirror(self, url, addr):
+        """ probe the ports of the mirror with a short exponential backoff,
+            returns the seconds it took to get ready (or None after MAXWAIT) """
+        started = time.monotonic()
+        deadline = started + max(1, MAXWAIT)
+        for port in self.mirror_ports(url):
+            logg.debug("wait %s:%s (%ss)", url, port, MAXWAIT)
+            delay = PROBEFIRST
+            attempts = 1
+            error = self.probe_port(addr, port, deadline)
+            while error:
+                if time.monotonic() + delay > deadline:
+                    logg.warning("mirror %s:%s not ready after %3.3f sec: %s", url, port, time.monotonic() - started, error)
+                    return None
+                logg.debug("wait %s:%s = %s", url, port, error)
+                time.sleep(delay)
+                delay = min(delay * 2, PROBEMAX)
+                attempts += 1
+                error = self.probe_port(addr, port, deadline)
+            logg.debug("wait %s:%s - OK (%s attempts)", url, port, attempts)
         took = time.monotonic() - started
-        if took > 1.1:
-            logg.debug("wait %3.3f sec", took)
-        return sum(results.values())
+        logg.info("mirror %s ready after %3.3f sec", url, took)
+        return took
+    def probe_port(self, addr, port, deadline):
+        """ an empty string when the port accepts a connection (or answers
+            an http request with PROBEHTTP), otherwise the error """
+        timeout = max(0.01, min(PROBETIMEOUT, deadline - time.monotonic()))
+        try:
+            if not PROBEHTTP:
+                sock = socket.create_connection((addr, port), timeout)
+                sock.close()
+                return ""
+            if port == 443:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE  # the self-signed certificate of the container
+                conn = http.client.HTTPSConnection(addr, port, timeout=timeout, context=context)
+            else:
+                conn = http.client.HTTPConnection(addr, port, timeout=timeout)
+            try:
+                conn.request("GET", METRICSPATH)
+                conn.getresponse().read()  # any status, even an older server without metrics
+            finally:
+                conn.close()
+            return ""
+        except (OSError, http.client.HTTPException) as e:  # refused, unreachable, timeout, reset
+            return str(e) or e.__class__.__name__
     def infos(self, image=None):
         image = self.detect(image)
         mirrors = self.info_containers(image)
@@ -965,6 +1970,10 @@ class DockerMirrorPackagesRepo:
             return " ".join(self.add_hosts(image, mirrors))
         else:
             return json.dumps(mirrors, indent=2)
+    def stats(self, image=None):
+        image = self.detect(image)
+        mirrors = self.stats_containers(image)
+        return stats_table(mirrors)
     def from_dockerfile(self, dockerfile, defaults=None):
         if os.path.isdir(dockerfile):
             dockerfile = os.path.join(dockerfile, "Dockerfile")
@@ -986,6 +1995,189 @@ def repo_scripts():
     if os.path.isdir(dn): return dn
     return "scripts"
 
+@contextlib.contextmanager
+def command_options(options):
+    """ the DAEMONOPTIONS values of a client for the time of one command, the
+        values of the daemon itself are restored afterwards """
+    saved = {name: globals()[name] for name in DAEMONOPTIONS}
+    try:
+        globals().update({name: value for name, value in (options or {}).items() if name in saved})
+        yield
+    finally:
+        globals().update(saved)
+
+def run_command(packagesrepo, cmd, image=None, images=None, options=None):
+    """ the output of a command, as printed by the cli. The options are those
+        of a daemon client (see DAEMONOPTIONS), they are used for this command only. """
+    global ADDHOSTS  # pylint: disable=global-statement
+    with command_options(options):
+        if cmd in ["?", "help"]:
+            return packagesrepo.helps()
+        elif cmd in ["detect", "image"]:
+            return packagesrepo.detect(image)
+        elif cmd in ["repo", "from"]:
+            return packagesrepo.repo(image)
+        elif cmd in ["repos", "for"]:
+            return packagesrepo.repos(image)
+        elif cmd in ["latest"]:
+            return packagesrepo.get_docker_latest_version(image or "")
+        elif cmd in ["epel"]:
+            return packagesrepo.epel(image)
+        elif cmd in ["facts"]:
+            return packagesrepo.facts(image)
+        elif cmd in ["plan", "plans"]:
+            return packagesrepo.plans(image)
+        elif cmd in ["start", "starts"]:
+            return packagesrepo.starts(image)
+        elif cmd in ["stop", "stops"]:
+            return packagesrepo.stops(image)
+        elif cmd in ["show", "shows", "info", "infos"]:
+            return packagesrepo.infos(image)
+        elif cmd in ["addhost", "add-host", "addhosts", "add-hosts"]:
+            ADDHOSTS = True
+            return packagesrepo.infos(image)
+        elif cmd in ["inspect"]:
+            return packagesrepo.inspects(image)
+        elif cmd in ["containers"]:
+            return packagesrepo.containers(image)
+        elif cmd in ["stats", "metrics"]:
+            return packagesrepo.stats(image)
+        elif cmd in ["shared", "share", "shares"]:
+            return packagesrepo.shares([image] + list(images or []))
+        elif cmd in ["unshare", "unshares", "unshared"]:
+            return packagesrepo.unshares()
+        elif cmd in ["scripts"]:
+            return repo_scripts()
+        else:
+            print("unknown command", cmd)
+            sys.exit(os.EX_UNAVAILABLE)
+
+def daemon_command(cmd, image=None, images=None):
+    """ the output and the exit code of the command from a running daemon, or None """
+    socketpath = os.path.expanduser(DOCKER_MIRROR_SOCKET)
+    if NODAEMON or cmd not in DAEMONCOMMANDS or not os.path.exists(socketpath):
+        return None
+    options = {name: globals()[name] for name in DAEMONOPTIONS}
+    options["DOCKER_MIRROR_CONFIG"] = os.path.abspath(os.path.expanduser(DOCKER_MIRROR_CONFIG))
+    request = {"command": cmd, "image": image, "images": list(images or []), "options": options}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketpath)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        reply = json.loads(decodes_(data))
+    except (OSError, ValueError) as e:
+        logg.debug("no daemon on %s: %s", socketpath, e)
+        return None
+    finally:
+        sock.close()
+    if not reply.get("served"):
+        logg.debug("daemon on %s uses another docker", socketpath)
+        return None
+    return reply.get("output"), reply.get("exit", 0)
+
+class MirrorDaemonHandler(socketserver.StreamRequestHandler):
+    """ one json request line, one json answer line """
+    def handle(self):
+        try:
+            request = json.loads(decodes_(self.rfile.readline()))
+        except ValueError as e:
+            logg.warning("bad request: %s", e)
+            return
+        server = self.server
+        assert isinstance(server, MirrorDaemonServer)
+        reply = server.daemon.handle(request)
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+class MirrorDaemonServer(socketserver.ThreadingUnixStreamServer):
+    """ the unix socket of a MirrorDaemon, a thread per client """
+    daemon_threads = True
+    def __init__(self, socketpath, daemon):
+        socketserver.ThreadingUnixStreamServer.__init__(self, socketpath, MirrorDaemonHandler)
+        self.daemon = daemon
+
+class MirrorDaemon:
+    """ answers the cli commands on a unix socket with the mirrors resolved in memory.
+        They are dropped on docker image events, or when the options have changed.
+        Without the events (or with --refresh) each command resolves them again. """
+    def __init__(self, socketpath=None):
+        self.socketpath = os.path.expanduser(socketpath or DOCKER_MIRROR_SOCKET)
+        self.repo = DockerMirrorPackagesRepo()
+        self.repo.background = True
+        self.lock = threading.Lock()  # one command at a time, as they use the options of their client
+        self.options = None  # of the last command
+        self.changed = False
+        self.watching = False
+    def watch(self):
+        """ sets 'changed' on image events, for the lifetime of the daemon """
+        while True:
+            try:
+                self.watching = True
+                for event in self.repo.docker().events(["image"]):
+                    logg.debug("event %s %s", event.get("Action", event.get("status")), event.get("id", ""))
+                    self.changed = True
+            except (http.client.HTTPException, OSError, ValueError) as e:
+                logg.debug("events: %s", e)
+            self.watching = False
+            self.changed = True
+            time.sleep(MAXWAIT)
+    def handle(self, request):
+        options = json_dict(request, "options")
+        if options.get("DOCKER") != DOCKER or options.get("BACKEND") != BACKEND:
+            return {"served": False}
+        with self.lock:
+            started = time.monotonic()
+            if self.changed or not self.watching or options != self.options or options.get("REFRESH"):
+                self.changed = False
+                self.repo.forget()
+            self.options = options
+            cmd, image = json_text(request, "command"), json_text(request, "image") or None
+            images = [str(name) for name in json_list(request, "images")]
+            try:
+                text, exitcode = run_command(self.repo, cmd, image, images, options), 0
+            except SystemExit as e:
+                text, exitcode = None, e.code if isinstance(e.code, int) else 1
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logg.error("%s %s: %s", cmd, image, e)
+                text, exitcode = None, 1
+            logg.info("%s %s took %3.3f sec", cmd, image or "", time.monotonic() - started)
+        return {"served": True, "output": text, "exit": exitcode}
+    def serve(self):
+        if os.path.exists(self.socketpath):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socketpath)
+                logg.error("a daemon is already running on %s", self.socketpath)
+                return os.EX_UNAVAILABLE
+            except OSError:
+                os.unlink(self.socketpath)
+            finally:
+                sock.close()
+        socketdir = os.path.dirname(self.socketpath)
+        if socketdir and not os.path.isdir(socketdir):
+            os.makedirs(socketdir)
+        umask = os.umask(0o177)  # the socket is only for this user from the start
+        try:
+            server = MirrorDaemonServer(self.socketpath, self)
+        finally:
+            os.umask(umask)
+        threading.Thread(target=self.watch, daemon=True).start()
+        logg.warning("serving on %s", self.socketpath)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(self.socketpath)
+        return 0
+
+
 if __name__ == "__main__":
     from argparse import ArgumentParser, HelpFormatter
     cmdline = ArgumentParser(formatter_class=lambda prog: HelpFormatter(prog, max_help_position=36, width=81),  # type: ignore[arg-type]
@@ -999,6 +2191,8 @@ if __name__ == "__main__":
                          help="show addhost options for 'docker run' [%(default)s]")
     cmdline.add_argument("-n", "--no-detect", '--nodetect', action="store_true", default=NODETECT,
                          help="skip implicit 'detect' during 'start' [%(default)s]")
+    cmdline.add_argument("--backend", metavar="cli|api|auto", default=BACKEND,
+                         help="use the engine API on its unix socket or the docker command [%(default)s]")
     cmdline.add_argument("--imagesrepo", metavar="PREFIX", default=IMAGESREPO,
                          help="set [%(default)s]")
     cmdline.add_argument("--epel", action="store_true", default=ADDEPEL,
@@ -1007,18 +2201,32 @@ if __name__ == "__main__":
                          help="addhosts using updates variant [%(default)s]")
     cmdline.add_argument("--universe", action="store_true", default=UNIVERSE,
                          help="addhosts using universe variant [%(default)s]")
+    cmdline.add_argument("--probe", action="store_true", default=PROBEHTTP,
+                         help="wait for an http answer of the started mirrors [%(default)s]")
+    cmdline.add_argument("--refresh", action="store_true", default=REFRESH,
+                         help="detect the image again, not from the cache [%(default)s]")
+    cmdline.add_argument("--lease", metavar="ID", default=LEASE,
+                         help="start/stop as a lease, the last one stops the containers [%(default)s]")
+    cmdline.add_argument("--grace", metavar="SEC", type=int, default=GRACE,
+                         help="wait before stopping for the last lease [%(default)s]")
+    cmdline.add_argument("--nodaemon", action="store_true", default=NODAEMON,
+                         help="run the command here, even when a daemon is serving [%(default)s]")
+    cmdline.add_argument("--socket", metavar="PATH", default=DOCKER_MIRROR_SOCKET,
+                         help="of the daemon for the 'serve' command [%(default)s]")
     cmdline.add_argument("-f", "--file", metavar="DOCKERFILE", default=None,
                          help="default to image FROM the dockerfile [%(default)s]")
     cmdline.add_argument("-l", "--local", "--localmirrors", action="count", default=0,
                          help="fail if a local mirror was not found [%(default)s]")
     cmdline.add_argument("-C", "--configfile", metavar="FILE", default=DOCKER_MIRROR_CONFIG,
                          help="overrides in [%(default)s]")
-    commands = ["help", "detect", "image", "repo", "info", "facts", "start", "stop"]
+    commands = ["help", "detect", "image", "repo", "info", "facts", "plan", "start", "stop", "stats", "shared", "unshare", "serve"]
     cmdline.add_argument("command", nargs="?", default="detect", help="|".join(commands))
     cmdline.add_argument("image", nargs="?", default=None, help="defaults to image name matching the local host system")
+    cmdline.add_argument("images", nargs="*", default=[], help="more images for the 'shared' command")
     opt = cmdline.parse_args()
     logging.basicConfig(level=max(0, logging.WARNING - opt.verbose * 10 + opt.quiet * 10))
     DOCKER = opt.docker
+    BACKEND = opt.backend
     IMAGESREPO = opt.imagesrepo
     NODETECT = opt.no_detect
     ADDHOSTS = opt.add_hosts
@@ -1026,40 +2234,24 @@ if __name__ == "__main__":
     # UPDATES = opt.updates
     UNIVERSE = opt.universe  # ubuntu universe repo
     LOCAL = opt.local
+    PROBEHTTP = opt.probe
+    REFRESH = opt.refresh
     DOCKER_MIRROR_CONFIG = opt.configfile
+    DOCKER_MIRROR_SOCKET = opt.socket
+    NODAEMON = opt.nodaemon
+    LEASE = opt.lease
+    GRACE = opt.grace
     command = opt.command or "detect"
     repo = DockerMirrorPackagesRepo()
     if not opt.image and opt.file:
         opt.image = repo.from_dockerfile(opt.file)
-    if command in ["?", "help"]:
-        print(repo.helps())
-    elif command in ["detect", "image"]:
-        print(repo.detect(opt.image))
-    elif command in ["repo", "from"]:
-        print(repo.repo(opt.image))
-    elif command in ["repos", "for"]:
-        print(repo.repos(opt.image))
-    elif command in ["latest"]:
-        print(repo.get_docker_latest_version(opt.image))
-    elif command in ["epel"]:
-        print(repo.epel(opt.image))
-    elif command in ["facts"]:
-        print(repo.facts(opt.image))
-    elif command in ["start", "starts"]:
-        print(repo.starts(opt.image))
-    elif command in ["stop", "stops"]:
-        print(repo.stops(opt.image))
-    elif command in ["show", "shows", "info", "infos"]:
-        print(repo.infos(opt.image))
-    elif command in ["addhost", "add-host", "addhosts", "add-hosts"]:
-        ADDHOSTS = True
-        print(repo.infos(opt.image))
-    elif command in ["inspect"]:
-        print(repo.inspects(opt.image))
-    elif command in ["containers"]:
-        print(repo.containers(opt.image))
-    elif command in ["scripts"]:
-        print(repo_scripts())
-    else:
-        print("unknown command", opt.command)
-        sys.exit(os.EX_UNAVAILABLE)
+    if command in ["serve", "daemon"]:
+        sys.exit(MirrorDaemon().serve())
+    answer = daemon_command(command, opt.image, opt.images)
+    if answer is not None:
+        output, code = answer
+        if output is not None:
+            print(output)
+        sys.exit(code)
+    print(run_command(repo, command, opt.image, opt.images))
+    logg.info("%s: %i config reads, %i docker calls", command, *repo.calls())
@@ -1,5 +1,10 @@
 #! /usr/bin/python3
-from typing import Optional, Union, Tuple, Dict, List
+from typing import Optional, Union, Tuple, Dict, List, Iterator, IO
+import http.client
+import socketserver
+import configparser
+import threading
+import tarfile
 
 DIST: Dict[str, str]
 BASE: Dict[str, str]
@@ -9,26 +14,155 @@ OPENSUSE: Dict[str, str]
 def decodes(text: Optional[str]) -> Optional[str]: ...
 def decodes_(text: Union[str,bytes]) -> str: ...
 def output3(cmd: Union[str, List[str]], shell: bool = True, debug: bool = True) -> Tuple[str, str, int]: ...
+def docker_socket(exe: str = "docker") -> str: ...
+def docker_backend(backend: Optional[str] = None) -> Union[DockerAPI, DockerCLI]: ...
+def json_value(value: object, *keys: str) -> object: ...
+def json_text(value: object, *keys: str) -> str: ...
+def json_list(value: object, *keys: str) -> List[object]: ...
+def json_dict(value: object, *keys: str) -> Dict[str, object]: ...
+def json_labels(value: object, *keys: str) -> Dict[str, str]: ...
+def inspected_name(value: Dict[str, object], names: List[str]) -> Optional[str]: ...
+def run_config(args: List[str]) -> Optional[Tuple[str, Dict[str, object]]]: # type: ignore[return]
+    hostconfig: Dict[str, object]
+    config: Dict[str, object]
+def archive_texts(data: bytes, top: str, names: List[str]) -> Tuple[Dict[str, str], Dict[str, str]]: # type: ignore[return]
+    texts: Dict[str, str]
+    links: Dict[str, str]
+    members: Dict[str, tarfile.TarInfo]
+    member: Optional[tarfile.TarInfo]
+def release_image(texts: Dict[str, str]) -> Tuple[str, str]: ...
+
+class DetectCache:
+    filename: str
+    maxsize: int
+    def __init__(self, filename: Optional[str] = None, maxsize: Optional[int] = None) -> None: ...
+    def read(self) -> Dict[str, Dict[str, Union[str, int]]]: ...
+    def get(self, imageid: str) -> Optional[str]: ...
+    def put(self, imageid: str, image: str, detected: str) -> None: ...
+
+class RepoCatalog:
+    filename: str
+    source: Dict[str, object]
+    entries: List[List[str]]
+    keys: List[Tuple[str, ...]]
+    labels: Dict[str, Dict[str, str]]
+    def __init__(self, filename: Optional[str] = None) -> None: ...
+    def load(self, entries: List[List[str]], source: Dict[str, object], labels: Optional[Dict[str, Dict[str, str]]] = None) -> None: ...
+    def add(self, rep: str, tag: str, image: str, mount: str = "") -> None: ...
+    def nearest(self, rep: str, version: str, released: str) -> Optional[List[str]]: ...
+    def read(self) -> Optional[int]: ...
+    def write(self, listed: int) -> None: ...
+
+class MirrorLeases:
+    directory: str
+    def __init__(self, directory: Optional[str] = None) -> None: ...
+    def locked(self, container: str) -> Iterator[IO[str]]: ...
+    def read(self, container: str) -> Tuple[Dict[str, float], float]: ...
+    def write(self, container: str, leases: Dict[str, float], released: float) -> None: ...
+    def acquire(self, container: str, lease: str) -> int: ...
+    def others(self, container: str, lease: str = "") -> int: ...
+
+class DockerCLI:
+    docker: str
+    calls: int
+    def __init__(self, docker: Optional[str] = None) -> None: ...
+    def command(self, args: List[str], debug: bool = True) -> Tuple[str, str, int]: ...
+    def inspect(self, names: List[str], kind: str = "") -> Dict[str, Optional[Dict[str, object]]]: # type: ignore[return]
+        found: Dict[str, Optional[Dict[str, object]]]
+    def remove(self, name: str) -> bool: ...
+    def create(self, name: str, image: str) -> str: ...
+    def run(self, args: List[str]) -> Tuple[str, str, int]: ...
+    def archive(self, name: str, path: str, debug: bool = True) -> Tuple[Optional[bytes], str]: ...
+    def image_tags(self, reference: str = "") -> Optional[List[str]]: ...
+    def labelled_images(self, label: str) -> Optional[Dict[str, Dict[str, str]]]: # type: ignore[return]
+        found: Dict[str, Dict[str, str]]
+    def events(self, kinds: List[str]) -> Iterator[Dict[str, object]]: ...
+    def image_events(self, since: int, until: int) -> Optional[int]: ...
+    def container_names(self, name: str) -> List[str]: ...
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    socketpath: str
+    def __init__(self, socketpath: str, timeout: Optional[float] = ...) -> None: ...
+    def connect(self) -> None: ...
+
+class DockerAPI:
+    socketpath: str
+    local: threading.local
+    fallback: DockerCLI
+    calls: int
+    def __init__(self, socketpath: str, docker: Optional[str] = None) -> None: ...
+    def request(self, method: str, url: str, body: Optional[Dict[str, object]] = None, decode: bool = True) -> Tuple[int, object]: ...
+    def ping(self) -> bool: ...
+    def message(self, status: int, content: object) -> str: ...
+    def inspect(self, names: List[str], kind: str = "") -> Dict[str, Optional[Dict[str, object]]]: # type: ignore[return]
+        found: Dict[str, Optional[Dict[str, object]]]
+    def remove(self, name: str) -> bool: ...
+    def create_container(self, name: str, config: Dict[str, object]) -> Tuple[str, str]: ...
+    def create(self, name: str, image: str) -> str: ...
+    def run(self, args: List[str]) -> Tuple[str, str, int]: ...
+    def archive(self, name: str, path: str, debug: bool = True) -> Tuple[Optional[bytes], str]: ...
+    def image_tags(self, reference: str = "") -> Optional[List[str]]: ...
+    def labelled_images(self, label: str) -> Optional[Dict[str, Dict[str, str]]]: # type: ignore[return]
+        found: Dict[str, Dict[str, str]]
+    def events(self, kinds: List[str]) -> Iterator[Dict[str, object]]: ...
+    def image_events(self, since: int, until: int) -> Optional[int]: ...
+    def container_names(self, name: str) -> List[str]: ...
+
 def major(version: str) -> str: ...
 def majorminor(version: str) -> str: ...
 def onlyversion(image: str) -> str: ...
+def parse_metrics(text: str) -> Dict[str, Dict[str, float]]: # type: ignore[return]
+    found: Dict[str, Dict[str, float]]
+def stats_table(stats: Dict[str, Optional[Dict[str, Dict[str, float]]]]) -> str: ...
+def exposed_ports(config: object) -> List[int]: ...
+def shared_groups(mirrors: List[DockerMirror]) -> List[List[DockerMirror]]: # type: ignore[return]
+    groups: List[List[DockerMirror]]
 
 class DockerMirror:
     def __init__(self, cname: str, image: str, hosts: List[str], mount: str = "") -> None: ...
     def __str__(self) -> str: ...
 
+class MirrorPlan:
+    image: str
+    version: str
+    mirrors: List[DockerMirror]
+    def __init__(self, image: str, version: str, mirrors: List[DockerMirror]) -> None: ...
+    def __str__(self) -> str: ...
+    def data(self) -> Dict[str, object]: ...
+
 class DockerMirrorPackagesRepo:
     def __init__(self, image: Optional[str] = None) -> None:
         self._image: Optional[str]
+        self._ports: Dict[str, List[int]]
+        self._docker: Optional[Union[DockerAPI, DockerCLI]]
+        self._docker_lock: threading.Lock
+        self._config: Optional[Tuple[str, configparser.ConfigParser]]
+        self._configreads: int
+        self._plans: Dict[Optional[str], MirrorPlan]
+        self._catalog: Optional[RepoCatalog]
+        self._labelled: Optional[Dict[str, Dict[str, str]]]
+        self._leases: MirrorLeases
+        self.background: bool
+    def docker(self) -> Union[DockerAPI, DockerCLI]: ...
+    def forget(self) -> None: ...
+    def config(self) -> configparser.ConfigParser: ...
+    def catalog(self) -> RepoCatalog: # type: ignore[return]
+        source: Dict[str, object]
+    def labelled(self) -> Dict[str, Dict[str, str]]: ...
+    def calls(self) -> Tuple[int, int]: ...
     def host_system_image(self) -> str: ...
     def detect_etc_image(self, etc: str) -> Tuple[str, str]: ...
     def detect_base_image(self, image: str) -> str: ...
-    def detect_base_image_from(self, cname: str, tempdir: str) -> Tuple[str, str]: ...
+    def image_id(self, image: str) -> str: ...
+    def detect_base_image_from(self, cname: str) -> Tuple[str, str]: ...
     def get_docker_latest_image(self, image: str) -> str: ...
     def get_docker_latest_version(self, image: str) -> str: ...
     def get_docker_mirror(self, image: str) -> Optional[DockerMirror]: ...
-    def get_docker_mirrors(self, image: str) -> List[DockerMirror]: # type: ignore[return]
+    def get_docker_mirrors(self, image: str) -> List[DockerMirror]: ...
+    def plan(self, image: str) -> MirrorPlan: ...
+    def resolve_docker_mirrors(self, image: str) -> List[DockerMirror]: # type: ignore[return]
         mirrors: List[DockerMirror]
+    def get_labelled_docker_mirror(self, image: str) -> Optional[DockerMirror]: ...
     def get_ubuntu_latest(self, image: str, default: Optional[str] = None) -> str: ...
     def get_ubuntu_latest_version(self, version: str) -> str: ...
     def get_ubuntu_docker_mirror(self, image: str) -> DockerMirror: ...
@@ -53,17 +187,30 @@ class DockerMirrorPackagesRepo:
     def get_epel_docker_mirror_images(self, rep: str) -> List[str]: ...
     def get_epel_docker_mirror_disks(self, rep: str, *hosts: str) -> Dict[str, DockerMirror]: ...
     def ip_container(self, name: str) -> Optional[str]: ...
+    def ip_containers(self, names: List[str]) -> Dict[str, Optional[str]]: # type: ignore[return]
+        done: Dict[str, Optional[str]]
     def start_containers(self, image: str) -> Dict[str, Optional[str]]: # type: ignore[return]
         done: Dict[str, Optional[str]]
+    def start_mirror(self, mirror: DockerMirror) -> Optional[str]: ...
     def start_container(self, image: str, container: str, mount:str) -> Optional[str]: ...
+    def start_shared_containers(self, images: List[str]) -> Dict[str, Optional[str]]: # type: ignore[return]
+        mirrors: List[DockerMirror]
+        done: Dict[str, Optional[str]]
+    def start_shared_container(self, container: str, mirrors: List[DockerMirror]) -> Optional[str]: ...
+    def stop_shared_containers(self) -> Dict[str, str]: ...
     def stop_containers(self, image: str) -> Dict[str, str]: # type: ignore[return]
         done: Dict[str, str]
     def stop_container(self, image: str, container: str) -> str: ...
+    def linger(self, container: str, released: float) -> None: ...
+    def linger_remove(self, container: str, released: float) -> None: ...
+    def remove_container(self, container: str) -> str: ...
     def info_containers(self, image: str) -> Dict[str, Optional[str]]: ...
     def info_container(self, image: str, container: str) -> Optional[str]: ...
     def get_containers(self, image: str) -> List[str]: ...
     def inspect_containers(self, image: str) -> Dict[str, Optional[str]]: # type: ignore[return]
         done: Dict[str, Optional[str]]
+    def metrics_container(self, name: str, addr: str) -> Optional[Dict[str, Dict[str, float]]]: ...
+    def stats_containers(self, image: str) -> Dict[str, Optional[Dict[str, Dict[str, float]]]]: ...
     def add_hosts(self, image: str, done: Optional[Dict[str, Optional[str]]] = None) -> List[str]: # type: ignore[return]
         args: List[str]
     def helps(self) -> str: ...
@@ -72,13 +219,45 @@ class DockerMirrorPackagesRepo:
     def repo(self, image: Optional[str] = None) -> str: ...
     def repos(self, image: Optional[str] = None) -> str: ...
     def facts(self, image: Optional[str] = None) -> str: ...
+    def plans(self, image: Optional[str] = None) -> str: ...
     def starts(self, image: Optional[str] = None) -> str: ...
+    def shares(self, images: Optional[List[Optional[str]]] = None) -> str: ...
+    def unshares(self) -> str: ...
     def stops(self, image: Optional[str] = None) -> str: ...
     def wait_mirrors(self, hosts: Dict[str, Optional[str]]) -> int: # type: ignore[return]
-        results: Dict[str, int]
+        results: List[Optional[float]]
+    def inspect_ports(self, mirrors: List[DockerMirror]) -> None: ...
+    def mirror_ports(self, url: str) -> List[int]: ...
+    def wait_mirror(self, url: str, addr: str) -> Optional[float]: ...
+    def probe_port(self, addr: str, port: int, deadline: float) -> str: # type: ignore[return]
+        conn: http.client.HTTPConnection
     def infos(self, image: Optional[str] = None) -> str: ...
     def containers(self, image: Optional[str] = None) -> str: ...
     def inspects(self, image: Optional[str] = None) -> str: ...
+    def stats(self, image: Optional[str] = None) -> str: ...
     def from_dockerfile(self, dockerfile: str, defaults: Optional[str] = None) -> Optional[str]: ...
 
 def repo_scripts() -> str: ...
+def command_options(options: Optional[Dict[str, object]]) -> Iterator[None]: ...
+def run_command(packagesrepo: DockerMirrorPackagesRepo, cmd: str, image: Optional[str] = None, images: Optional[List[str]] = None,
+                options: Optional[Dict[str, object]] = None) -> str: ...
+def daemon_command(cmd: str, image: Optional[str] = None, images: Optional[List[str]] = None) -> Optional[Tuple[Optional[str], int]]: ...
+
+class MirrorDaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None: ...
+
+class MirrorDaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon: MirrorDaemon
+    def __init__(self, socketpath: str, daemon: MirrorDaemon) -> None: ...
+
+class MirrorDaemon:
+    socketpath: str
+    repo: DockerMirrorPackagesRepo
+    lock: threading.Lock
+    options: Optional[Dict[str, object]]
+    changed: bool
+    watching: bool
+    def __init__(self, socketpath: Optional[str] = None) -> None: ...
+    def watch(self) -> None: ...
+    def handle(self, request: Dict[str, object]) -> Dict[str, object]: ...
+    def serve(self) -> int: ...
@@ -11,13 +11,27 @@ __contact__ = "https://github.com/gdraheim/docker-mirror-packages-repo"
 __license__ = "CC0 Creative Commons Zero (Public Domain)"
 __version__ = "1.7.7122"
 
-from typing import Union, Optional, List, Dict, cast
+from typing import Union, Optional, List, Dict, Tuple, cast
 import sys
 import subprocess
 import collections
+import gzip
+import hashlib
+import http.client
+import io
 import json
 import os.path
+import shutil
+import socket
+import socketserver
+import ssl
+import tarfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from urllib.request import urlopen, Request
 from fnmatch import fnmatchcase as fnmatch
 
 import logging
@@ -123,12 +137,883 @@ def make_file(name: str, content: str) -> None:
 def drop_file(name: str) -> None:
     if os.path.exists(name):
         os.remove(name)
+def free_port() -> int:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = cast(int, sock.getsockname()[1])
+    sock.close()
+    return port
+def wait_port(port: int, maxwait: float = 5.) -> None:
+    started = time.monotonic()
+    while time.monotonic() - started < maxwait:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+def start_server(script: str, *options: str) -> "subprocess.Popen[bytes]":
+    """ one of the repo server scripts on a free port, to be used when wait_port is done """
+    return subprocess.Popen([sys.executable, script, "--summary", "0", "--workers", "1"] + list(options),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def stop_server(server: "subprocess.Popen[bytes]") -> None:
+    server.kill()
+    server.wait()
+def http_request(port: int, path: str, headers: Optional[Dict[str, str]] = None, verb: str = "GET") -> Tuple[http.client.HTTPResponse, bytes]:
+    """ the answer with its body, on a new connection to the local port """
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request(verb, path, headers=headers or {})
+        answer = conn.getresponse()
+        return answer, answer.read()
+    finally:
+        conn.close()
+def get_url(url: str, host: str = "") -> str:
+    request = Request(url, headers={"Host": host} if host else {})
+    with urlopen(request, timeout=5) as f:
+        return decodes(f.read())
+def json_value(value: object, *keys: str) -> object:
+    """ the value at the keys of nested json objects, None when one is missing """
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+class FakeEngineServer(socketserver.ThreadingUnixStreamServer):
+    """ the state of a fake docker engine, one for each test (see FakeEngine) """
+    daemon_threads = True
+    def __init__(self, path: str, exposed: int = 80) -> None:
+        self.exposed = exposed  # the port that the images EXPOSE
+        self.startdelay = 0.  # seconds that a container start takes
+        self.containers: Dict[str, Dict[str, object]] = {}
+        self.requests: List[str] = []
+        self.connections = 0
+        self.events: List[Dict[str, str]] = []
+        self.images: List[Dict[str, Union[str, List[str], Dict[str, str]]]] = [{"Id": "sha256:epel", "RepoTags": ["localhost:5000/mirror-packages/epel-repo:9.4.2405"], "Labels": {}}]
+        socketserver.ThreadingUnixStreamServer.__init__(self, path, FakeEngine)
+    def requested(self, prefix: str) -> int:
+        """ the number of requests so far that start like 'GET /images/json' """
+        return len([request for request in self.requests if request.startswith(prefix)])
 
+class FakeEngine(BaseHTTPRequestHandler):
+    """ a few endpoints of the docker engine API on a unix socket (see test_00018) """
+    protocol_version = "HTTP/1.1"
+    engine: FakeEngineServer
+    def setup(self) -> None:
+        BaseHTTPRequestHandler.setup(self)
+        self.engine = cast(FakeEngineServer, self.server)
+        self.engine.connections += 1
+    def log_message(self, format: str, *values: object) -> None:  # pylint: disable=redefined-builtin
+        pass
+    def reply(self, status: int, value: object = None, content_type: str = "application/json") -> None:
+        data = b"" if value is None else value if isinstance(value, bytes) else json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    def do_GET(self) -> None:  # pylint: disable=too-many-statements
+        self.engine.requests.append("GET " + self.path)
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        if path == "/_ping":
+            self.reply(200, b"OK", "text/plain")
+        elif path == "/events" and "until" not in parse_qs(url.query):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            sent = len(self.engine.events)
+            try:
+                for _ in range(200):
+                    for event in self.engine.events[sent:]:
+                        self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    sent = len(self.engine.events)
+                    time.sleep(0.05)
+            except OSError:
+                pass
+            self.close_connection = True  # pylint: disable=attribute-defined-outside-init
+        elif path == "/events":
+            self.reply(200, "".join([json.dumps(event) + "\n" for event in self.engine.events]).encode("utf-8"), "application/json")
+        elif path == "/images/json":
+            filters = json.loads(parse_qs(url.query).get("filters", ["{}"])[0])
+            images = [image for image in self.engine.images
+                      if all(fnmatch(tag.rsplit(":", 1)[0], pattern) for tag in image["RepoTags"] for pattern in filters.get("reference", []))
+                      and all(label in image["Labels"] for label in filters.get("label", []))]
+            self.reply(200, images)
+        elif path.startswith("/images/") and path.endswith("/json"):
+            self.reply(200, {"Id": "sha256:" + path, "Config": {"Cmd": ["python3", "/srv/scripts/filelist.py"],
+                                                               "ExposedPorts": {F"{self.engine.exposed}/tcp": {}}}})
+        elif path.startswith("/containers/") and path.endswith("/json") and path[len("/containers/"):-len("/json")] in self.engine.containers:
+            self.reply(200, self.engine.containers[path[len("/containers/"):-len("/json")]])
+        elif path.startswith("/containers/") and path.endswith("/archive") and parse_qs(url.query)["path"] == ["/etc"]:
+            tar = io.BytesIO()
+            with tarfile.open(fileobj=tar, mode="w") as archive:
+                info = tarfile.TarInfo("etc")
+                info.type = tarfile.DIRTYPE
+                archive.addfile(info)
+                content = b"localhost\n"
+                info = tarfile.TarInfo("etc/hostname")
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+                info = tarfile.TarInfo("etc/os-release")
+                info.type = tarfile.SYMTYPE
+                info.linkname = "../usr/lib/os-release"
+                archive.addfile(info)
+            self.reply(200, tar.getvalue(), "application/x-tar")
+        elif path.startswith("/containers/") and path.endswith("/archive") and parse_qs(url.query)["path"] == ["/usr/lib/os-release"]:
+            content = b'ID="opensuse-leap"\nVERSION_ID="15.6"\n'
+            tar = io.BytesIO()
+            with tarfile.open(fileobj=tar, mode="w") as archive:
+                info = tarfile.TarInfo("os-release")
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+            self.reply(200, tar.getvalue(), "application/x-tar")
+        else:
+            self.reply(404, {"message": "No such object"})
+    def do_POST(self) -> None:
+        self.engine.requests.append("POST " + self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0") or "0"))
+        url = urlparse(self.path)
+        if url.path == "/containers/create":
+            name = parse_qs(url.query)["name"][0]
+            config = json.loads(body)
+            self.engine.containers[name] = {"Id": "id-" + name, "Name": "/" + name, "Image": "sha256:/images/" + config["Image"] + "/json",
+                                     "State": {"Status": "created"}, "Config": config, "NetworkSettings": {"IPAddress": "127.0.0.1"}}
+            self.reply(201, {"Id": "id-" + name})
+        elif url.path.startswith("/containers/id-") and url.path.endswith("/start"):
+            time.sleep(self.engine.startdelay)
+            state = self.engine.containers[url.path[len("/containers/id-"):-len("/start")]]["State"]
+            assert isinstance(state, dict)
+            state["Status"] = "running"
+            self.reply(204)
+        else:
+            self.reply(404, {"message": "No such object"})
+    def do_DELETE(self) -> None:
+        self.engine.requests.append("DELETE " + self.path)
+        name = unquote(urlparse(self.path).path)[len("/containers/"):]
+        if name in self.engine.containers:
+            del self.engine.containers[name]
+            self.reply(204)
+        else:
+            self.reply(404, {"message": "No such container"})
 
 class DockerMirrorPackagesTest(unittest.TestCase):
+    def fake_engine(self, tmp: str, exposed: int = 80) -> Tuple[FakeEngineServer, List[str], Dict[str, str]]:
+        """ a fake docker engine in the tmp dir (removed after the test), and the docker_mirror.py
+            command and environment to use it, with its cache and daemon socket in the tmp dir """
+        os.makedirs(tmp, exist_ok=True)
+        self.addCleanup(shutil.rmtree, tmp)
+        engine = FakeEngineServer(F"{tmp}/engine.sock", exposed)
+        threading.Thread(target=engine.serve_forever, daemon=True).start()
+        self.addCleanup(engine.server_close)
+        self.addCleanup(engine.shutdown)
+        env = dict(os.environ, DOCKER_HOST=F"unix://{os.path.abspath(tmp)}/engine.sock", DOCKER_MIRROR_CACHE=F"{tmp}/cache",
+                   DOCKER_MIRROR_SOCKET=F"{tmp}/daemon.sock")
+        cmd = [sys.executable, "docker_mirror.py", "--backend", "api", "--docker", "no-such-docker", "-C", F"{tmp}/docker_mirror.ini"]
+        return engine, cmd, env
+    def listening_port(self) -> int:
+        """ a local port that accepts connections until the end of the test """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(16)
+        self.addCleanup(listener.close)
+        return cast(int, listener.getsockname()[1])
     def test_00001_hello(self) -> None:
         print("... starting the testsuite ...")
         logg.info("starting the testsuite ...")
+    def test_00001_threads(self) -> None:
+        """ an idle connection holds one worker, the other workers keep answering (no docker needed) """
+        tmp = "tmp.test_00001"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        make_file(F"{tmp}/7/os/a.txt", "hello\n")
+        port = free_port()
+        server = start_server("scripts/filelist.py", "--data", tmp, "--port", str(port), "--threads", "2", "--timeout", "5")
+        try:
+            wait_port(port)
+            idle = socket.create_connection(("127.0.0.1", port), timeout=5)
+            try:
+                started = time.monotonic()
+                for _ in range(3):
+                    answer, body = http_request(port, "/7/os/a.txt")
+                    self.assertEqual((answer.status, body), (200, b"hello\n"))
+                took = time.monotonic() - started
+            finally:
+                idle.close()
+        finally:
+            stop_server(server)
+            shutil.rmtree(tmp)
+        self.assertLess(took, 2.)
+    def test_00002_sendfile(self) -> None:
+        """ a package file is sent zero-copy, also for a range in the middle of it (no docker needed) """
+        sys.path.insert(0, "scripts")
+        import mirrorserver  # type: ignore[import-not-found]  # pylint: disable=import-outside-toplevel,import-error
+        tmp = "tmp.test_00002"
+        os.makedirs(F"{tmp}/7/os/Packages", exist_ok=True)
+        content = os.urandom(3 * 1024 * 1024 + 7)
+        with open(F"{tmp}/7/os/Packages/a.rpm", "wb") as f:
+            f.write(content)
+        port = free_port()
+        server = start_server("scripts/filelist.py", "--data", tmp, "--port", str(port))
+        conn, peer = socket.socketpair()
+        try:
+            handler = mirrorserver.MirrorHandler.__new__(mirrorserver.MirrorHandler)
+            handler.connection, handler.wfile = conn, io.BytesIO()
+            with open(F"{tmp}/7/os/Packages/a.rpm", "rb") as f:
+                self.assertEqual(handler.sendfile_fileno(f, handler.wfile), f.fileno())
+                self.assertEqual(handler.sendfile_fileno(io.BytesIO(content), handler.wfile), -1)
+                self.assertEqual(handler.sendfile_fileno(f, io.BytesIO()), -1)
+            wait_port(port)
+            full, body = http_request(port, "/7/os/Packages/a.rpm")
+            self.assertEqual((full.status, len(body)), (200, len(content)))
+            self.assertEqual(body, content)
+            middle, body = http_request(port, "/7/os/Packages/a.rpm", {"Range": "bytes=1048576-1114111"})
+            self.assertEqual(middle.status, 206)
+            self.assertEqual(body, content[1048576:1114112])
+        finally:
+            conn.close()
+            peer.close()
+            stop_server(server)
+            sys.path.remove("scripts")
+            shutil.rmtree(tmp)
+    def test_00003_ranges(self) -> None:  # pylint: disable=too-many-locals
+        """ the file answers do Range, If-Range and If-None-Match (no docker needed) """
+        tmp = "tmp.test_00003"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        content = b"0123456789abcdefghij"
+        make_file(F"{tmp}/7/os/a.txt", decodes(content))
+        port = free_port()
+        server = start_server("scripts/filelist.py", "--data", tmp, "--port", str(port))
+        try:
+            wait_port(port)
+            full, body = http_request(port, "/7/os/a.txt")
+            self.assertEqual((full.status, body), (200, content))
+            self.assertEqual(full.getheader("Accept-Ranges"), "bytes")
+            etag = full.getheader("ETag", "")
+            single, body = http_request(port, "/7/os/a.txt", {"Range": "bytes=2-5"})
+            self.assertEqual((single.status, body), (206, b"2345"))
+            self.assertEqual(single.getheader("Content-Range"), "bytes 2-5/20")
+            suffix, body = http_request(port, "/7/os/a.txt", {"Range": "bytes=-3"})
+            self.assertEqual((suffix.status, body), (206, b"hij"))
+            self.assertEqual(suffix.getheader("Content-Range"), "bytes 17-19/20")
+            multi, body = http_request(port, "/7/os/a.txt", {"Range": "bytes=0-1,10-"})
+            self.assertEqual(multi.status, 206)
+            boundary = multi.getheader("Content-Type", "").split("boundary=")[1]
+            parts = [F"\r\n--{boundary}\r\nContent-Type: text/plain\r\nContent-Range: bytes 0-1/20\r\n\r\n01",
+                     F"\r\n--{boundary}\r\nContent-Type: text/plain\r\nContent-Range: bytes 10-19/20\r\n\r\nabcdefghij",
+                     F"\r\n--{boundary}--\r\n"]
+            self.assertEqual(body, "".join(parts).encode("ascii"))
+            unsatisfiable, body = http_request(port, "/7/os/a.txt", {"Range": "bytes=30-40"})
+            self.assertEqual((unsatisfiable.status, body), (416, b""))
+            self.assertEqual(unsatisfiable.getheader("Content-Range"), "bytes */20")
+            invalid, body = http_request(port, "/7/os/a.txt", {"Range": "bytes="})
+            self.assertEqual((invalid.status, body), (200, content))
+            changed, body = http_request(port, "/7/os/a.txt", {"Range": "bytes=2-5", "If-Range": '"0-0"'})
+            self.assertEqual((changed.status, body), (200, content))
+            unchanged, body = http_request(port, "/7/os/a.txt", {"Range": "bytes=2-5", "If-Range": etag})
+            self.assertEqual((unchanged.status, body), (206, b"2345"))
+            cached, body = http_request(port, "/7/os/a.txt", {"If-None-Match": etag})
+            self.assertEqual((cached.status, body), (304, b""))
+            modified, body = http_request(port, "/7/os/a.txt", {"If-None-Match": '"0-0"'})
+            self.assertEqual((modified.status, body), (200, content))
+            head, body = http_request(port, "/7/os/a.txt", verb="HEAD")
+            self.assertEqual((head.status, body), (200, b""))
+            self.assertEqual(head.getheader("Content-Length"), "20")
+        finally:
+            stop_server(server)
+            shutil.rmtree(tmp)
+    def test_00004_keepalive(self) -> None:
+        """ requests share one kept-alive connection, also pipelined, up to --maxrequests (no docker needed) """
+        tmp = "tmp.test_00004"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        make_file(F"{tmp}/7/os/a.txt", "hello\n")
+        port = free_port()
+        server = start_server("scripts/filelist.py", "--data", tmp, "--port", str(port), "--maxrequests", "3")
+        try:
+            wait_port(port)
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            try:
+                conn.request("GET", "/7/os/a.txt")
+                first = conn.getresponse()
+                self.assertEqual((first.status, first.read()), (200, b"hello\n"))
+                sock = conn.sock
+                self.assertIsNotNone(sock)
+                conn.request("GET", "/7/os/a.txt")
+                second = conn.getresponse()
+                self.assertEqual((second.status, second.read()), (200, b"hello\n"))
+                self.assertIs(conn.sock, sock)
+                self.assertIsNone(second.getheader("Connection"))
+                conn.request("GET", "/7/os/a.txt")
+                third = conn.getresponse()
+                self.assertEqual((third.status, third.read()), (200, b"hello\n"))
+                self.assertEqual(third.getheader("Connection"), "close")
+            finally:
+                conn.close()
+            pipelined = socket.create_connection(("127.0.0.1", port), timeout=5)
+            try:
+                request = b"GET /7/os/a.txt HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                pipelined.sendall(request * 3)
+                data = b""
+                while data.count(b"hello\n") < 3:
+                    chunk = pipelined.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+            finally:
+                pipelined.close()
+            self.assertEqual(data.count(b"HTTP/1.1 200"), 3)
+            self.assertEqual(data.count(b"hello\n"), 3)
+        finally:
+            stop_server(server)
+            shutil.rmtree(tmp)
+    def test_00004_keepalive_idle(self) -> None:
+        """ idle kept-alive connections are closed when a new client waits for a worker (no docker needed) """
+        tmp = "tmp.test_00004"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        make_file(F"{tmp}/7/os/a.txt", "hello\n")
+        port = free_port()
+        server = start_server("scripts/filelist.py", "--data", tmp, "--port", str(port), "--threads", "2", "--timeout", "5")
+        idle: List[http.client.HTTPConnection] = []
+        try:
+            wait_port(port)
+            started = time.monotonic()
+            for _ in range(3):  # more than --threads
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+                idle.append(conn)
+                conn.request("GET", "/7/os/a.txt")
+                answer = conn.getresponse()
+                self.assertEqual((answer.status, answer.read()), (200, b"hello\n"))
+            answer, body = http_request(port, "/7/os/a.txt")
+            took = time.monotonic() - started
+            self.assertEqual((answer.status, body), (200, b"hello\n"))
+        finally:
+            for conn in idle:
+                conn.close()
+            stop_server(server)
+            shutil.rmtree(tmp)
+        self.assertLess(took, 1.)
+    def test_00005_metalink_cache(self) -> None:
+        """ the metalink answer is made again only when the repomd.xml size or mtime changed (no docker needed) """
+        tmp = "tmp.test_00005"
+        repomd_xml = F"{tmp}/9/Everything/x86_64/repodata/repomd.xml"
+        os.makedirs(os.path.dirname(repomd_xml), exist_ok=True)
+        make_file(repomd_xml, "<repomd><revision>1</revision></repomd>\n")
+        st = os.stat(repomd_xml)
+        metalink = "/metalink?repo=epel-9&arch=x86_64"
+        port = free_port()
+        server = start_server("scripts/mirrors.fedoraproject.org.py", "--data", tmp, "--port", str(port))
+        try:
+            wait_port(port)
+            first = get_url(F"http://127.0.0.1:{port}{metalink}")
+            make_file(repomd_xml, "<repomd><revision>2</revision></repomd>\n")
+            os.utime(repomd_xml, ns=(st.st_atime_ns, st.st_mtime_ns))
+            cached = get_url(F"http://127.0.0.1:{port}{metalink}")
+            make_file(repomd_xml, "<repomd><revision>33</revision></repomd>\n")
+            changed = get_url(F"http://127.0.0.1:{port}{metalink}")
+        finally:
+            stop_server(server)
+            shutil.rmtree(tmp)
+        logg.debug("metalink:\n%s", changed)
+        self.assertEqual(first, cached)
+        self.assertNotEqual(first, changed)
+        self.assertIn(F"<size>{st.st_size + 1}</size>", changed)
+        self.assertIn(F"<mm:timestamp>{int(st.st_mtime)}</mm:timestamp>", first)
+    def test_00005_metalink_urls(self) -> None:
+        """ the same repomd.xml served for two mirror urls has the url of each in its metalink answer (no docker needed) """
+        tmp = "tmp.test_00005"
+        os.makedirs(F"{tmp}/9/Everything/x86_64/repodata", exist_ok=True)
+        make_file(F"{tmp}/9/Everything/x86_64/repodata/repomd.xml", "<repomd><revision>1</revision></repomd>\n")
+        metalink = "/metalink?repo=epel-9&arch=x86_64"
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "scripts/mirrorhosts.py", "--port", str(port), "--summary", "0", "--workers", "1",
+                                   "--route", F"epel-a a.example mirrors.fedoraproject.org.py --data {tmp} --url http://a.example",
+                                   "--route", F"epel-b b.example mirrors.fedoraproject.org.py --data {tmp} --url http://b.example"],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_port(port)
+            answers = [get_url(F"http://127.0.0.1:{port}{metalink}", host) for host in ["a.example", "b.example", "a.example"]]
+        finally:
+            server.kill()
+            server.wait()
+            shutil.rmtree(tmp)
+        logg.debug("metalink:\n%s", answers[1])
+        self.assertIn(">http://a.example/9/Everything/x86_64/repodata/repomd.xml</url>", answers[0])
+        self.assertIn(">http://b.example/9/Everything/x86_64/repodata/repomd.xml</url>", answers[1])
+        self.assertEqual(answers[0], answers[2])
+    def test_00006_metalink_index(self) -> None:
+        """ the precomputed metalink answer is the same as the one made on request (no docker needed) """
+        tmp = "tmp.test_00006"
+        os.makedirs(F"{tmp}/9/Everything/x86_64/repodata", exist_ok=True)
+        make_file(F"{tmp}/9/Everything/x86_64/repodata/repomd.xml",
+                  '<?xml version="1.0" ?>\n<repomd>\n<revision>1</revision>\n<data type="primary">\n<timestamp>1700000000</timestamp>\n</data>\n</repomd>\n')
+        metalink = "/metalink?repo=epel-9&arch=x86_64"
+        answers = []
+        try:
+            made = output(F"{sys.executable} scripts/mirrors.fedoraproject.org.py --data {tmp} --makeindex")
+            self.assertIn("made mirrorindex.json for 1 repos", made)
+            for _ in range(2):
+                port = free_port()
+                server = start_server("scripts/mirrors.fedoraproject.org.py", "--data", tmp, "--port", str(port))
+                try:
+                    wait_port(port)
+                    answers.append(get_url(F"http://127.0.0.1:{port}{metalink}"))
+                finally:
+                    stop_server(server)
+                drop_file(F"{tmp}/mirrorindex.json")  # the second answer is made on request
+        finally:
+            shutil.rmtree(tmp)
+        logg.debug("metalink:\n%s", answers[0])
+        self.assertIn(">http://mirrors.fedoraproject.org/9/Everything/x86_64/repodata/repomd.xml</url>", answers[0])
+        self.assertIn("<mm:timestamp>1700000000</mm:timestamp>", answers[0])
+        self.assertEqual(answers[0], answers[1])
+    def test_00007_accesslog(self) -> None:
+        """ the access log has a json line per request and a summary line per path prefix (no docker needed) """
+        tmp = "tmp.test_00007"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        make_file(F"{tmp}/7/os/a.txt", "hello\n")
+        accesslog = os.path.abspath(F"{tmp}/access.log")
+        port = free_port()
+        server = start_server("scripts/filelist.py", "--data", tmp, "--port", str(port), "--accesslog", accesslog, "--summary", "1")
+        try:
+            wait_port(port)
+            self.assertEqual(http_request(port, "/7/os/a.txt")[0].status, 200)
+            self.assertEqual(http_request(port, "/7/os/b.txt")[0].status, 404)
+            text = ""
+            started = time.monotonic()
+            while time.monotonic() - started < 5 and '"summary"' not in text:
+                time.sleep(0.1)
+                with open(accesslog) as f:
+                    text = f.read()
+        finally:
+            stop_server(server)
+            shutil.rmtree(tmp)
+        entries = [json.loads(line) for line in text.splitlines()]
+        logg.debug("accesslog: %s", entries)
+        requests = [entry for entry in entries if "path" in entry]
+        self.assertEqual([(entry["method"], entry["path"], entry["status"], entry["bytes"]) for entry in requests],
+                         [("GET", "/7/os/a.txt", 200, 6), ("GET", "/7/os/b.txt", 404, requests[1]["bytes"])])
+        self.assertEqual(requests[0]["client"], "127.0.0.1")
+        self.assertGreaterEqual(requests[0]["ms"], 0)
+        summaries = [entry for entry in entries if "summary" in entry]
+        self.assertEqual([(entry["summary"], entry["requests"]) for entry in summaries], [("/7/os", 2)])
+        self.assertEqual(summaries[0]["bytes"], 6 + requests[1]["bytes"])
+        self.assertLessEqual(summaries[0]["p50"], summaries[0]["p99"])
+    def test_00009_tls(self) -> None:  # pylint: disable=too-many-locals
+        """ the certificate is made by --makecert, a stalled handshake does not block the
+            other workers, and a client can resume its tls session (no docker needed) """
+        if not shutil.which("openssl"):
+            self.skipTest("no openssl to make the certificate")
+        tmp = "tmp.test_00009"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        make_file(F"{tmp}/7/os/a.txt", "hello\n")
+        certdir = os.path.abspath(tmp)
+        port = free_port()
+        url = F"https://localhost:{port}"
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        def https_get(session: Optional[ssl.SSLSession] = None) -> Tuple[bytes, Optional[ssl.SSLSession], Optional[bool]]:
+            sock = context.wrap_socket(socket.create_connection(("127.0.0.1", port), timeout=5), session=session)
+            with sock:
+                sock.sendall(b"GET /7/os/a.txt HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+                data = b""
+                while True:
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+                return data, sock.session, sock.session_reused
+        try:
+            sh____(F"{sys.executable} scripts/mirrors.fedoraproject.org.py --ssl {url} --certdir {certdir} --makecert >/dev/null")
+            pemfile = F"{certdir}/localhost.pem"
+            self.assertTrue(os.path.exists(pemfile))
+            made = os.path.getmtime(pemfile)
+            server = start_server("scripts/mirrors.fedoraproject.org.py", "--data", tmp, "--ssl", url, "--certdir", certdir, "--threads", "2")
+            try:
+                wait_port(port)
+                stalled = socket.create_connection(("127.0.0.1", port), timeout=5)
+                try:
+                    started = time.monotonic()
+                    data, session, _ = https_get()
+                    took = time.monotonic() - started
+                finally:
+                    stalled.close()
+                self.assertTrue(data.startswith(b"HTTP/1.1 200"))
+                self.assertTrue(data.endswith(b"\r\n\r\nhello\n"))
+                self.assertLess(took, 2.)
+                resumed, _, reused = https_get(session)
+                self.assertTrue(resumed.endswith(b"\r\n\r\nhello\n"))
+                self.assertTrue(reused)
+            finally:
+                stop_server(server)
+            self.assertEqual(os.path.getmtime(pemfile), made)
+        finally:
+            shutil.rmtree(tmp)
+    def test_00010_file_cache(self) -> None:
+        """ metadata files are answered from memory, a too big one is not read into it (no docker needed) """
+        tmp = "tmp.test_00010"
+        os.makedirs(F"{tmp}/7/os/repodata", exist_ok=True)
+        small = "<repomd/>\n" * 10
+        big = "<filelists/>\n" * 30000  # over a quarter of the 1MB cache
+        make_file(F"{tmp}/7/os/repodata/repomd.xml", small)
+        make_file(F"{tmp}/7/os/repodata/filelists.xml", big)
+        port = free_port()
+        server = start_server("scripts/filelist.py", "--data", tmp, "--port", str(port), "--cachesize", "1")
+        try:
+            wait_port(port)
+            for _ in range(3):
+                self.assertEqual(get_url(F"http://127.0.0.1:{port}/7/os/repodata/repomd.xml"), small)
+                self.assertEqual(get_url(F"http://127.0.0.1:{port}/7/os/repodata/filelists.xml"), big)
+            text = get_url(F"http://127.0.0.1:{port}/-/metrics")
+        finally:
+            stop_server(server)
+            shutil.rmtree(tmp)
+        logg.debug("metrics:\n%s", text)
+        self.assertIn("mirror_cache_files 1\n", text)
+        self.assertIn(F"mirror_cache_bytes {len(small)}\n", text)
+        hits = [line for line in text.splitlines() if line.startswith("mirror_cache_hits_total ")]
+        self.assertGreaterEqual(int(hits[0].split()[1]), 2)
+    def test_00010_file_cache_bypass(self) -> None:
+        """ a file too big for the cache is given as the open file for sendfile (no docker needed) """
+        sys.path.insert(0, "scripts")
+        import mirrorserver  # type: ignore[import-not-found]  # pylint: disable=import-outside-toplevel,import-error
+        tmp = "tmp.test_00010"
+        os.makedirs(F"{tmp}/repodata", exist_ok=True)
+        make_file(F"{tmp}/repodata/repomd.xml", "<repomd/>\n")
+        make_file(F"{tmp}/repodata/filelists.xml", "<filelists/>\n" * 30000)
+        try:
+            cache = mirrorserver.FileCache(1024 * 1024)
+            cache.prewarm_dirs(tmp)
+            self.assertEqual(cache.counters()["files"], 1)
+            f, st = cache.open(F"{tmp}/repodata/filelists.xml")
+            with f:
+                self.assertIsInstance(f, io.BufferedReader)
+                self.assertEqual(os.fstat(f.fileno()).st_size, st.st_size)
+            f, st = cache.open(F"{tmp}/repodata/repomd.xml")
+            self.assertIsInstance(f, io.BytesIO)
+            self.assertEqual(cache.counters(), {"hits": 1, "misses": 1, "bytes": st.st_size, "files": 1})
+        finally:
+            sys.path.remove("scripts")
+            shutil.rmtree(tmp)
+    def test_00010_metrics(self) -> None:
+        """ the scripts count their requests on /-/metrics (no docker needed) """
+        tmp = "tmp.test_00010"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        make_file(F"{tmp}/7/os/a.txt", "hello\n")
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "scripts/filelist.py", "--data", tmp, "--port", str(port), "--summary", "0", "--workers", "1"],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_port(port)
+            self.assertEqual(get_url(F"http://127.0.0.1:{port}/7/os/a.txt"), "hello\n")
+            with self.assertRaises(IOError):
+                get_url(F"http://127.0.0.1:{port}/7/os/b.txt")
+            text = get_url(F"http://127.0.0.1:{port}/-/metrics")
+        finally:
+            server.kill()
+            server.wait()
+            shutil.rmtree(tmp)
+        logg.debug("metrics:\n%s", text)
+        self.assertIn('mirror_requests_total{prefix="/7/os/a.txt"} 1', text)
+        self.assertIn('mirror_bytes_total{prefix="/7/os/a.txt"} 6', text)
+        self.assertIn('mirror_notfound_total{prefix="/7/os/b.txt"} 1', text)
+        self.assertIn('mirror_inflight_requests 1', text)
+        self.assertIn('mirror_request_seconds_count{prefix="/7/os/a.txt"} 1', text)
+    def test_00011_workers(self) -> None:
+        """ the worker processes share the port and add up their /-/metrics (no docker needed) """
+        tmp = "tmp.test_00011"
+        os.makedirs(F"{tmp}/7/os", exist_ok=True)
+        make_file(F"{tmp}/7/os/a.txt", "hello\n")
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "scripts/filelist.py", "--data", tmp, "--port", str(port), "--summary", "0", "--workers", "3"],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_port(port)
+            for _ in range(12):
+                self.assertEqual(get_url(F"http://127.0.0.1:{port}/7/os/a.txt"), "hello\n")
+            time.sleep(1.5)  # SHAREINTERVAL
+            text = get_url(F"http://127.0.0.1:{port}/-/metrics")
+            server.terminate()
+            self.assertEqual(server.wait(10), 0)
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+            shutil.rmtree(tmp)
+        logg.debug("metrics:\n%s", text)
+        self.assertIn('mirror_workers 3', text)
+        self.assertIn('mirror_requests_total{prefix="/7/os/a.txt"} 12', text)
+        self.assertIn('mirror_bytes_total{prefix="/7/os/a.txt"} 72', text)
+    def test_00012_vhosts(self) -> None:
+        """ one server for several mirrors by Host header or mirror name (no docker needed) """
+        tmp = "tmp.test_00012"
+        os.makedirs(F"{tmp}/ubuntu/ubuntu/dists", exist_ok=True)
+        os.makedirs(F"{tmp}/opensuse/distribution", exist_ok=True)
+        make_file(F"{tmp}/ubuntu/ubuntu/dists/a.txt", "ubuntu\n")
+        make_file(F"{tmp}/opensuse/distribution/a.txt", "opensuse\n")
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "scripts/mirrorhosts.py", "--port", str(port), "--summary", "0", "--workers", "1",
+                                   "--route", F"ubuntu-repo-24.04 archive.ubuntu.com /srv/scripts/filelist.py --data {tmp}/ubuntu",
+                                   "--route", F"opensuse-repo-15.6 download.opensuse.org filelist.py --data {tmp}/opensuse",
+                                   "--route", F"centos-repo-7.9.2009 mirrorlist.centos.org mirrorlist.py --data {tmp}"],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_port(port)
+            url = F"http://127.0.0.1:{port}"
+            self.assertEqual(get_url(F"{url}/ubuntu/dists/a.txt", "archive.ubuntu.com"), "ubuntu\n")
+            self.assertEqual(get_url(F"{url}/distribution/a.txt", "download.opensuse.org:80"), "opensuse\n")
+            self.assertEqual(get_url(F"{url}/opensuse-repo-15.6/distribution/a.txt"), "opensuse\n")
+            self.assertEqual(get_url(F"{url}/?release=7&arch=x86_64&repo=os", "mirrorlist.centos.org"),
+                             "http://mirrorlist.centos.org/7/os/x86_64/\n")
+            with self.assertRaises(IOError):
+                get_url(F"{url}/distribution/a.txt", "archive.ubuntu.com")
+        finally:
+            server.kill()
+            server.wait()
+            shutil.rmtree(tmp)
+    def test_00013_repodata_fix(self) -> None:
+        """ repomd.xml gets the renamed repodata files with their checksums (no docker needed) """
+        tmp = "tmp.test_00013"
+        os.makedirs(F"{tmp}/repodata", exist_ok=True)
+        content = b"<filelists>\n" * 1000
+        packed = gzip.compress(content)
+        with open(F"{tmp}/repodata/1234-filelists.xml.gz", "wb") as f:
+            f.write(packed)
+        make_file(F"{tmp}/repodata/repomd.xml", '<?xml version="1.0" ?><repomd><data type="filelists">'
+                  '<checksum type="sha512">0</checksum><open-checksum type="sha512">0</open-checksum>'
+                  '<location href="repodata/abcd-filelists.xml.gz"/><size>0</size><open-size>0</open-size></data></repomd>')
+        try:
+            summary = output(F"{sys.executable} scripts/repodata-fix.py {tmp}")
+            self.assertIn("1 repomd.xml, 1 fixed with 1 entries", summary)
+            with open(F"{tmp}/repodata/repomd.xml") as f:
+                text = f.read()
+            self.assertIn('href="repodata/1234-filelists.xml.gz"', text)
+            self.assertIn(F'<checksum type="sha512">{hashlib.sha512(packed).hexdigest()}</checksum>', text)
+            self.assertIn(F'<open-checksum type="sha512">{hashlib.sha512(content).hexdigest()}</open-checksum>', text)
+            self.assertIn(F"<size>{len(packed)}</size>", text)
+            self.assertIn(F"<open-size>{len(content)}</open-size>", text)
+            self.assertTrue(os.path.exists(F"{tmp}/repodata/repomd.xml.old"))
+            shutil.copy(F"{tmp}/repodata/repomd.xml.old", F"{tmp}/repodata/repomd.xml")
+            summary = output(F"{sys.executable} scripts/repodata-fix.py {tmp}")
+            self.assertIn("0.0 MB hashed, 1 cached", summary)
+        finally:
+            shutil.rmtree(tmp)
+    def test_00014_repodata_batch(self) -> None:
+        """ a repomd.xml that can not be parsed is counted, with --keep-going it does not fail the run (no docker needed) """
+        tmp = "tmp.test_00014"
+        os.makedirs(F"{tmp}/a/repodata", exist_ok=True)
+        os.makedirs(F"{tmp}/b/repodata", exist_ok=True)
+        make_file(F"{tmp}/a/repodata/repomd.xml", '<?xml version="1.0" ?><repomd></repomd>')
+        make_file(F"{tmp}/b/repodata/repomd.xml", "(zstd)")
+        try:
+            failing = runs(F"{sys.executable} scripts/repodata-fix.py {tmp}")
+            self.assertEqual(failing.rc, 1)
+            self.assertIn("2 repomd.xml, 0 fixed with 0 entries", failing.out)
+            self.assertIn("1 failed", failing.out)
+            going = runs(F"{sys.executable} scripts/repodata-fix.py {tmp} --keep-going")
+            self.assertEqual(going.rc, 0)
+            self.assertIn("1 failed", going.out)
+        finally:
+            shutil.rmtree(tmp)
+    def test_00015_metalink_readonly(self) -> None:
+        """ answering a metalink does not write into the mirror tree, the index step does (no docker needed) """
+        tmp = "tmp.test_00015"
+        repodata = F"{tmp}/9/Everything/x86_64/repodata"
+        os.makedirs(repodata, exist_ok=True)
+        make_file(F"{repodata}/repomd.xml", '<?xml version="1.0" ?>\n<repomd>\n<timestamp>1700000000</timestamp>\n</repomd>\n')
+        os.utime(F"{repodata}/repomd.xml", (1600000000, 1600000000))
+        port = free_port()
+        server = start_server("scripts/mirrors.fedoraproject.org.py", "--data", tmp, "--port", str(port))
+        try:
+            wait_port(port)
+            answer = get_url(F"http://127.0.0.1:{port}/metalink?repo=epel-9&arch=x86_64")
+            self.assertIn("<mm:timestamp>1700000000</mm:timestamp>", answer)
+            self.assertEqual(sorted(os.listdir(repodata)), ["repomd.xml"])
+            self.assertEqual(os.path.getmtime(F"{repodata}/repomd.xml"), 1600000000)
+            output(F"{sys.executable} scripts/mirrors.fedoraproject.org.py --data {tmp} --makeindex")
+            self.assertIn(".checksums.json", os.listdir(repodata))
+            self.assertEqual(os.path.getmtime(F"{repodata}/repomd.xml"), 1600000000)
+        finally:
+            stop_server(server)
+            shutil.rmtree(tmp)
+    def test_00016_parallel_start(self) -> None:
+        """ the mirrors of an image are started at the same time (no docker needed) """
+        tmp = "tmp.test_00016"
+        engine, cmd, env = self.fake_engine(tmp, self.listening_port())
+        engine.startdelay = 2.
+        make_file(F"{tmp}/docker_mirror.ini", "[epel-repo:9.4.2405]\nimage = localhost:5000/mirror-packages/epel-repo:9.4.2405\n")
+        started = time.monotonic()
+        proc = subprocess.run(cmd + ["start", "almalinux:9.4", "--epel"], env=env, stdout=subprocess.PIPE, check=True)
+        took = time.monotonic() - started
+        self.assertEqual(json.loads(proc.stdout), {"almalinux-repo-9.4": "127.0.0.1", "epel-repo-9.4.2405": "127.0.0.1"})
+        self.assertEqual(sorted(engine.containers), ["almalinux-repo-9.4", "epel-repo-9.4.2405"])
+        self.assertEqual([json_value(container, "State", "Status") for container in engine.containers.values()], ["running", "running"])
+        self.assertEqual(engine.requested("POST /containers/id-"), 2)
+        self.assertLess(took, 3.5)  # one after the other takes over 4 seconds
+    def test_00017_probes(self) -> None:
+        """ start waits for the port of the mirror, and stats asks the same port (no docker needed) """
+        tmp = "tmp.test_00017"
+        port = free_port()
+        engine, cmd, env = self.fake_engine(tmp, port)
+        os.makedirs(F"{tmp}/data/7/os", exist_ok=True)
+        make_file(F"{tmp}/data/7/os/a.txt", "hello\n")
+        servers: List["subprocess.Popen[bytes]"] = []
+        def later() -> None:
+            time.sleep(0.5)
+            servers.append(start_server("scripts/filelist.py", "--data", F"{tmp}/data", "--port", str(port)))
+        opening = threading.Thread(target=later)
+        try:
+            opening.start()
+            started = time.monotonic()
+            proc = subprocess.run(cmd + ["start", "opensuse/leap:15.6", "--probe"], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            took = time.monotonic() - started
+            opening.join()
+            self.assertEqual(json.loads(proc.stdout), {"opensuse-repo-15.6": "127.0.0.1"})
+            self.assertNotIn(b"not ready", proc.stderr)
+            self.assertGreater(took, 0.5)
+            self.assertLess(took, 5.)  # MAXWAIT is 6
+            self.assertEqual(get_url(F"http://127.0.0.1:{port}/7/os/a.txt"), "hello\n")
+            proc = subprocess.run(cmd + ["stats", "opensuse/leap:15.6"], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            logg.debug("stats:\n%s", decodes(proc.stdout))
+            self.assertNotIn(b"no metrics", proc.stderr)
+            self.assertIn("/7/os/a.txt", decodes(proc.stdout))
+        finally:
+            opening.join()
+            for server in servers:
+                stop_server(server)
+    def test_00018_engine_api(self) -> None:
+        """ start and stop with the engine API on a fake unix socket (no docker needed) """
+        engine, cmd, env = self.fake_engine("tmp.test_00018", self.listening_port())
+        started = json.loads(subprocess.check_output(cmd + ["start", "opensuse/leap:15.6"], env=env))
+        self.assertEqual(started, {"opensuse-repo-15.6": "127.0.0.1"})
+        self.assertEqual(json_value(engine.containers["opensuse-repo-15.6"], "State", "Status"), "running")
+        self.assertEqual(json_value(engine.containers["opensuse-repo-15.6"], "Config", "HostConfig", "AutoRemove"), True)
+        self.assertLess(engine.connections, len(engine.requests))
+        stopped = json.loads(subprocess.check_output(cmd + ["stop", "opensuse/leap:15.6"], env=env))
+        self.assertEqual(list(stopped), ["opensuse-repo-15.6"])
+        self.assertNotIn("opensuse-repo-15.6", engine.containers)
+        detected = decodes(subprocess.check_output(cmd + ["detect", "example/unknown:1.0"], env=env))
+        self.assertEqual(detected.strip(), "opensuse/leap:15.6")
+        archives = [request for request in engine.requests if "/containers/docker_mirror_detect.unknown.1.0/archive" in request]
+        self.assertEqual(archives, ["GET /containers/docker_mirror_detect.unknown.1.0/archive?path=%2Fetc",
+                                    "GET /containers/docker_mirror_detect.unknown.1.0/archive?path=%2Fusr%2Flib%2Fos-release"])
+    def test_00019_detect_cache(self) -> None:
+        """ the detected base image is cached by the image id (no docker needed) """
+        tmp = "tmp.test_00019"
+        engine, cmd, env = self.fake_engine(tmp)
+        archived = "POST /containers/create?name=docker_mirror_detect."
+        detected = decodes(subprocess.check_output(cmd + ["detect", "example/cached:2.0"], env=env))
+        self.assertEqual(detected.strip(), "opensuse/leap:15.6")
+        self.assertEqual(engine.requested(archived), 1)
+        with open(F"{tmp}/cache/detect.json") as f:
+            self.assertEqual(json.load(f)["sha256:/images/example/cached:2.0/json"]["detected"], "opensuse/leap:15.6")
+        detected = decodes(subprocess.check_output(cmd + ["detect", "example/cached:2.0"], env=env))
+        self.assertEqual(detected.strip(), "opensuse/leap:15.6")
+        self.assertEqual(engine.requested(archived), 1)
+        detected = decodes(subprocess.check_output(cmd + ["detect", "example/cached:2.0", "--refresh"], env=env))
+        self.assertEqual(detected.strip(), "opensuse/leap:15.6")
+        self.assertEqual(engine.requested(archived), 2)
+    def test_00021_mirror_plan(self) -> None:
+        """ the mirrors of an image are resolved once per command (no docker needed) """
+        tmp = "tmp.test_00021"
+        engine, cmd, env = self.fake_engine(tmp)
+        make_file(F"{tmp}/docker_mirror.ini", "[epel-repo:9.4.2405]\nimage = localhost:5000/mirror-packages/epel-repo:9.4.2405\nmount = /srv/epel\n")
+        plan = json.loads(subprocess.check_output(cmd + ["plan", "almalinux:9.4", "--epel"], env=env))
+        self.assertEqual(plan["version"], "9.4-20240530")
+        self.assertEqual([mirror["name"] for mirror in plan["mirrors"]], ["almalinux-repo-9.4", "epel-repo-9.4.2405"])
+        self.assertEqual(plan["mirrors"][1]["mount"], "/srv/epel")
+        self.assertEqual(plan["calls"]["config"], 1)
+        self.assertEqual(engine.requested("GET /images/json?filters=%7B%22reference"), 1)
+        facts = json.loads(subprocess.check_output(cmd + ["facts", "almalinux:9.4", "--epel"], env=env))
+        self.assertEqual(list(facts), ["almalinux-repo-9.4", "epel-repo-9.4.2405"])
+    def test_00022_repo_catalog(self) -> None:
+        """ the repo images are listed again only after image events (no docker needed) """
+        tmp = "tmp.test_00022"
+        engine, cmd, env = self.fake_engine(tmp)
+        listed = "GET /images/json?filters=%7B%22reference"
+        self.assertEqual(json.loads(subprocess.check_output(cmd + ["plan", "almalinux:9.5", "--epel"], env=env))["mirrors"][1]["image"],
+                         "localhost:5000/mirror-packages/epel-repo:9.4.2405")
+        self.assertEqual(engine.requested(listed), 1)
+        with open(F"{tmp}/cache/catalog.json") as f:
+            self.assertEqual(json.load(f)["entries"][0][:4], ["epel-repo", "9", "2405", "9.4.2405"])
+        self.assertEqual(json.loads(subprocess.check_output(cmd + ["plan", "almalinux:9.4", "--epel"], env=env))["mirrors"][1]["image"],
+                         "localhost:5000/mirror-packages/epel-repo:9.4.2405")
+        self.assertEqual(engine.requested(listed), 1)
+        engine.events.append({"Type": "image", "Action": "tag"})
+        self.assertEqual(json.loads(subprocess.check_output(cmd + ["plan", "almalinux:9.4", "--epel"], env=env))["mirrors"][1]["image"],
+                         "localhost:5000/mirror-packages/epel-repo:9.4.2405")
+        self.assertEqual(engine.requested(listed), 2)
+    def test_00023_labelled_mirror(self) -> None:
+        """ a repo image is found by its labels in one listing (no docker needed) """
+        engine, cmd, env = self.fake_engine("tmp.test_00023")
+        label = "com.github.gdraheim.docker-mirror"
+        engine.images.append({"Id": "sha256:opensuse", "RepoTags": ["localhost:5000/mirror-packages/opensuse-repo:15.6.1"],
+                              "Labels": {F"{label}.distro": "opensuse", F"{label}.version": "15.6.1", F"{label}.baseimage": "opensuse/leap:15.6",
+                                         F"{label}.hosts": "download.opensuse.org,cdn.opensuse.org", F"{label}.port": "80"}})
+        plan = json.loads(subprocess.check_output(cmd + ["plan", "opensuse/leap:15.6"], env=env))
+        self.assertEqual(plan["mirrors"], [{"name": "opensuse-repo-15.6.1", "image": "localhost:5000/mirror-packages/opensuse-repo:15.6.1",
+                                            "hosts": ["download.opensuse.org", "cdn.opensuse.org"], "mount": ""}])
+        self.assertEqual(engine.requested("GET /images/json?filters=%7B%22label"), 1)
+        plan = json.loads(subprocess.check_output(cmd + ["plan", "opensuse/leap:15.5"], env=env))
+        self.assertEqual(plan["mirrors"][0]["image"], "localhost:5000/mirror-packages/opensuse-repo:15.5")
+        self.assertEqual(engine.requested("GET /images/json"), 2)  # listed once with the catalog
+    def test_00024_daemon(self) -> None:
+        """ the cli asks a running daemon, which keeps the plan until image events (no docker needed) """
+        tmp = "tmp.test_00024"
+        engine, cmd, env = self.fake_engine(tmp)
+        listed = "GET /images/json?filters=%7B%22label"
+        daemon = subprocess.Popen(cmd + ["serve"], env=env)
+        self.addCleanup(daemon.wait)
+        self.addCleanup(daemon.terminate)
+        for _ in range(100):
+            if os.path.exists(F"{tmp}/daemon.sock") and engine.requested("GET /events?filters"):
+                break
+            time.sleep(0.05)
+        before = engine.requested(listed)
+        plan = json.loads(subprocess.check_output(cmd + ["plan", "opensuse/leap:15.6"], env=env))
+        self.assertEqual(plan["mirrors"][0]["name"], "opensuse-repo-15.6")
+        self.assertEqual(engine.requested(listed), before + 1)
+        self.assertEqual(json.loads(subprocess.check_output(cmd + ["plan", "opensuse/leap:15.6"], env=env))["mirrors"], plan["mirrors"])
+        self.assertEqual(engine.requested(listed), before + 1)
+        engine.events.append({"Type": "image", "Action": "tag", "id": "sha256:opensuse"})
+        time.sleep(0.3)
+        self.assertEqual(json.loads(subprocess.check_output(cmd + ["plan", "opensuse/leap:15.6"], env=env))["mirrors"], plan["mirrors"])
+        self.assertEqual(engine.requested(listed), before + 2)
+        self.assertEqual(json.loads(subprocess.check_output(cmd + ["plan", "opensuse/leap:15.6", "--nodaemon"], env=env))["mirrors"], plan["mirrors"])
+        self.assertEqual(engine.requested(listed), before + 3)
+        self.assertEqual(subprocess.call(cmd + ["start", "--no-detect"], env=env), os.EX_USAGE)
+        self.assertEqual(os.stat(F"{tmp}/daemon.sock").st_mode & 0o777, 0o600)
+        def asked_mirrors(options: Dict[str, object]) -> List[object]:
+            request = {"command": "plan", "image": "almalinux:9.4", "options": dict(options, DOCKER="no-such-docker", BACKEND="api")}
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(F"{tmp}/daemon.sock")
+                sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+                answer = json.loads(sock.makefile().readline())
+            return cast(List[object], json.loads(answer["output"])["mirrors"])
+        self.assertEqual(len(asked_mirrors({"ADDEPEL": True})), 2)
+        self.assertEqual(len(asked_mirrors({})), 1)  # not kept from the last client
+    def test_00025_leases(self) -> None:
+        """ a shared mirror keeps running until the last build releases its lease (no docker needed) """
+        engine, cmd, env = self.fake_engine("tmp.test_00025", self.listening_port())
+        for lease in ["build.1", "build.2"]:
+            started = json.loads(subprocess.check_output(cmd + ["start", "opensuse/leap:15.6", "--lease", lease], env=env))
+            self.assertEqual(started, {"opensuse-repo-15.6": "127.0.0.1"})
+        self.assertEqual(engine.requested("POST /containers/create"), 1)
+        stopped = json.loads(subprocess.check_output(cmd + ["stop", "opensuse/leap:15.6", "--lease", "build.1"], env=env))
+        self.assertEqual(stopped, {"opensuse-repo-15.6": "(leased 1)"})
+        self.assertIn("opensuse-repo-15.6", engine.containers)
+        stopped = json.loads(subprocess.check_output(cmd + ["stop", "opensuse/leap:15.6"], env=env))
+        self.assertEqual(stopped, {"opensuse-repo-15.6": "(leased 1)"})
+        self.assertIn("opensuse-repo-15.6", engine.containers)
+        stopped = json.loads(subprocess.check_output(cmd + ["stop", "opensuse/leap:15.6", "--lease", "build.2", "--grace", "1"], env=env))
+        self.assertEqual(stopped, {"opensuse-repo-15.6": "(stops in 1s)"})
+        self.assertIn("opensuse-repo-15.6", engine.containers)
+        subprocess.check_output(cmd + ["start", "opensuse/leap:15.6", "--lease", "build.3"], env=env)
+        time.sleep(1.5)
+        self.assertIn("opensuse-repo-15.6", engine.containers)
+        subprocess.check_output(cmd + ["stop", "opensuse/leap:15.6", "--lease", "build.3"], env=env)
+        self.assertNotIn("opensuse-repo-15.6", engine.containers)
     def test_10073_centos(self) -> None:
         prefix = PREFIX
         docker = DOCKER
@@ -706,6 +1591,44 @@ class DockerMirrorPackagesTest(unittest.TestCase):
         sh____(F"{mirrors} facts {base_image}")
         sh____(F"{mirrors} start {base_image} --add-hosts")
         sh____(F"{mirrors} stop {base_image}")
+    def test_20001_centos_stats(self) -> None:
+        prefix = PREFIX
+        docker = DOCKER
+        mirrors = _docker_mirror
+        repo_image = "centos-repo:7.3.1611"
+        base_image = "centos:7.3.1611"
+        if not os.path.exists(DOCKER_SOCKET): self.skipTest("docker-base test")
+        if not image_exists(prefix, repo_image): self.skipTest("have no " + repo_image)
+        if DRYRUN: return
+        sh____(F"{mirrors} start {base_image} --add-hosts")
+        stats = output(F"{mirrors} stats {base_image}")
+        sh____(F"{mirrors} stop {base_image}")
+        logg.info("stats:\n%s", stats)
+        self.assertIn("CONTAINER", stats)
+        self.assertIn("(in flight)", stats)
+    def test_20002_shared(self) -> None:
+        """ one shared container for the mirrors of centos and ubuntu """
+        prefix = PREFIX
+        docker = DOCKER
+        mirrors = _docker_mirror
+        centos_image = "centos:7.9.2009"
+        ubuntu_image = "ubuntu:24.04"
+        if not os.path.exists(DOCKER_SOCKET): self.skipTest("docker-base test")
+        repo_image1 = output(F"{mirrors} repo {centos_image}").strip()
+        repo_image2 = output(F"{mirrors} repo {ubuntu_image}").strip()
+        if not image_exist(repo_image1): self.skipTest("have no " + repo_image1)
+        if not image_exist(repo_image2): self.skipTest("have no " + repo_image2)
+        if DRYRUN: return
+        add_host = output(F"{mirrors} shared {centos_image} {ubuntu_image} --add-hosts").strip()
+        logg.info("add-host %s", add_host)
+        sx____(F"{docker} rm -f test-box1")
+        sh____(F"{docker} run -d --name test-box1 {add_host} {ubuntu_image} sleep 600")
+        sh____(F"{docker} exec test-box1 apt-get update")
+        sx____(F"{docker} rm -f test-box1")
+        sh____(F"{mirrors} unshare")
+        self.assertIn("mirrorlist.centos.org", add_host)
+        self.assertIn("archive.ubuntu.com", add_host)
+        self.assertEqual(len(set(arg.split(":")[-1] for arg in add_host.split() if ":" in arg)), 1)
     def test_20073_centos(self) -> None:
         docker = DOCKER
         mirror = _docker_mirror
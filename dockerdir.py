@@ -96,8 +96,8 @@ class DockerScripts:
         docker_mirror = _docker_mirror
         if path.exists(path.join(dockerdir, docker_mirror)):
             dockerfilename = path.basename(dockerfile)
-            mirror_start = "./{docker_mirror} -f {dockerfilename} -a start".format(**locals())
-            mirror_stop = "./{docker_mirror} -f {dockerfilename} -a stop".format(**locals())
+            mirror_start = "./{docker_mirror} -f {dockerfilename} -a start --lease build.$$".format(**locals())
+            mirror_stop = "./{docker_mirror} -f {dockerfilename} -a stop --lease build.$$".format(**locals())
         # generate ........................................................
         _taglist = [tag for tag in ENV if tag.startswith("_tag")]
         if _commit in ENV:
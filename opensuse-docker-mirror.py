@@ -28,6 +28,7 @@ NIX = ""
 TRUE = 1
 NOBASE = False
 IMAGESREPO = os.environ.get("IMAGESREPO", "localhost:5000/mirror-packages")
+LABELS = "com.github.gdraheim.docker-mirror"  # prefix of the labels on the repo images
 REPODATADIR = os.environ.get("REPODATADIR", "")
 REPODIR = os.environ.get("REPODIR", "repo.d")
 
@@ -59,6 +60,7 @@ OPENSUSE["15.4"] = "opensuse/leap"
 OPENSUSE["15.5"] = "opensuse/leap"
 OPENSUSE["15.6"] = "opensuse/leap"
 OPENSUSE["16.0"] = "opensuse/leap"
+CHECKSUMS = ".checksums.json"  # repodata-fix.py cache kept with the synced repo, the disk srv/repo is linked from it
 NEEDCREATEREPO: List[str] = []  # ["15.2"] # obsolete, using repodata-fix.py now
 LEAP: str = "15.5"
 VARIANT = ""
@@ -76,6 +78,7 @@ ARCHLIST = [ "x86_64", "aarch64", "s390x", "ppc", "ppc64le" ]
 ARCHS = ["x86_64"]
 
 DISTROPYTHON = "python3"
+THREADS = 8 # worker threads of the scripts in the repo containers
 BASELAYER = "base"
 MAKEMINI = False
 CREATEREPO = 0
@@ -227,6 +230,7 @@ def opensuse_sync_pack_(dist: str, repo: str, filters: Optional[List[str]] = Non
 
 opensuserepo_CMD = [F"/usr/bin/{DISTROPYTHON}", "/srv/scripts/filelist.py", "--data", "/srv/repo"]
 opensuserepo_PORT = "80"
+opensuserepo_HOSTS = "download.opensuse.org"
 def opensuse_base() -> str:
     return opensuse_repo(True)
 def opensuse_repo(onlybase: bool = False) -> str:
@@ -261,10 +265,13 @@ def opensuse_repo(onlybase: bool = False) -> str:
         sh___(F"{docker} exec {cname} bash -c 'zypper install -y -r {oss} createrepo || zypper install -y -r {oss} createrepo_c'")
     if bind_repo:
         sh___(F"{docker} exec {cname} zypper rr {oss}")
-    CMD = str(opensuserepo_CMD).replace("'", '"')
+    CMD = str(opensuserepo_CMD + ["--threads", str(THREADS)]).replace("'", '"')
     PORT = opensuserepo_PORT
     base = BASELAYER
-    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
+    labels: Dict[str, Union[str, int]] = {"distro": distro, "version": version, "baseimage": baseimage,
+                                          "hosts": opensuserepo_HOSTS, "port": PORT, "data": "/srv/repo"}
+    LABEL = commit_labels(layer=base, **labels)
+    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
     dists: Dict[str, List[str]] = OrderedDict()
     if not onlybase:
         dists["main"] = ["distribution"]
@@ -278,7 +285,7 @@ def opensuse_repo(onlybase: bool = False) -> str:
             if path.isdir(pooldir):
                 sh___(F"{docker} cp {pooldir} {cname}:/srv/repo/")
                 base = dist
-                sh___(F"{docker} exec {cname} bash -c \"find /srv/repo/{subdir} -name repomd.xml -exec {python} /srv/scripts/repodata-fix.py {{}} -v ';'\" ")
+                sh___(F"{docker} exec {cname} {python} /srv/scripts/repodata-fix.py /srv/repo/{subdir} -v --keep-going --nocache")
             else:
                 logg.warning("did not find pooldir %s", pooldir)
         if dist in ["update"]:
@@ -288,7 +295,8 @@ def opensuse_repo(onlybase: bool = False) -> str:
                 sh___(F""" {docker} exec {cname} bash -c "cd /srv/repo/{dist}/leap/{leap}/oss && rm -rv repodata" """)
                 sh___(F""" {docker} exec {cname} bash -c "cd /srv/repo/{dist}/leap/{leap}/oss && createrepo ." """)
         if base == dist:
-            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
+            LABEL = commit_labels(layer=base, **labels)
+            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
     sh___(F"{docker} rm --force {cname}")
     if base != BASELAYER:
         sh___(F"{docker} tag {imagesrepo}/{distro}-repo/{base}:{version} {imagesrepo}/{distro}-repo:{version}")
@@ -359,7 +367,7 @@ def opensuse_disk(onlybase: bool = False) -> str:
             pooldir = F"{repodir}/{distro}.{version}/{subdir}"
             if path.isdir(pooldir):
                 sh___(F"cp -r --link --no-clobber {pooldir} {srv}/repo/")
-                sh___(F"find {srv}/repo/{subdir} -name repomd.xml -exec {scripts}/repodata-fix.py {{}} -v ';' ")
+                sh___(F"{scripts}/repodata-fix.py {srv}/repo/{subdir} -v --keep-going --cache {repodir}/{distro}.{version}/{CHECKSUMS}")
             else:
                 logg.warning("no such pooldir: %s", pooldir)
             if CREATEREPO > 1:
@@ -405,6 +413,11 @@ def find_path(exe: str, default: str = NIX) -> str:
 
 def opensuse_scripts() -> None:
     print(repo_scripts())
+def commit_labels(**labels: Union[str, int]) -> str:
+    """ the 'docker commit' changes for the LABELS of a repo image, which let
+        docker_mirror.py find the mirror for an image without its version tables """
+    return " ".join([F"-c 'LABEL {LABELS}.{name}=\"{value}\"'" for name, value in labels.items()])
+
 def repo_scripts() -> str:
     me = os.path.dirname(sys.argv[0]) or "."
     dn = os.path.join(me, "scripts")
@@ -540,6 +553,7 @@ if __name__ == "__main__":
     cmdline.add_option("-D", "--docker", metavar="EXE", default=DOCKER,   help="alternative to [%default] (e.g. podman)")
     cmdline.add_option("--rsync", metavar="EXE", default=RSYNC, help="alternative to [%default]")
     cmdline.add_option("--distropython", metavar="EXE", default=DISTROPYTHON,  help="alternative to ./scripts [%default] runner")
+    cmdline.add_option("--threads", metavar="NUM", default=THREADS, help="worker threads of ./scripts in the repo image [%default]")
     cmdline.add_option("-R", "--nobase", action="store_true", default=NOBASE,
                        help="rm */base when repo image is ready [%default]")
     cmdline.add_option("--repodir", metavar="DIR", default=REPODIR,
@@ -581,5 +595,6 @@ if __name__ == "__main__":
     DOCKER = opt.docker
     RSYNC = opt.rsync
     DISTROPYTHON = opt.python
+    THREADS = int(opt.threads)
     LEAP_set(opt.ver)
     sys.exit(_main(cmdline_args or ["list"]))
@@ -0,0 +1,117 @@
+#! /usr/bin/python3
+""" a sidecar file with the checksums of the repodata files, so that they are not
+    hashed again when nothing has changed. An entry is keyed by the device and the
+    inode of the file and is only valid for the same size and mtime_ns. Writers merge
+    their entries under a flock and replace the file atomically. (python2 compatible)"""
+
+__copyright__ = "(C) 2018-2025 Guido Draheim"
+__contact__ = "https://github.com/gdraheim/docker-mirror-packages-repo"
+__license__ = "CC0 Creative Commons Zero (Public Domain)"
+__version__ = "1.7.7122"
+
+import os
+import os.path
+import json
+import threading
+import fcntl
+import time
+
+import logging
+logg = logging.getLogger("CHECKSUMS")
+
+SIDECAR = ".checksums.json"  # in the repodata directory
+MAXAGE = 90 * 24 * 60 * 60  # seconds to keep the entry of a file that is not there
+
+def mtime_ns(st):
+    """ st_mtime_ns is not in python2 """
+    return getattr(st, "st_mtime_ns", None) or int(st.st_mtime * 1000000000)
+
+def file_key(st):
+    return "%i:%i" % (st.st_dev, st.st_ino)
+
+class ChecksumCache(object):
+    """ kind -> values per file, where the kind is a checksum type like 'sha256' """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = None  # loaded on first use
+        self.changed = {}
+    def read(self):
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, OSError, ValueError) as e:
+            logg.debug("no checksums in %s: %s", self.filename, e)
+        return {}
+    def get(self, path, kind):
+        """ the values stored for the file, if it was not changed since """
+        st = os.stat(path)
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.read()
+            entry = self.entries.get(file_key(st))
+        if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == mtime_ns(st):
+            values = entry.get(kind)
+            if isinstance(values, dict):
+                return values
+        return None
+    def put(self, path, kind, values):
+        st = os.stat(path)
+        key = file_key(st)
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.read()
+            entry = self.entries.get(key)
+            if not entry or entry.get("size") != st.st_size or entry.get("mtime_ns") != mtime_ns(st):
+                entry = {"path": os.path.abspath(path), "size": st.st_size, "mtime_ns": mtime_ns(st)}
+            entry[kind] = values
+            entry["time"] = int(time.time())
+            self.entries[key] = entry
+            self.changed[key] = entry
+    def save(self):
+        """ merge the changes into the file on disk, dropping the entries of files that
+            were changed, or that are gone for a while (a tree may be copied again later).
+            A read-only place is not an error. """
+        with self.lock:
+            changed, self.changed = self.changed, {}
+        if not changed:
+            return False
+        try:
+            with open(self.filename + ".lock", "a") as lockfile:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+                entries = self.read()
+                for key, entry in changed.items():
+                    old = entries.get(key)
+                    if old and old.get("size") == entry["size"] and old.get("mtime_ns") == entry["mtime_ns"]:
+                        old.update(entry)
+                    else:
+                        entries[key] = entry
+                oldest = time.time() - MAXAGE
+                for key in list(entries):
+                    entry = entries[key]
+                    stamp = entry.get("time", 0)
+                    try:
+                        filepath = entry["path"]
+                        if isinstance(filepath, (int, dict)):
+                            raise TypeError("no path in %s" % key)
+                        st = os.stat(filepath)
+                        if file_key(st) == key and entry["size"] == st.st_size and entry["mtime_ns"] == mtime_ns(st):
+                            continue
+                    except OSError:
+                        if isinstance(stamp, int) and stamp > oldest:
+                            continue
+                    except (KeyError, TypeError):
+                        pass
+                    del entries[key]
+                tmpfile = "%s.%i.tmp" % (self.filename, os.getpid())
+                with open(tmpfile, "w") as f:
+                    json.dump(entries, f, indent=1, sort_keys=True)
+                os.rename(tmpfile, self.filename)
+            with self.lock:
+                self.entries = entries
+            return True
+        except (IOError, OSError) as e:
+            logg.debug("can not save checksums to %s: %s", self.filename, e)
+            return False
@@ -0,0 +1,21 @@
+#! /usr/bin/python3
+from typing import Dict, Optional, Union
+import os
+import threading
+
+SIDECAR: str
+MAXAGE: int
+
+def mtime_ns(st: os.stat_result) -> int: ...
+def file_key(st: os.stat_result) -> str: ...
+
+class ChecksumCache(object):
+    filename: str
+    lock: threading.Lock
+    entries: Optional[Dict[str, Dict[str, Union[str, int, Dict[str, Union[str, int]]]]]]
+    changed: Dict[str, Dict[str, Union[str, int, Dict[str, Union[str, int]]]]]
+    def __init__(self, filename: str) -> None: ...
+    def read(self) -> Dict[str, Dict[str, Union[str, int, Dict[str, Union[str, int]]]]]: ...
+    def get(self, path: str, kind: str) -> Optional[Dict[str, Union[str, int]]]: ...
+    def put(self, path: str, kind: str, values: Dict[str, Union[str, int]]) -> None: ...
+    def save(self) -> bool: ...
@@ -10,14 +10,8 @@ __version__ = "1.7.7122"
 import optparse # pylint: disable=deprecated-module
 import os
 
-try:
-    from http.server import SimpleHTTPRequestHandler
-except ImportError:  # py2
-    from SimpleHTTPServer import SimpleHTTPRequestHandler  # type: ignore
-try:
-    from socketserver import TCPServer
-except ImportError:  # py2
-    from SocketServer import TCPServer  # type: ignore
+from mirrorserver import MirrorHandler, THREADS, IDLETIMEOUT, MAXREQUESTS, SUMMARY, CACHESIZE
+from mirrorserver import serve, WORKERS
 
 PORT = 80
 
@@ -26,22 +20,34 @@ ext.add_option("-d", "--data", default=".",
                help="change to data directory before")
 ext.add_option("-p", "--port", default=PORT,
                help="serve on that port for http")
-
-opt, args = ext.parse_args()
-
-if opt.data and opt.data != ".":
-    os.chdir(opt.data)
-
-class MyHandler(SimpleHTTPRequestHandler):
-    def do_GET(self):
-        # nothing special to be done for just files
-        if os.path.exists("./" + self.path):
-            print("OK", self.path)
-        else:
-            print("NO", self.path)
-        return SimpleHTTPRequestHandler.do_GET(self)
-
-httpd = TCPServer(("", opt.port), MyHandler)
-
-print("serving at port", opt.port)
-httpd.serve_forever()
+ext.add_option("-t", "--threads", default=THREADS,
+               help="number of worker threads (%default)")
+ext.add_option("-k", "--timeout", default=IDLETIMEOUT,
+               help="idle seconds of a kept-alive connection (%default)")
+ext.add_option("-m", "--maxrequests", default=MAXREQUESTS,
+               help="requests on one connection before closing (%default)")
+ext.add_option("-l", "--accesslog", default="-",
+               help="json lines of the requests, '-' for stdout, '' for plain (%default)")
+ext.add_option("--summary", default=SUMMARY,
+               help="seconds between latency summaries, 0 for none (%default)")
+ext.add_option("--cachesize", default=CACHESIZE // (1024 * 1024),
+               help="MB of metadata files held in memory, 0 for none (%default)")
+ext.add_option("-w", "--workers", default=WORKERS,
+               help="processes sharing the port, 0 for the cpu quota (%default)")
+
+class MyHandler(MirrorHandler):
+    """ nothing special to be done for just files """
+
+def make_handler(options, root=None):  # pylint: disable=unused-argument
+    """ MyHandler for one mirror, serving from root instead of the cwd """
+    class Handler(MyHandler):
+        """ the files of one mirror """
+    Handler.root = root
+    return Handler
+
+if __name__ == "__main__":
+    opt, args = ext.parse_args()
+    if opt.data and opt.data != ".":
+        os.chdir(opt.data)
+    print("serving at port", opt.port)
+    serve(make_handler(opt), int(opt.port), opt)
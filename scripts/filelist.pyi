@@ -1,6 +1,11 @@
 #! /usr/bin/python3
 
-from http.server import SimpleHTTPRequestHandler
+from typing import Optional, Type
+import optparse
+from mirrorserver import MirrorHandler
 
-class MyHandler(SimpleHTTPRequestHandler): # type: ignore[return]
-    def do_GET(self) -> None: ...
+ext: optparse.OptionParser
+
+class MyHandler(MirrorHandler): ...
+
+def make_handler(options: optparse.Values, root: Optional[str] = None) -> Type[MyHandler]: ...
@@ -0,0 +1,127 @@
+#! /usr/bin/python3
+""" one server for the mirrors of several images. Each route is given like
+    the CMD of a mirror image, as the mirror name, its hostnames and the
+    script with its options. The request goes to the mirror whose name is
+    the first path segment, or else by the Host header and http/https. The
+    mirrors serve from their own --data directories. (python2 compatible)"""
+# pylint: disable=line-too-long
+
+from __future__ import print_function
+
+__copyright__ = "(C) 2018-2025 Guido Draheim"
+__contact__ = "https://github.com/gdraheim/docker-mirror-packages-repo"
+__license__ = "CC0 Creative Commons Zero (Public Domain)"
+__version__ = "1.7.7122"
+
+import optparse # pylint: disable=deprecated-module
+import os
+import sys
+import shlex
+
+try:
+    from urllib.parse import urlparse
+except ImportError:  # py2
+    from urlparse import urlparse  # type: ignore
+
+from mirrorserver import MirrorHandler, VirtualHosts, THREADS, IDLETIMEOUT, MAXREQUESTS, SUMMARY, CACHESIZE
+from mirrorserver import serve, WORKERS
+from mirrorserver import make_certificate, sni_context, CERTDIR
+
+PORT = 80
+SSLPORT = 443
+
+ext = optparse.OptionParser("%prog [options] --route 'NAME HOST[,HOST] SCRIPT [OPTIONS]'...")
+ext.add_option("-p", "--port", default=PORT,
+               help="serve on that port for http")
+ext.add_option("--sslport", default=SSLPORT,
+               help="serve on that port for the routes with --ssl (%default)")
+ext.add_option("-t", "--threads", default=THREADS,
+               help="number of worker threads (%default)")
+ext.add_option("-k", "--timeout", default=IDLETIMEOUT,
+               help="idle seconds of a kept-alive connection (%default)")
+ext.add_option("-m", "--maxrequests", default=MAXREQUESTS,
+               help="requests on one connection before closing (%default)")
+ext.add_option("-l", "--accesslog", default="-",
+               help="json lines of the requests, '-' for stdout, '' for plain (%default)")
+ext.add_option("--summary", default=SUMMARY,
+               help="seconds between latency summaries, 0 for none (%default)")
+ext.add_option("--cachesize", default=CACHESIZE // (1024 * 1024),
+               help="MB of metadata files held in memory, 0 for none (%default)")
+ext.add_option("-w", "--workers", default=WORKERS,
+               help="processes sharing the port, 0 for the cpu quota (%default)")
+ext.add_option("--certdir", default=CERTDIR,
+               help="where the certificates for the --ssl routes are kept (%default)")
+ext.add_option("--makecert", action="store_true", default=False,
+               help="make the certificates for the --ssl routes and exit")
+ext.add_option("-r", "--route", action="append", default=[],
+               help="mirror name, hostnames and the script with its options")
+
+SCRIPTS = {}  # script name -> module
+
+class MyHandler(MirrorHandler):
+    """ the handler class gets switched to the route of the request """
+    def do_GET(self):
+        self.send_error(404, "No mirror for this host")
+    def do_HEAD(self):
+        self.send_error(404, "No mirror for this host")
+
+def load_script(script):
+    """ the mirror script next to this one as a module (its main part is
+        not run), even when the route names the script in another dir """
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.basename(script))
+    if filename in SCRIPTS:
+        return SCRIPTS[filename]
+    name = os.path.basename(filename)[:-len(".py")].replace(".", "_").replace("-", "_")
+    try:
+        import importlib.util  # pylint: disable=import-outside-toplevel
+    except ImportError:  # py2
+        import imp  # type: ignore # pylint: disable=import-outside-toplevel,deprecated-module
+        module = imp.load_source(name, filename)
+    else:
+        spec = importlib.util.spec_from_file_location(name, filename)
+        if spec is None or spec.loader is None:
+            raise ImportError("can not load " + filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    SCRIPTS[filename] = module
+    return module
+
+def add_route(virtualhosts, routespec):
+    """ parse 'NAME HOST[,HOST] SCRIPT [OPTIONS]' and add the handler of the
+        script for it. Returns the ssl hostnames that need a certificate. """
+    parts = shlex.split(routespec)
+    if len(parts) < 3:
+        raise ValueError("route needs NAME HOST[,HOST] SCRIPT: " + routespec)
+    name, hosts, script, scriptargs = parts[0], [host for host in parts[1].split(",") if host], parts[2], parts[3:]
+    module = load_script(script)
+    scriptopt, _ = module.ext.parse_args(scriptargs)
+    handler = module.make_handler(scriptopt, os.path.abspath(scriptopt.data))
+    secure = getattr(scriptopt, "ssl", "")
+    virtualhosts.add(name, hosts, handler, bool(secure))
+    print("route", name, "for", ",".join(hosts), "to", os.path.basename(script), "on", os.path.abspath(scriptopt.data))
+    if not secure:
+        return []
+    sslnames = [urlparse(secure).hostname or "localhost"]
+    return sslnames + [host for host in hosts if host not in sslnames]
+
+if __name__ == "__main__":
+    opt, args = ext.parse_args()
+    vhosts = VirtualHosts()
+    hostnames = []
+    for route in opt.route + args:
+        for hostname in add_route(vhosts, route):
+            if hostname not in hostnames:
+                hostnames.append(hostname)
+    pemfiles = [(hostname, make_certificate(hostname, opt.certdir)) for hostname in hostnames]
+    if opt.makecert:
+        sys.exit(0)
+    if not vhosts.routes:
+        ext.error("no --route given")
+    MyHandler.vhosts = vhosts
+    listeners = []
+    if pemfiles:
+        listeners.append((int(opt.sslport), sni_context(pemfiles)))
+        print("serving at port", opt.port, "and", opt.sslport, "for", " ".join(hostnames))
+    else:
+        print("serving at port", opt.port)
+    serve(MyHandler, int(opt.port), opt, None, listeners)
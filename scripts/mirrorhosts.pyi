@@ -0,0 +1,18 @@
+#! /usr/bin/python3
+
+from typing import Dict, List
+import optparse
+import types
+from mirrorserver import MirrorHandler, VirtualHosts
+
+PORT: int
+SSLPORT: int
+ext: optparse.OptionParser
+SCRIPTS: Dict[str, types.ModuleType]
+
+class MyHandler(MirrorHandler):
+    def do_GET(self) -> None: ...
+    def do_HEAD(self) -> None: ...
+
+def load_script(script: str) -> types.ModuleType: ...
+def add_route(virtualhosts: VirtualHosts, routespec: str) -> List[str]: ...
@@ -10,20 +10,17 @@ __version__ = "1.7.7122"
 
 import optparse # pylint: disable=deprecated-module
 import os
+import sys
 
-try:
-    from http.server import SimpleHTTPRequestHandler
-except ImportError:  # py2
-    from SimpleHTTPServer import SimpleHTTPRequestHandler  # type: ignore
-try:
-    from socketserver import TCPServer
-except ImportError:  # py2
-    from SocketServer import TCPServer  # type: ignore
 try:
     from urllib.parse import urlparse
 except ImportError:  # py2
     from urlparse import urlparse  # type: ignore
 
+from mirrorserver import MirrorHandler, THREADS, IDLETIMEOUT, MAXREQUESTS, SUMMARY, CACHESIZE
+from mirrorserver import serve, WORKERS
+from mirrorserver import make_certificate, ssl_context, CERTDIR
+
 PORT = 80
 SSL = ""
 URL = "http://mirrorlist.centos.org"
@@ -33,23 +30,36 @@ ext.add_option("-d", "--data", default=".",
                help="change to data directory before")
 ext.add_option("-p", "--port", default=PORT,
                help="serve on that port for http")
+ext.add_option("-t", "--threads", default=THREADS,
+               help="number of worker threads (%default)")
+ext.add_option("-k", "--timeout", default=IDLETIMEOUT,
+               help="idle seconds of a kept-alive connection (%default)")
+ext.add_option("-m", "--maxrequests", default=MAXREQUESTS,
+               help="requests on one connection before closing (%default)")
+ext.add_option("-l", "--accesslog", default="-",
+               help="json lines of the requests, '-' for stdout, '' for plain (%default)")
+ext.add_option("--summary", default=SUMMARY,
+               help="seconds between latency summaries, 0 for none (%default)")
+ext.add_option("--cachesize", default=CACHESIZE // (1024 * 1024),
+               help="MB of metadata files held in memory, 0 for none (%default)")
+ext.add_option("-w", "--workers", default=WORKERS,
+               help="processes sharing the port, 0 for the cpu quota (%default)")
 ext.add_option("-u", "--url", default=URL,
                help="url prefix (%default)")
 ext.add_option("-s", "--ssl", default=SSL,
                help="ssl server (%default)")
-
-opt, args = ext.parse_args()
-URL = opt.url
-SSL = opt.ssl
+ext.add_option("--certdir", default=CERTDIR,
+               help="where the certificate for --ssl is kept (%default)")
+ext.add_option("--makecert", action="store_true", default=False,
+               help="make the certificate for --ssl and exit")
 
 DEFAULT_REL1 = "9"
 DEFAULT_ARCH = "x86_64"
 DEFAULT_REPO = "os"
 
-if opt.data and opt.data != ".":
-    os.chdir(opt.data)
-
-class MyHandler(SimpleHTTPRequestHandler):
+class MyHandler(MirrorHandler):
+    url = URL
+    ssl = SSL
     def do_GET(self):
         if self.path.startswith("/?") or self.path.startswith("/mirrorlist?") or self.path.startswith("/mirrorlist/?"):
             mirrorlist, parameters = self.path.split("?", 1)
@@ -65,17 +75,12 @@ class MyHandler(SimpleHTTPRequestHandler):
             if infra in ["container"]:
                 infra = "os"
             if release in ["8", "9"]:
-                text = "%s/%s/%s/%s/%s/\n" % (SSL or URL, release, repo, arch, infra)
+                text = "%s/%s/%s/%s/%s/\n" % (self.ssl or self.url, release, repo, arch, infra)
             else:
-                text = "%s/%s/%s/%s/\n" % (SSL or URL, release, repo, arch)
-            print("SERVE", self.path)
-            print("   AS", text.strip())
+                text = "%s/%s/%s/%s/\n" % (self.ssl or self.url, release, repo, arch)
+            self.served_as = text.strip()
             data = text.encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
+            self.send_data(data, "text/plain")
             return None
         if self.path.startswith("/mirrorlist/"):
             if "?" in self.path:
@@ -99,49 +104,42 @@ class MyHandler(SimpleHTTPRequestHandler):
                 repo = mapped[repo]
             arch = "$basearch"  # generic :)
             infra = "os"  # almalinux does not care
-            text = "%s/%s/%s/%s/%s/\n" % (SSL or URL, release, repo, arch, infra)
-            print("SERVE", self.path)
-            print("   AS", text.strip())
+            text = "%s/%s/%s/%s/%s/\n" % (self.ssl or self.url, release, repo, arch, infra)
+            self.served_as = text.strip()
             data = text.encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
+            self.send_data(data, "text/plain")
             return None
-        print("CHECK", self.path)
-        return SimpleHTTPRequestHandler.do_GET(self)
+        return MirrorHandler.do_GET(self)
 
-server = urlparse(SSL or URL)
+def make_handler(options, root=None):
+    """ MyHandler for the url options, serving from root instead of the cwd """
+    class Handler(MyHandler):
+        """ the mirrorlist of one mirror """
+    Handler.url = options.url
+    Handler.ssl = options.ssl
+    Handler.root = root
+    return Handler
 
-if not SSL:
-    httpd = TCPServer(("", opt.port), MyHandler)
-    print("serving at port", opt.port)
-    httpd.serve_forever()
-else:
-    port = server.port
-    if not port:
-        port = int(opt.port)
-        if port < 100: port = 443
-    import ssl
-    import subprocess
-    hostname = server.hostname
-    if not hostname:
-        hostname = "localhost"
-    cc = hostname.split(".")[-1]
-    og = hostname.split(".")[-2]
-    if len(cc) > 2: cc = "US"
-    cmd = "openssl req -x509 -newkey rsa:4096 -sha256 -days 3650 -nodes"
-    cmd += " -keyout /tmp/{hostname}.key -out /tmp/{hostname}.crt -subj /C={cc}/L={og}/CN={hostname}".format(**locals())
-    print(cmd)
-    subprocess.call(cmd, shell=True)
-    cmd = "cat /tmp/{hostname}.key /tmp/{hostname}.crt > /tmp/{hostname}.pem".format(**locals())
-    subprocess.call(cmd, shell=True)
-    httpd = TCPServer(("", port), MyHandler)
-    # httpd.socket = ssl.wrap_socket(httpd.socket, certfile='/tmp/%s.pem' % hostname, server_side=True) # pylint: disable=deprecated-method
-    # SSLContext was introduced in 2.7.9 # ssl.wrap_socket was removed in Python 3.12
-    context = ssl.SSLContext()
-    context.load_cert_chain(certfile = '/tmp/%s.pem' % hostname)
-    httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
-    print("serving at port", port, "for", SSL)
-    httpd.serve_forever()
+if __name__ == "__main__":
+    opt, args = ext.parse_args()
+    if opt.data and opt.data != ".":
+        os.chdir(opt.data)
+    server = urlparse(opt.ssl or opt.url)
+    if not opt.ssl:
+        handler = make_handler(opt)
+        print("serving at port", opt.port)
+        serve(handler, int(opt.port), opt)
+    else:
+        port = server.port
+        if not port:
+            port = int(opt.port)
+            if port < 100: port = 443
+        hostname = server.hostname
+        if not hostname:
+            hostname = "localhost"
+        pemfile = make_certificate(hostname, opt.certdir)
+        if opt.makecert:
+            sys.exit(0)
+        handler = make_handler(opt)
+        print("serving at port", port, "for", opt.ssl)
+        serve(handler, port, opt, ssl_context(pemfile))
@@ -1,5 +1,13 @@
 #! /usr/bin/python3
-from http.server import SimpleHTTPRequestHandler
+from typing import Optional, Type
+import optparse
+from mirrorserver import MirrorHandler
 
-class MyHandler(SimpleHTTPRequestHandler):
+ext: optparse.OptionParser
+
+class MyHandler(MirrorHandler):
+    url: str
+    ssl: str
     def do_GET(self) -> None: ...
+
+def make_handler(options: optparse.Values, root: Optional[str] = None) -> Type[MyHandler]: ...
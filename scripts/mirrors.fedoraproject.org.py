@@ -12,190 +12,257 @@ __version__ = "1.7.7122"
 import optparse # pylint: disable=deprecated-module
 import os
 import os.path
+import sys
+import json
 import re
-import time
 import hashlib
+import threading
 
-try:
-    from http.server import SimpleHTTPRequestHandler
-except ImportError:  # py2
-    from SimpleHTTPServer import SimpleHTTPRequestHandler  # type: ignore
-try:
-    from socketserver import TCPServer
-except ImportError:  # py2
-    from SocketServer import TCPServer  # type: ignore
 try:
     from urllib.parse import urlparse
 except ImportError:  # py2
     from urlparse import urlparse  # type: ignore
 
+from mirrorserver import MirrorHandler, THREADS, IDLETIMEOUT, MAXREQUESTS, SUMMARY, CACHESIZE
+from mirrorserver import serve, WORKERS
+from mirrorserver import make_certificate, ssl_context, CERTDIR
+from checksumcache import ChecksumCache, SIDECAR
+
 
 URL = "http://mirrors.fedoraproject.org"
 SSL = ""
 PORT = 80
+INDEXFILE = "mirrorindex.json"  # in the data directory
+EPEL = {"epel-7": "7", "epel-8": "8/Everything", "epel-modular-8": "8/Modular", "epel-9": "9/Everything"}  # repo -> dir
 
 ext = optparse.OptionParser("%prog [options]")
 ext.add_option("-d", "--data", default=".",
                help="change to data directory before")
 ext.add_option("-p", "--port", default=PORT,
                help="serve on that port for http")
+ext.add_option("-t", "--threads", default=THREADS,
+               help="number of worker threads (%default)")
+ext.add_option("-k", "--timeout", default=IDLETIMEOUT,
+               help="idle seconds of a kept-alive connection (%default)")
+ext.add_option("-m", "--maxrequests", default=MAXREQUESTS,
+               help="requests on one connection before closing (%default)")
+ext.add_option("-l", "--accesslog", default="-",
+               help="json lines of the requests, '-' for stdout, '' for plain (%default)")
+ext.add_option("--summary", default=SUMMARY,
+               help="seconds between latency summaries, 0 for none (%default)")
+ext.add_option("--cachesize", default=CACHESIZE // (1024 * 1024),
+               help="MB of metadata files held in memory, 0 for none (%default)")
+ext.add_option("-w", "--workers", default=WORKERS,
+               help="processes sharing the port, 0 for the cpu quota (%default)")
 ext.add_option("-u", "--url", default=URL,
                help="url prefix (%default)")
 ext.add_option("-s", "--ssl", default=SSL,
                help="ssl server (%default)")
-
-opt, args = ext.parse_args()
-URL = opt.url
-SSL = opt.ssl
+ext.add_option("--certdir", default=CERTDIR,
+               help="where the certificate for --ssl is kept (%default)")
+ext.add_option("--makecert", action="store_true", default=False,
+               help="make the certificate for --ssl and exit")
+ext.add_option("--makeindex", action="store_true", default=False,
+               help="precompute the metalink answers into " + INDEXFILE)
 
 def boot_time():
     return int(open('/proc/stat').read().split('btime ')[1].split()[0])
-def os_path_md5(path):
-    m = hashlib.md5()
-    m.update(open(path, "rb").read())
-    return m.hexdigest()
-def os_path_sha256(path):
-    m = hashlib.sha256()
-    m.update(open(path, "rb").read())
-    return m.hexdigest()
-def os_path_sha512(path):
-    m = hashlib.sha512()
-    m.update(open(path, "rb").read())
-    return m.hexdigest()
-def fix_mtime_repomd_xml(path):
+def os_path_hashes(path):
+    """ md5, sha256, sha512 and the newest <timestamp> in one pass """
+    md5, sha256, sha512 = hashlib.md5(), hashlib.sha256(), hashlib.sha512()
     timestamp = 0
-    for line in open(path):
-        m = re.match(".*<timestamp>(\\d+)</timestamp>.*", line)
-        if m:
-            ts = int(m.group(1))
-            if ts > timestamp:
-                timestamp = ts
-    if timestamp:
-        now = time.time()
-        old = os.path.getmtime(path)
-        if int(old) != int(timestamp):
-            print("FIXED", path, timestamp, "(old", old, ")")
-            os.utime(path, (now, timestamp))
+    with open(path, "rb") as f:
+        for line in f:
+            md5.update(line)
+            sha256.update(line)
+            sha512.update(line)
+            m = re.match(b".*<timestamp>(\\d+)</timestamp>.*", line)
+            if m:
+                ts = int(m.group(1))
+                if ts > timestamp:
+                    timestamp = ts
+    return md5.hexdigest(), sha256.hexdigest(), sha512.hexdigest(), timestamp
+def cached_path_hashes(path, save=False):
+    """ os_path_hashes() via the checksum cache next to the file, which is shared
+        with repodata-fix.py. Only the index step saves to it, so that serving
+        clients do not write into the mirror tree. """
+    cache = ChecksumCache(os.path.join(os.path.dirname(path), SIDECAR))
+    values = cache.get(path, "metalink")
+    if values:
+        return str(values["md5"]), str(values["sha256"]), str(values["sha512"]), int(values["timestamp"])
+    md5, sha256, sha512, timestamp = os_path_hashes(path)
+    if save:
+        cache.put(path, "metalink", {"md5": md5, "sha256": sha256, "sha512": sha512, "timestamp": timestamp})
+        cache.save()
+    return md5, sha256, sha512, timestamp
+
+METALINKS = {}  # (repomd.xml path, repomd url) -> (size, mtime, metalink data)
+METALINKS_LOCK = threading.Lock()
+
+def metalink_repomd_xml(repomd_xml, repomd_url, save=False):
+    """ the metalink document is only generated again when repomd.xml has changed,
+        it is kept per repomd_url as well, since the url is a part of the document.
+        The mm:timestamp is the newest <timestamp> in repomd.xml (or else its mtime)
+        as the file itself is not touched, it may be hard-linked to the synced repo. """
+    st = os.stat(repomd_xml)
+    with METALINKS_LOCK:
+        cached = METALINKS.get((repomd_xml, repomd_url))
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+        return cached[2]
+    # pylint: disable=possibly-unused-variable
+    md5, sha256, sha512, timestamp = cached_path_hashes(repomd_xml, save)
+    generator = "http://github/gdraheim/docker-mirror-packages-repo"
+    ns = "http://www.metalinker.org/"
+    mm = "http://fedorahosted.org/mirrormanager"
+    ts = timestamp or int(st.st_mtime)
+    sz = st.st_size
+    http = repomd_url.split(":")[0]
+    xml = """<?xml version="1.0" encoding="utf-8"?>
+             <metalink version="3.0" xmlns="{ns}" xmlns:mm="{mm}" generator="{generator}">
+              <files>
+               <file name="repomd.xml">
+                <mm:timestamp>{ts}</mm:timestamp>
+                <size>{sz}</size>
+                <verification>
+                  <hash type="md5">{md5}</hash>
+                  <hash type="sha256">{sha256}</hash>
+                  <hash type="sha512">{sha512}</hash>
+                </verification>
+                <resources maxconnections="1">
+                 <url protocol="{http}" type="{http}" preference="100">{repomd_url}</url>
+                </resources>
+               </file>
+              </files>
+             </metalink>""".format(**locals())
+    data = xml.encode("utf-8")
+    with METALINKS_LOCK:
+        METALINKS[(repomd_xml, repomd_url)] = (st.st_size, st.st_mtime, data)
+    return data
 
-if opt.data and opt.data != ".":
-    os.chdir(opt.data)
+def repomd_xml_dirs(top="."):
+    """ the repo paths like '8/Everything/x86_64/' that have a repodata/repomd.xml """
+    found = []
+    for dirpath, dirnames, _ in os.walk(top):
+        if os.path.isfile(os.path.join(dirpath, "repodata", "repomd.xml")):
+            found.append(os.path.relpath(dirpath, top) + "/")
+            dirnames[:] = []
+        else:
+            dirnames[:] = [name for name in dirnames if name not in ["Packages", "debug", "drpms"]]
+    return sorted(found)
+def make_index(filename, prefix, top="."):
+    """ the metalink answers for every repo dir are stored per url prefix,
+        so that the ssl and the http image can share one index file """
+    index = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            index = json.load(f)
+    answers = {}
+    for use in repomd_xml_dirs(top):
+        repomd_xml = os.path.join(top, use + "repodata/repomd.xml")
+        repomd_url = "%s/%s" % (prefix, use + "repodata/repomd.xml")  # as in do_GET, the top is only for the file
+        data = metalink_repomd_xml(repomd_xml, repomd_url, save=True)
+        st = os.stat(repomd_xml)
+        answers[use] = {"size": st.st_size, "mtime": st.st_mtime, "metalink": data.decode("utf-8")}
+        print("INDEX", use)
+    index[prefix] = answers
+    with open(filename + ".tmp", "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.rename(filename + ".tmp", filename)
+    return len(answers)
+def load_index(filename, prefix, top="."):
+    """ the precomputed metalink answers whose repomd.xml did not change since """
+    try:
+        with open(filename) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    answers = {}
+    for use, item in index.get(prefix, {}).items():
+        repomd_xml = os.path.join(top, use + "repodata/repomd.xml")
+        try:
+            st = os.stat(repomd_xml)
+        except OSError:
+            continue
+        if st.st_size == item["size"] and st.st_mtime == item["mtime"]:
+            answers[use] = item["metalink"].encode("utf-8")
+        else:
+            print("STALE", use)
+    return answers
 
-class MyHandler(SimpleHTTPRequestHandler):
+class MyHandler(MirrorHandler):
+    url = URL
+    ssl = SSL
+    metalink_index = {}  # repo path -> precomputed metalink data
     def do_GET(self):
         if self.path.startswith("/metalink?"):
-            # pylint: disable=possibly-unused-variable
             metalink = True  # epel/fedora format as long as we know
             values = {}
             for param in self.path[self.path.find("?") + 1:].split("&"):
                 if "=" in param:
                     name, value = param.split("=")
                     values[name] = value
-            release = values.get("release", "0")
             arch = values.get("arch", "x86_64")
             repo = values.get("repo", "os")
             infra = values.get("infra", "")
             if infra in ["container"]:
                 infra = "os"
-            if repo in ["epel-7"]:
-                use = "%s/%s/" % ("7", arch)
-            elif repo in ["epel-8"]:
-                use = "%s/%s/" % ("8/Everything", arch)
-            elif repo in ["epel-modular-8"]:
-                use = "%s/%s/" % ("8/Modular", arch)
-            elif repo in ["epel-9"]:
-                use = "%s/%s/" % ("9/Everything", arch)
-            else:
-                use = "%s/%s/" % (repo, arch)
-            url = "%s/%s" % (SSL or URL, use)
-            print("SERVE", self.path)
-            print("   AS", url)
+            use = "%s/%s/" % (EPEL.get(repo, repo), arch)
+            url = "%s/%s" % (self.ssl or self.url, use)
+            self.served_as = url
             if metalink:
-                repomd_xml = use.rstrip("/") + "/repodata/repomd.xml"
+                repomd_xml = self.data_path(use.rstrip("/") + "/repodata/repomd.xml")
                 repomd_url = url.rstrip("/") + "/repodata/repomd.xml"
+                if use in self.metalink_index:
+                    self.send_data(self.metalink_index[use], "application/metalink+xml")
+                    return None
                 if not os.path.exists(repomd_xml):
                     text = "did not find " + repomd_xml
                     data = text.encode("utf-8")
-                    self.send_response(404)
-                    self.send_header("Content-Type", "text/plain")
-                    self.send_header("Content-Length", str(len(data)))
-                    self.send_header("X-Filepath", repomd_xml)
-                    self.end_headers()
-                    self.wfile.write(data)
+                    self.send_data(data, "text/plain", 404, [("X-Filepath", repomd_xml)])
                     return None
-                fix_mtime_repomd_xml(repomd_xml)
-                generator = "http://github/gdraheim/docker-mirror-packages-repo"
-                ns = "http://www.metalinker.org/"
-                mm = "http://fedorahosted.org/mirrormanager"
-                ts = int(os.path.getmtime(repomd_xml))
-                sz = os.path.getsize(repomd_xml)
-                md5 = os_path_md5(repomd_xml)
-                sha256 = os_path_sha256(repomd_xml)
-                sha512 = os_path_sha512(repomd_xml)
-                http = url.split(":")[0]
-                xml = """<?xml version="1.0" encoding="utf-8"?>
-             <metalink version="3.0" xmlns="{ns}" xmlns:mm="{mm}" generator="{generator}">
-              <files>
-               <file name="repomd.xml">
-                <mm:timestamp>{ts}</mm:timestamp>
-                <size>{sz}</size>
-                <verification>
-                  <hash type="md5">{md5}</hash>
-                  <hash type="sha256">{sha256}</hash>
-                  <hash type="sha512">{sha512}</hash>
-                </verification>
-                <resources maxconnections="1">
-                 <url protocol="{http}" type="{http}" preference="100">{repomd_url}</url>
-                </resources>
-               </file>
-              </files>
-             </metalink>""".format(**locals())
-                data = xml.encode("utf-8")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/metalink+xml")
-                self.send_header("Content-Length", str(len(data)))
-                self.end_headers()
-                self.wfile.write(data)
+                data = metalink_repomd_xml(repomd_xml, repomd_url)
+                self.send_data(data, "application/metalink+xml")
             else:
                 data = (url + "\r\n").encode("utf-8")
-                self.send_response(200)
-                self.send_header("Content-Type", "text/plain")
-                self.send_header("Content-Length", str(len(data)))
-                self.end_headers()
-                self.wfile.write(data)
+                self.send_data(data, "text/plain")
             return None
-        print("CHECK", self.path)
-        return SimpleHTTPRequestHandler.do_GET(self)
+        return MirrorHandler.do_GET(self)
 
-server = urlparse(SSL or URL)
+def make_handler(options, root=None):
+    """ MyHandler for the url options, serving from root instead of the cwd,
+        with the metalink answers from the index file that are still valid """
+    class Handler(MyHandler):
+        """ the metalinks of one mirror """
+    Handler.url = options.url
+    Handler.ssl = options.ssl
+    Handler.root = root
+    Handler.metalink_index = load_index(os.path.join(root or ".", INDEXFILE), options.ssl or options.url, root or ".")
+    print("loaded", INDEXFILE, "for", len(Handler.metalink_index), "repos")
+    return Handler
 
-if not SSL:
-    httpd = TCPServer(("", opt.port), MyHandler)
-    print("serving at port", opt.port)
-    httpd.serve_forever()
-else:
-    port = server.port
-    if not port:
-        port = int(opt.port)
-        if port < 100: port = 443
-    import ssl
-    import subprocess
-    hostname = server.hostname
-    if not hostname:
-        hostname = "localhost"
-    cc = hostname.split(".")[-1]
-    og = hostname.split(".")[-2]
-    if len(cc) > 2: cc = "US"
-    cmd = "openssl req -x509 -newkey rsa:4096 -sha256 -days 3650 -nodes"
-    cmd += " -keyout /tmp/{hostname}.key -out /tmp/{hostname}.crt -subj /C={cc}/L={og}/CN={hostname}".format(**locals())
-    print(cmd)
-    subprocess.call(cmd, shell=True)
-    cmd = "cat /tmp/{hostname}.key /tmp/{hostname}.crt > /tmp/{hostname}.pem".format(**locals())
-    subprocess.call(cmd, shell=True)
-    httpd = TCPServer(("", port), MyHandler)
-    # httpd.socket = ssl.wrap_socket(httpd.socket, certfile='/tmp/%s.pem' % hostname, server_side=True)  # pylint: disable=deprecated-method
-    # SSLContext was introduced in 2.7.9 # ssl.wrap_socket was removed in Python 3.12
-    context = ssl.SSLContext()
-    context.load_cert_chain(certfile = '/tmp/%s.pem' % hostname)
-    httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
-    print("serving at port", port, "for", SSL)
-    httpd.serve_forever()
+if __name__ == "__main__":
+    opt, args = ext.parse_args()
+    if opt.data and opt.data != ".":
+        os.chdir(opt.data)
+    if opt.makeindex:
+        print("made", INDEXFILE, "for", make_index(INDEXFILE, opt.ssl or opt.url), "repos")
+        sys.exit(0)
+    server = urlparse(opt.ssl or opt.url)
+    if not opt.ssl:
+        handler = make_handler(opt)
+        print("serving at port", opt.port)
+        serve(handler, int(opt.port), opt)
+    else:
+        port = server.port
+        if not port:
+            port = int(opt.port)
+            if port < 100: port = 443
+        hostname = server.hostname
+        if not hostname:
+            hostname = "localhost"
+        pemfile = make_certificate(hostname, opt.certdir)
+        if opt.makecert:
+            sys.exit(0)
+        handler = make_handler(opt)
+        print("serving at port", port, "for", opt.ssl)
+        serve(handler, port, opt, ssl_context(pemfile))
@@ -1,12 +1,28 @@
 #! /usr/bin/python3
 
-from http.server import SimpleHTTPRequestHandler
+from typing import Dict, Tuple, List, Optional, Type
+import optparse
+import threading
+from mirrorserver import MirrorHandler
+
+INDEXFILE: str
+EPEL: Dict[str, str]
+ext: optparse.OptionParser
+METALINKS: Dict[Tuple[str, str], Tuple[int, float, bytes]]
+METALINKS_LOCK: threading.Lock
 
 def boot_time() -> int: ...
-def os_path_md5(path: str) -> str: ...
-def os_path_sha256(path: str) -> str: ...
-def os_path_sha512(path: str) -> str: ...
-def fix_mtime_repomd_xml(path: str) -> None: ...
+def os_path_hashes(path: str) -> Tuple[str, str, str, int]: ...
+def cached_path_hashes(path: str, save: bool = False) -> Tuple[str, str, str, int]: ...
+def metalink_repomd_xml(repomd_xml: str, repomd_url: str, save: bool = False) -> bytes: ...
+def repomd_xml_dirs(top: str = ".") -> List[str]: ...
+def make_index(filename: str, prefix: str, top: str = ".") -> int: ...
+def load_index(filename: str, prefix: str, top: str = ".") -> Dict[str, bytes]: ...
 
-class MyHandler(SimpleHTTPRequestHandler): # type: ignore[return]
+class MyHandler(MirrorHandler): # type: ignore[return]
+    url: str
+    ssl: str
+    metalink_index: Dict[str, bytes]
     def do_GET(self) -> None: ...
+
+def make_handler(options: optparse.Values, root: Optional[str] = None) -> Type[MyHandler]: ...
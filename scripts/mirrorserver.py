@@ -0,0 +1,1161 @@
+#! /usr/bin/python3
+""" common serving loop for the repo mirror scripts. The accepted connections
+    are handed to a fixed number of worker threads, so that one client pulling
+    a large package does not block the others. Package files are sent with
+    zero-copy sendfile where the connection allows, and the file answers
+    do Range and conditional requests. Connections are kept alive for the
+    next request as in HTTP/1.1. The access log is written as json lines by
+    a background thread along with latency summaries. The counters of the
+    server are shown on /-/metrics for prometheus. For https the tls
+    handshake is done by the worker thread, using a certificate that is
+    usually made at image build time. The repo metadata files that every
+    client asks for first are held in a bounded memory cache. Several worker
+    processes can share the port by SO_REUSEPORT, the number defaults to the
+    cpu quota of the container, and they restart gracefully on SIGHUP. With
+    virtual hosts one server answers for several mirrors by the Host header.
+    (python2 compatible)"""
+
+from __future__ import print_function
+
+__copyright__ = "(C) 2018-2025 Guido Draheim"
+__contact__ = "https://github.com/gdraheim/docker-mirror-packages-repo"
+__license__ = "CC0 Creative Commons Zero (Public Domain)"
+__version__ = "1.7.7122"
+
+import os
+import io
+import sys
+import time
+import math
+import json
+import errno
+import signal
+import tempfile
+import traceback
+import bisect
+import stat
+import shutil
+import select
+import socket
+import ssl
+import threading
+import binascii
+import subprocess
+import email.utils
+from fnmatch import fnmatchcase as fnmatch
+from collections import OrderedDict
+
+try:
+    from http.server import SimpleHTTPRequestHandler
+except ImportError:  # py2
+    from SimpleHTTPServer import SimpleHTTPRequestHandler  # type: ignore
+try:
+    from urllib.parse import urlsplit, urlunsplit
+except ImportError:  # py2
+    from urlparse import urlsplit, urlunsplit  # type: ignore
+try:
+    from socketserver import TCPServer
+except ImportError:  # py2
+    from SocketServer import TCPServer  # type: ignore
+try:
+    import queue
+except ImportError:  # py2
+    import Queue as queue  # type: ignore
+
+THREADS = 1
+BACKLOG = 4  # accepted connections waiting per worker thread
+COPYBUFSIZE = 256 * 1024  # when sendfile can not be used
+SENDFILE = hasattr(socket.socket, "sendfile")  # py3.5
+FADVISE = hasattr(os, "posix_fadvise")  # py3.3
+MAXRANGES = 64  # in one multipart/byteranges answer
+IDLETIMEOUT = 5  # seconds to wait for the next request on a connection
+IDLEPOLL = 0.1  # seconds between the checks for waiting connections while idle
+MAXREQUESTS = 1000  # requests on one connection before closing it
+ACCESSLOGSIZE = 4096  # entries waiting for the writer, more are dropped
+SUMMARY = 60  # seconds between the latency summaries in the access log
+LATENCIES = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]  # histogram bounds in ms
+TIMER = getattr(time, "perf_counter", time.time)  # py3.3
+METRICSPATH = "/-/metrics"
+METRICSDEPTH = 3  # path prefix like '/9/BaseOS/x86_64' for repo and arch
+MAXPREFIXES = 256  # more path prefixes are counted as 'other'
+CERTDIR = "/tmp"  # where the {hostname}.pem is made once
+HANDSHAKETIMEOUT = 10  # seconds for a client to complete the tls handshake
+CACHESIZE = 64 * 1024 * 1024  # bytes of metadata files held in memory
+METADATA = ["*/repodata/*", "*/dists/*/InRelease", "*/dists/*/Release", "*/dists/*/Release.gpg",
+            "*/dists/*/Packages*", "*/dists/*/Sources*", "*/dists/*/Translation-*", "*/dists/*/Contents-*",
+            "*/dists/*/by-hash/*", "*/media.1/*", "*/content", "*/content.asc", "*/content.key"]
+METADATADIRS = ["repodata", "dists"]  # prewarmed at server start
+NOPREWARMDIRS = ["Packages", "pool", "drpms", "debug"]
+WORKERS = 0  # processes sharing the port, 0 for the cpu quota of the container
+MAXWORKERS = 8  # when the container has no cpu quota
+GRACE = 30  # seconds for an old worker to finish its connections
+SHAREINTERVAL = 1  # seconds between the metrics snapshots of a worker
+PIPEBUF = 4096  # bytes of access log lines in one atomic write
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)  # py2 has not the linux value
+
+class ThreadPoolServer(TCPServer):
+    """ a TCPServer where each request is run by one of the worker threads.
+        The queue of accepted connections is bounded, so the listen loop
+        stops accepting while all workers are busy. With an ssl context the
+        accepted connection is wrapped by the worker, so that a slow tls
+        handshake does not block the listen loop. With reuseport the port
+        can be bound by several worker processes. """
+    stopping = False
+    def __init__(self, server_address, RequestHandlerClass, threads=THREADS, context=None, reuseport=False):
+        self.workers = []
+        self.context = context
+        self.reuseport = reuseport
+        TCPServer.__init__(self, server_address, RequestHandlerClass)
+        self.threads = max(1, int(threads))
+        self.pending = queue.Queue(self.threads * BACKLOG)
+        for num in range(self.threads):
+            worker = threading.Thread(target=self.process_request_worker, name="worker-%i" % num)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+    def server_bind(self):
+        if self.reuseport:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        TCPServer.server_bind(self)
+    def process_request(self, request, client_address):
+        assert isinstance(request, socket.socket)
+        self.pending.put((request, client_address))
+    def process_request_worker(self):
+        while True:
+            request, client_address = self.pending.get()
+            if request is None:
+                break
+            if self.context is not None:
+                try:
+                    request.settimeout(HANDSHAKETIMEOUT)
+                    request = self.context.wrap_socket(request, server_side=True)
+                except (ssl.SSLError, socket.error, OSError):
+                    self.shutdown_request(request)
+                    continue
+            try:
+                self.finish_request(request, client_address)
+            except Exception:  # pylint: disable=broad-except
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+    def server_close(self):
+        TCPServer.server_close(self)
+        for _worker in self.workers:
+            self.pending.put((None, None))
+    def stop(self):
+        """ from a signal handler - the kept-alive connections get closed after
+            their current request and serve_forever returns in the main thread """
+        self.stopping = True
+        stopper = threading.Thread(target=self.shutdown, name="stop")
+        stopper.daemon = True
+        stopper.start()
+    def join(self, grace=GRACE):
+        """ wait for the worker threads to finish the accepted connections """
+        deadline = time.time() + grace
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.time()))
+
+class ServerGroup(object):
+    """ the servers for several ports in one process, like http and https.
+        The first one is run by serve_forever, the others in threads. """
+    def __init__(self, servers):
+        self.servers = servers
+        self.RequestHandlerClass = servers[0].RequestHandlerClass
+    def serve_forever(self):
+        for server in self.servers[1:]:
+            listener = threading.Thread(target=server.serve_forever, name="listen-%s" % server.server_address[1])
+            listener.daemon = True
+            listener.start()
+        self.servers[0].serve_forever()
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+    def server_close(self):
+        for server in self.servers:
+            server.server_close()
+    def join(self, grace=GRACE):
+        deadline = time.time() + grace
+        for server in self.servers:
+            server.join(max(0.0, deadline - time.time()))
+
+class AccessLog(object):
+    """ json lines for the requests, written by a background thread. The
+        workers never wait for the log pipe - when the queue is full then
+        the entry is dropped and counted. Every summary period there is a
+        latency histogram line for each path prefix like '/9/BaseOS'. The
+        lines are written in whole with O_APPEND, so that the worker
+        processes can share the log file or the stdout pipe. """
+    def __init__(self, filename="-", summary=SUMMARY, size=ACCESSLOGSIZE):
+        self.filename = filename
+        self.summary = summary
+        self.entries = queue.Queue(size)
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.histograms = {}
+        self.writer = threading.Thread(target=self.write_entries, name="accesslog")
+        self.writer.daemon = True
+        self.writer.start()
+    def log(self, entry):
+        try:
+            self.entries.put_nowait(entry)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+    def write_entries(self):
+        if self.filename == "-":
+            sys.stdout.flush()
+            fd = sys.stdout.fileno()
+        else:
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        deadline = time.time() + self.summary if self.summary else None
+        lines = []
+        while True:
+            timeout = max(0.0, deadline - time.time()) if deadline else None
+            try:
+                entry = self.entries.get(True, timeout)
+            except queue.Empty:
+                entry = None
+            if entry is not None:
+                lines.append(json.dumps(entry, sort_keys=True) + "\n")
+                self.record(entry)
+            if deadline and time.time() >= deadline:
+                lines += self.summary_lines()
+                deadline = time.time() + self.summary
+            if lines and (entry is None or self.entries.empty() or len(lines) >= 64):
+                write_lines(fd, lines)
+                lines = []
+    def record(self, entry):
+        prefix = path_prefix(str(entry["path"]))
+        if prefix not in self.histograms:
+            self.histograms[prefix] = Histogram()
+        self.histograms[prefix].add(float(entry["ms"]), int(entry["bytes"]))
+    def summary_lines(self):
+        lines = []
+        pid = os.getpid()
+        for prefix in sorted(self.histograms):
+            histogram = self.histograms[prefix]
+            summary = {"summary": prefix, "period": self.summary, "pid": pid,
+                       "requests": histogram.requests, "bytes": histogram.sent, "max": histogram.slowest,
+                       "p50": histogram.quantile(0.50), "p90": histogram.quantile(0.90),
+                       "p99": histogram.quantile(0.99)}
+            lines.append(json.dumps(summary, sort_keys=True) + "\n")
+        self.histograms = {}
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            summary = {"summary": "dropped", "period": self.summary, "pid": pid, "dropped": dropped}
+            lines.append(json.dumps(summary, sort_keys=True) + "\n")
+        return lines
+
+class Metrics(object):
+    """ counters since the start of the server, per path prefix, that are
+        shown in the prometheus text format on the METRICSPATH. With a
+        shared directory each worker process writes a snapshot there, and
+        the answering worker adds up the snapshots of the others. """
+    def __init__(self, depth=METRICSDEPTH, shared=None):
+        self.depth = depth
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.histograms = {}
+    def started(self):
+        with self.lock:
+            self.inflight += 1
+    def finished(self, path, status, sent, ms):
+        prefix = path_prefix(path, self.depth)
+        with self.lock:
+            self.inflight -= 1
+            if prefix not in self.histograms:
+                if len(self.histograms) >= MAXPREFIXES:
+                    prefix = "other"
+                if prefix not in self.histograms:
+                    self.histograms[prefix] = Histogram()
+            histogram = self.histograms[prefix]
+            histogram.add(ms, sent)
+            if status == 404:
+                histogram.notfound += 1
+    def snapshot(self, cache=None):
+        with self.lock:
+            histograms = dict((prefix, histogram.copy()) for prefix, histogram in self.histograms.items())
+            inflight = self.inflight
+        return Snapshot(os.getpid(), inflight, histograms, cache.counters() if cache is not None else None)
+    def share(self, cache=None):
+        """ write the snapshot of this process to the shared directory """
+        if not self.shared:
+            return
+        filename = os.path.join(self.shared, "%i.json" % os.getpid())
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.snapshot(cache).values(), f)
+        os.rename(filename + ".tmp", filename)
+    def sharing(self, cache=None, interval=SHAREINTERVAL):
+        """ write the snapshots in the background """
+        def share_loop():
+            while True:
+                try:
+                    self.share(cache)
+                except (IOError, OSError):
+                    pass
+                time.sleep(interval)
+        sharing = threading.Thread(target=share_loop, name="sharing")
+        sharing.daemon = True
+        sharing.start()
+        return sharing
+    def collect(self, cache=None):
+        """ the snapshot of this process merged with those of the others """
+        snapshots = [self.snapshot(cache)]
+        if self.shared:
+            mine = "%i.json" % os.getpid()
+            for name in sorted(os.listdir(self.shared)):
+                if not name.endswith(".json") or name == mine:
+                    continue
+                snapshot = load_snapshot(os.path.join(self.shared, name))
+                if snapshot is None:
+                    continue
+                if not pid_alive(snapshot.pid):
+                    snapshot.inflight = 0  # the counters of old workers are kept
+                    if snapshot.cache is not None:
+                        snapshot.cache.update(bytes=0, files=0)
+                snapshots.append(snapshot)
+        return merge_snapshots(snapshots)
+    def text(self, cache=None):
+        return metrics_text(self.collect(cache))
+
+class Histogram(object):
+    """ the requests of a path prefix with their bytes and latencies. The
+        latencies are counted in buckets with the LATENCIES as bounds. """
+    def __init__(self, requests=0, sent=0, notfound=0, ms=0.0, slowest=0.0, buckets=None):
+        self.requests = requests
+        self.sent = sent
+        self.notfound = notfound
+        self.ms = ms
+        self.slowest = slowest
+        self.buckets = list(buckets or [0] * (len(LATENCIES) + 1))
+    def add(self, ms, sent):
+        self.requests += 1
+        self.sent += sent
+        self.ms += ms
+        self.slowest = max(self.slowest, ms)
+        self.buckets[bisect.bisect_left(LATENCIES, ms)] += 1
+    def merge(self, other):
+        self.requests += other.requests
+        self.sent += other.sent
+        self.notfound += other.notfound
+        self.ms += other.ms
+        self.slowest = max(self.slowest, other.slowest)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+    def copy(self):
+        return Histogram(self.requests, self.sent, self.notfound, self.ms, self.slowest, self.buckets)
+    def quantile(self, quantile):
+        """ the upper bucket bound in ms where the quantile of requests is reached """
+        wanted = quantile * self.requests
+        seen = 0
+        for bound, count in zip(LATENCIES, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(float(bound), self.slowest)
+        return self.slowest
+    def values(self):
+        return {"requests": self.requests, "sent": self.sent, "notfound": self.notfound,
+                "ms": self.ms, "slowest": self.slowest, "buckets": list(self.buckets)}
+
+class Snapshot(object):
+    """ the counters of a worker process as shared with the others through
+        a json file, or their sum that is shown as the metrics text """
+    def __init__(self, pid=0, inflight=0, histograms=None, cache=None, workers=1):
+        self.pid = pid
+        self.inflight = inflight
+        self.histograms = histograms or {}
+        self.cache = cache
+        self.workers = workers
+    def values(self):
+        values = {"pid": self.pid, "inflight": self.inflight, "workers": self.workers,
+                  "histograms": dict((prefix, histogram.values()) for prefix, histogram in self.histograms.items())}
+        if self.cache is not None:
+            values["cache"] = self.cache
+        return values
+
+class FileCache(object):
+    """ an LRU of the contents of metadata files, limited by bytes. An entry is
+        only used while the size and mtime of the file are the same. A single
+        file may take a quarter of the cache at most. """
+    def __init__(self, maxsize=CACHESIZE, patterns=None):
+        self.maxsize = maxsize
+        self.patterns = patterns or METADATA
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # path -> (size, mtime, data)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+    def wanted(self, path):
+        for pattern in self.patterns:
+            if fnmatch(path, pattern):
+                return True
+        return False
+    def get(self, path, st):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime:
+                self.entries[path] = entry  # most recently used
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self.size -= len(entry[2])
+            self.misses += 1
+            return None
+    def fits(self, st):
+        return st.st_size <= self.maxsize // 4
+    def put(self, path, st, data, evict=True):
+        if len(data) != st.st_size or not self.fits(st):
+            return False
+        with self.lock:
+            if not evict and self.size + len(data) > self.maxsize:
+                return False
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self.entries[path] = (st.st_size, st.st_mtime, data)
+            self.size += len(data)
+            while self.size > self.maxsize:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped[2])
+        return True
+    def open(self, path):
+        """ a file object from the cache (or put into it) and its stat. A file
+            that is too big for the cache is returned as the open file, so
+            that it is not read into memory and can be sent with sendfile. """
+        st = os.stat(path)
+        data = self.get(path, st)
+        if data is None:
+            f = open(path, "rb")
+            st = os.fstat(f.fileno())
+            if not self.fits(st):
+                return f, st
+            with f:
+                data = f.read()
+            self.put(path, st, data)
+        return io.BytesIO(data), st
+    def prewarm(self, top="."):
+        """ load the metadata dirs in the background, without evicting """
+        prewarm = threading.Thread(target=self.prewarm_dirs, args=(os.path.abspath(top),), name="prewarm")
+        prewarm.daemon = True
+        prewarm.start()
+        return prewarm
+    def prewarm_dirs(self, top):
+        for dirpath, dirnames, filenames in os.walk(top):
+            if os.path.basename(dirpath) in METADATADIRS:
+                for dirpath2, _, filenames2 in os.walk(dirpath):
+                    for filename in filenames2:
+                        path = os.path.join(dirpath2, filename)
+                        if not self.wanted(path):
+                            continue
+                        try:
+                            if not self.fits(os.stat(path)):
+                                continue
+                            with open(path, "rb") as f:
+                                if not self.put(path, os.fstat(f.fileno()), f.read(), evict=False):
+                                    continue
+                        except (IOError, OSError):
+                            continue
+                dirnames[:] = []
+            else:
+                dirnames[:] = [name for name in dirnames if name not in NOPREWARMDIRS]
+    def counters(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self.size, "files": len(self.entries)}
+
+class VirtualHosts(object):
+    """ the handler class for a request by the first path segment being the
+        name of a mirror, or else by the Host header and http/https. The
+        handlers of the mirrors usually serve from different data roots. """
+    def __init__(self):
+        self.routes = []
+        self.names = {}  # mirror name -> handler
+        self.hosts = {}  # (hostname, secure) -> handler
+    def add(self, name, hosts, handler, secure=False):
+        handler.vhosts = self
+        self.routes.append(handler)
+        self.names[name] = handler
+        for host in hosts:
+            self.hosts.setdefault((host.lower(), secure), handler)
+        return handler
+    def route(self, request):
+        parts = request.path.split("/", 2)
+        if len(parts) > 2 and parts[1] in self.names:
+            request.routed = "/" + parts[1]
+            request.path = "/" + parts[2]
+            return self.names[parts[1]]
+        secure = isinstance(request.connection, ssl.SSLSocket)
+        host = (request.headers.get("Host") or "").lower()
+        if host.startswith("["):
+            host = host.split("]", 1)[0] + "]"
+        else:
+            host = host.split(":", 1)[0]
+        handler = self.hosts.get((host, secure)) or self.hosts.get((host, not secure))
+        if handler is None:
+            for (_, routesecure), routehandler in sorted(self.hosts.items()):
+                if routesecure == secure:
+                    return routehandler
+            return self.routes[0] if self.routes else None
+        return handler
+
+class MirrorHandler(SimpleHTTPRequestHandler):
+    """ the base of MyHandler in the scripts. Regular files are sent with
+        sendfile on plain connections while ssl connections need to go
+        through a buffered copy. Files are answered with an ETag and the
+        server does conditional requests and single or multiple ranges.
+        Every answer has a Content-Length so that the connection can stay
+        open for the next request, up to an idle timeout and a request cap.
+        When other connections wait for a worker or when the server is
+        stopping then it is closed early, also while it is idle.
+        With an accesslog the requests go there instead of stderr. With
+        metrics the requests are counted, answered on the METRICSPATH.
+        With a cache the metadata files are answered from memory. With a
+        root the files are served from there instead of the current dir.
+        With vhosts the handler class is switched per request, as the
+        routes are subclasses of the MirrorHandler as well. """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and a small body are separate writes
+    timeout = IDLETIMEOUT
+    maxrequests = MAXREQUESTS
+    accesslog = None  # AccessLog
+    metrics = None  # Metrics
+    cache = None  # FileCache
+    root = None  # data directory
+    vhosts = None  # VirtualHosts
+    routed = ""
+    handled = 0
+    answering = False
+    status = None
+    sent = 0
+    served_as = None
+    byteranges = None
+    def setup(self):
+        SimpleHTTPRequestHandler.setup(self)
+        self.handled = 0
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_request():
+            self.handle_one_request()
+    def wait_request(self):
+        """ whether the next request on the kept-alive connection has arrived
+            within the idle timeout. It is waited for in short slices, and the
+            connection is given up as soon as others wait for a worker. """
+        waited = 0.0
+        while not self.request_buffered():
+            if self.server_busy() or getattr(self.server, "stopping", False):
+                return False
+            if waited >= self.timeout:
+                return False
+            readable, _, _ = select.select([self.connection], [], [], IDLEPOLL)
+            if readable:
+                return True
+            waited += IDLEPOLL
+        return True
+    def request_buffered(self):
+        """ when a pipelined request was already read into the buffer """
+        if isinstance(self.connection, ssl.SSLSocket) and self.connection.pending():
+            return True
+        if not hasattr(self.rfile, "peek"):  # py2
+            rbuf = getattr(self.rfile, "_rbuf", None)
+            return rbuf is not None and rbuf.tell() > 0
+        timeout = self.connection.gettimeout()
+        self.connection.settimeout(0.0)
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except (ssl.SSLError, socket.error, OSError, ValueError):
+            return False
+        finally:
+            self.connection.settimeout(timeout)
+    def handle_one_request(self):
+        self.handled += 1
+        self.status = None
+        self.sent = 0
+        self.served_as = None
+        self.answering = False
+        self.routed = ""
+        started = TIMER()
+        try:
+            SimpleHTTPRequestHandler.handle_one_request(self)
+        finally:
+            ms = round((TIMER() - started) * 1000, 3)
+            if self.answering and self.metrics is not None:
+                self.metrics.finished(self.path, self.status, self.sent, ms)
+        if self.status is not None and self.accesslog is not None:
+            entry = {"time": round(time.time(), 3), "client": self.client_address[0],
+                     "method": self.command, "path": self.path, "status": self.status,
+                     "bytes": self.sent, "ms": ms}
+            if self.served_as:
+                entry["as"] = self.served_as
+            self.accesslog.log(entry)
+    def parse_request(self):
+        parsed = SimpleHTTPRequestHandler.parse_request(self)
+        if parsed and self.vhosts is not None:
+            route = self.vhosts.route(self)
+            if route is not None:
+                self.__class__ = route
+        if parsed and self.metrics is not None:
+            self.metrics.started()
+            self.answering = True
+        return parsed
+    def send_response(self, code, message=None):
+        self.status = code
+        SimpleHTTPRequestHandler.send_response(self, code, message)
+    def send_header(self, keyword, value):
+        if keyword.lower() == "content-length" and self.command != "HEAD":
+            self.sent = int(value)
+        SimpleHTTPRequestHandler.send_header(self, keyword, value)
+    def log_request(self, code="-", size="-"):
+        if self.accesslog is None:
+            SimpleHTTPRequestHandler.log_request(self, code, size)
+    def end_headers(self):
+        if not self.close_connection and self.request_version != "HTTP/1.0":
+            if self.handled >= self.maxrequests or self.server_busy() or getattr(self.server, "stopping", False):
+                self.send_header("Connection", "close")
+        SimpleHTTPRequestHandler.end_headers(self)
+    def server_busy(self):
+        """ when accepted connections are waiting for a free worker """
+        pending = getattr(self.server, "pending", None)
+        return pending is not None and not pending.empty()
+    def send_data(self, data, content_type="text/plain", code=200, headers=None):
+        """ a complete answer from memory, including its Content-Length """
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers or []:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+    def send_error(self, code, message=None, explain=None):
+        if code not in [404] and explain is None:  # py2 has no explain
+            SimpleHTTPRequestHandler.send_error(self, code, message)
+            return
+        if code not in [404]:
+            SimpleHTTPRequestHandler.send_error(self, code, message, explain)
+            return
+        self.log_error("code %d, message %s", code, message)
+        text = "%i %s\n" % (code, message or "Not Found")
+        self.send_data(text.encode("utf-8"), "text/plain", code)
+    def do_GET(self):
+        if self.metrics is not None and self.path == METRICSPATH:
+            text = self.metrics.text(self.cache)
+            self.send_data(text.encode("utf-8"), "text/plain; version=0.0.4")
+            return
+        f = self.send_head()
+        if f:
+            try:
+                if self.byteranges is None:
+                    self.copyrange(f, self.wfile, f.tell(), None)
+                else:
+                    self.copyranges(f, self.wfile)
+            finally:
+                f.close()
+    def send_head(self):
+        self.byteranges = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = urlsplit(self.path)
+            if not parts.path.endswith("/"):
+                location = urlunsplit((parts[0], parts[1], self.routed + parts[2] + "/", parts[3], parts[4]))
+                self.send_data(b"", "text/plain", 301, [("Location", location)])
+                return None
+        if self.path.endswith("/") or not os.path.isfile(path):
+            return SimpleHTTPRequestHandler.send_head(self)
+        try:
+            f, st = self.open_file(path)
+        except (IOError, OSError):
+            self.send_error(404, "File not found")
+            return None
+        try:
+            etag = file_etag(st)
+            if self.not_modified(etag, st.st_mtime):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+                self.end_headers()
+                f.close()
+                return None
+            ctype = self.guess_type(path)
+            size = st.st_size
+            byteranges = self.want_ranges(etag, st.st_mtime, size)
+            if byteranges is not None and not byteranges:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%i" % size)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                f.close()
+                return None
+            if not byteranges:
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(size))
+            elif len(byteranges) == 1:
+                start, end = byteranges[0]
+                self.send_response(206)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Range", "bytes %i-%i/%i" % (start, end, size))
+                self.send_header("Content-Length", str(end - start + 1))
+                self.byteranges = [(b"", start, end)]
+            else:
+                boundary = binascii.hexlify(os.urandom(12)).decode("ascii")
+                length = 0
+                self.byteranges = []
+                for start, end in byteranges:
+                    part = "\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %i-%i/%i\r\n\r\n" % (boundary, ctype, start, end, size)
+                    self.byteranges.append((part.encode("ascii"), start, end))
+                    length += len(part) + end - start + 1
+                final = "\r\n--%s--\r\n" % boundary
+                self.byteranges.append((final.encode("ascii"), 0, -1))
+                length += len(final)
+                self.send_response(206)
+                self.send_header("Content-Type", "multipart/byteranges; boundary=%s" % boundary)
+                self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+    def translate_path(self, path):
+        translated = SimpleHTTPRequestHandler.translate_path(self, path)
+        if not self.root:
+            return translated
+        current = getattr(self, "directory", None) or os.getcwd()  # py3.7
+        relative = os.path.relpath(translated, current)
+        if relative == "." or relative.startswith(".."):
+            path = self.root
+        else:
+            path = os.path.join(self.root, relative)
+        if translated.endswith("/") and not path.endswith("/"):
+            path += "/"
+        return path
+    def data_path(self, path):
+        """ a path relative to the data directory """
+        if not self.root:
+            return path
+        return os.path.join(self.root, path)
+    def open_file(self, path):
+        """ the file object and its stat, from the cache for metadata files """
+        if self.cache is not None and self.cache.wanted(path):
+            return self.cache.open(path)
+        f = open(path, "rb")
+        return f, os.fstat(f.fileno())
+    def not_modified(self, etag, mtime):
+        """ check If-None-Match and (only without it) If-Modified-Since """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or "W/" + etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            since = http_date(if_modified_since)
+            if since is not None and int(mtime) <= since:
+                return True
+        return False
+    def want_ranges(self, etag, mtime, size):
+        """ None for the full file, or the list of (start, end) from Range.
+            The list is empty when none of the ranges can be satisfied. """
+        byterange = self.headers.get("Range")
+        if not byterange or self.command not in ["GET"]:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range:
+            if_range = if_range.strip()
+            if if_range.startswith('"') or if_range.startswith("W/"):
+                if if_range != etag:
+                    return None
+            elif http_date(if_range) != int(mtime):
+                return None
+        return parse_ranges(byterange, size)
+    def copyranges(self, source, outputfile):
+        for part, start, end in self.byteranges or []:
+            if part:
+                outputfile.write(part)
+            if end >= start:
+                self.copyrange(source, outputfile, start, end - start + 1)
+    def copyrange(self, source, outputfile, offset, count):
+        fileno = self.sendfile_fileno(source, outputfile)
+        if fileno < 0:
+            source.seek(offset)
+            if count is None:
+                shutil.copyfileobj(source, outputfile, COPYBUFSIZE)
+                return
+            while count > 0:
+                data = source.read(min(count, COPYBUFSIZE))
+                if not data:
+                    break
+                outputfile.write(data)
+                count -= len(data)
+            return
+        if FADVISE:
+            os.posix_fadvise(fileno, offset, count or 0, os.POSIX_FADV_SEQUENTIAL)
+        outputfile.flush()
+        self.connection.sendfile(source, offset, count)
+    def sendfile_fileno(self, source, outputfile):
+        """ the fileno of a regular file that can be sent zero-copy, or -1 """
+        if not SENDFILE or outputfile is not self.wfile:
+            return -1
+        if isinstance(self.connection, ssl.SSLSocket):
+            return -1
+        try:
+            fileno = source.fileno()
+            if stat.S_ISREG(os.fstat(fileno).st_mode):
+                return fileno
+        except (AttributeError, OSError, ValueError):
+            pass
+        return -1
+
+def make_certificate(hostname, certdir=CERTDIR):
+    """ the {hostname}.pem with key and self-signed certificate. It is made
+        only if it does not exist yet, usually at image build time. The ec key
+        is made in milliseconds where an rsa:4096 key takes seconds. """
+    pemfile = os.path.join(certdir, hostname + ".pem")
+    if os.path.exists(pemfile):
+        return pemfile
+    parts = hostname.split(".")
+    cc = parts[-1] if len(parts[-1]) <= 2 else "US"
+    og = parts[-2] if len(parts) > 1 else parts[0]
+    keyfile = os.path.join(certdir, hostname + ".key")
+    crtfile = os.path.join(certdir, hostname + ".crt")
+    subj = "/C=%s/L=%s/CN=%s" % (cc, og, hostname)
+    cmd = ["openssl", "ecparam", "-name", "prime256v1", "-genkey", "-noout", "-out", keyfile]
+    print(" ".join(cmd))
+    if subprocess.call(cmd):
+        cmd = ["openssl", "genrsa", "-out", keyfile, "2048"]
+        print(" ".join(cmd))
+        subprocess.call(cmd)
+    cmd = ["openssl", "req", "-new", "-x509", "-sha256", "-days", "3650", "-key", keyfile, "-out", crtfile, "-subj", subj]
+    print(" ".join(cmd))
+    subprocess.call(cmd)
+    with open(pemfile + ".tmp", "w") as pem:
+        for filename in [keyfile, crtfile]:
+            with open(filename) as f:
+                pem.write(f.read())
+    os.rename(pemfile + ".tmp", pemfile)
+    return pemfile
+
+def ssl_context(pemfile):
+    """ a server context that allows tls session resumption by tickets """
+    # SSLContext was introduced in 2.7.9 # ssl.wrap_socket was removed in Python 3.12
+    context = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS_SERVER", ssl.PROTOCOL_SSLv23))
+    context.options &= ~getattr(ssl, "OP_NO_TICKET", 0)
+    context.load_cert_chain(certfile=pemfile)
+    return context
+
+def cpu_quota():
+    """ the cpus of the container from the cgroup v2 cpu.max or the cgroup v1
+        cfs quota, else the available cpus up to MAXWORKERS """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # py2
+        import multiprocessing  # pylint: disable=import-outside-toplevel
+        cpus = multiprocessing.cpu_count()
+    quota, period = 0, 0
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            values = f.read().split()
+        if values[0] != "max":
+            quota, period = int(values[0]), int(values[1])
+    except (IOError, OSError, ValueError, IndexError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+        except (IOError, OSError, ValueError):
+            quota, period = 0, 0
+    if quota > 0 and period > 0:
+        return max(1, min(cpus, int(math.ceil(quota / float(period)))))
+    return max(1, min(cpus, MAXWORKERS))
+
+def serve(handler, port, opt, context=None, listeners=None):
+    """ the common serving part of the scripts, with the options from
+        optparse. The handler is set up in each worker process, as the
+        background threads do not survive a fork. The memory cache size
+        is split over the workers. The listeners are more (port, context)
+        pairs to be served by the same workers. """
+    workers = int(getattr(opt, "workers", WORKERS)) or cpu_quota()
+    shared = tempfile.mkdtemp(prefix="mirrorserver-") if workers > 1 else None
+    cachesize = int(getattr(opt, "cachesize", 0)) * 1024 * 1024 // workers
+    routes = handler.vhosts.routes if handler.vhosts is not None else []
+    def make_server():
+        metrics = Metrics(shared=shared)
+        cache = FileCache(cachesize) if cachesize else None
+        accesslog = AccessLog(opt.accesslog, float(opt.summary)) if opt.accesslog else None
+        for route in [handler] + routes:
+            route.timeout = float(opt.timeout)
+            route.maxrequests = int(opt.maxrequests)
+            route.metrics = metrics
+            route.cache = cache
+            route.accesslog = accesslog
+        if cache is not None:
+            for root in sorted(set(route.root or "." for route in routes or [handler])):
+                cache.prewarm(root)
+        if shared:
+            metrics.sharing(cache)
+        servers = []
+        for listenport, listencontext in [(port, context)] + list(listeners or []):
+            servers.append(ThreadPoolServer(("", listenport), handler, int(opt.threads), listencontext, reuseport=workers > 1))
+        return servers[0] if len(servers) == 1 else ServerGroup(servers)
+    sys.stdout.flush()
+    if workers <= 1:
+        make_server().serve_forever()
+    else:
+        try:
+            prefork(make_server, workers)
+        finally:
+            if shared:
+                shutil.rmtree(shared, ignore_errors=True)
+
+def prefork(make_server, workers):
+    """ run make_server().serve_forever() in that many processes. A worker
+        that dies is replaced. On SIGHUP a new set of workers is started and
+        the old ones are stopped gracefully, on SIGTERM all are stopped. """
+    state = {"generation": 0, "restart": False, "running": True}
+    children = {}  # pid -> (generation, started)
+    def start_worker():
+        pid = os.fork()
+        if not pid:
+            code = 0
+            try:
+                serve_worker(make_server)
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+                code = 1
+            sys.stdout.flush()
+            os._exit(code)  # pylint: disable=protected-access
+        children[pid] = (state["generation"], time.time())
+    def restart(signum, frame):  # pylint: disable=unused-argument
+        state["restart"] = True
+    def terminate(signum, frame):  # pylint: disable=unused-argument
+        state["running"] = False
+    signal.signal(signal.SIGHUP, restart)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for _ in range(workers):
+        start_worker()
+    print("started", workers, "workers", sorted(children))
+    sys.stdout.flush()
+    stopping = False
+    while children:
+        if state["restart"] and state["running"]:
+            state["restart"] = False
+            old = list(children)
+            state["generation"] += 1
+            for _ in range(workers):
+                start_worker()
+            for pid in old:
+                signal_worker(pid, signal.SIGTERM)
+            print("restarted", workers, "workers", sorted(pid for pid in children if pid not in old))
+            sys.stdout.flush()
+        if not state["running"] and not stopping:
+            for pid in children:
+                signal_worker(pid, signal.SIGTERM)
+            stopping = True
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                break
+            continue
+        if not pid:
+            time.sleep(0.1)
+            continue
+        generation, started = children.pop(pid, (None, 0))
+        if generation == state["generation"] and state["running"]:
+            print("worker", pid, "exited with", status, "- restarting")
+            sys.stdout.flush()
+            if time.time() - started < 1:
+                time.sleep(1)  # do not spin on a worker that can not start
+            start_worker()
+
+def serve_worker(make_server):
+    """ one worker process that stops gracefully on SIGTERM """
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent sends a SIGTERM
+    server = make_server()
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    server.serve_forever()
+    server.server_close()
+    server.join()
+    metrics = getattr(server.RequestHandlerClass, "metrics", None)
+    if metrics is not None:
+        metrics.share(getattr(server.RequestHandlerClass, "cache", None))
+
+def signal_worker(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except OSError:
+        pass
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def write_lines(fd, lines):
+    """ whole lines with one write() each up to PIPEBUF, so that the lines
+        of several processes on one pipe or O_APPEND file do not mix """
+    chunk = b""
+    for line in lines:
+        data = line.encode("utf-8")
+        if chunk and len(chunk) + len(data) > PIPEBUF:
+            write_all(fd, chunk)
+            chunk = b""
+        chunk += data
+    if chunk:
+        write_all(fd, chunk)
+
+def write_all(fd, data):
+    while data:
+        try:
+            written = os.write(fd, data)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        data = data[written:]
+
+def load_snapshot(filename):
+    """ the Snapshot that another worker process has written, or None """
+    try:
+        with open(filename) as f:
+            values = json.load(f)
+        histograms = dict((prefix, Histogram(**counters)) for prefix, counters in values.get("histograms", {}).items())
+        return Snapshot(values.get("pid", 0), values.get("inflight", 0), histograms, values.get("cache"))
+    except (IOError, OSError, ValueError, TypeError, AttributeError):
+        return None
+
+def merge_snapshots(snapshots):
+    """ the sum of the Metrics snapshots of the worker processes """
+    merged = Snapshot(workers=len(snapshots))
+    for snapshot in snapshots:
+        merged.inflight += snapshot.inflight
+        for prefix, histogram in snapshot.histograms.items():
+            if prefix not in merged.histograms:
+                merged.histograms[prefix] = Histogram()
+            merged.histograms[prefix].merge(histogram)
+        if snapshot.cache is not None:
+            if merged.cache is None:
+                merged.cache = {"hits": 0, "misses": 0, "bytes": 0, "files": 0}
+            for key in merged.cache:
+                merged.cache[key] += snapshot.cache.get(key, 0)
+    return merged
+
+def metrics_text(snapshot):
+    """ the prometheus text format of a (merged) Metrics snapshot """
+    histograms = snapshot.histograms
+    lines = []
+    lines.append("# HELP mirror_requests_total Requests answered by path prefix.")
+    lines.append("# TYPE mirror_requests_total counter")
+    for prefix in sorted(histograms):
+        lines.append('mirror_requests_total{prefix="%s"} %i' % (label(prefix), histograms[prefix].requests))
+    lines.append("# HELP mirror_bytes_total Body bytes sent by path prefix.")
+    lines.append("# TYPE mirror_bytes_total counter")
+    for prefix in sorted(histograms):
+        lines.append('mirror_bytes_total{prefix="%s"} %i' % (label(prefix), histograms[prefix].sent))
+    lines.append("# HELP mirror_notfound_total Requests answered with 404 by path prefix.")
+    lines.append("# TYPE mirror_notfound_total counter")
+    for prefix in sorted(histograms):
+        lines.append('mirror_notfound_total{prefix="%s"} %i' % (label(prefix), histograms[prefix].notfound))
+    lines.append("# HELP mirror_inflight_requests Requests being answered right now.")
+    lines.append("# TYPE mirror_inflight_requests gauge")
+    lines.append("mirror_inflight_requests %i" % snapshot.inflight)
+    lines.append("# HELP mirror_workers Worker processes of the server.")
+    lines.append("# TYPE mirror_workers gauge")
+    lines.append("mirror_workers %i" % snapshot.workers)
+    lines.append("# HELP mirror_request_seconds Latency of the requests by path prefix.")
+    lines.append("# TYPE mirror_request_seconds summary")
+    for prefix in sorted(histograms):
+        histogram = histograms[prefix]
+        for quantile in [0.5, 0.99]:
+            seconds = histogram.quantile(quantile) / 1000.
+            lines.append('mirror_request_seconds{prefix="%s",quantile="%s"} %.6f' % (label(prefix), quantile, seconds))
+        lines.append('mirror_request_seconds_sum{prefix="%s"} %.6f' % (label(prefix), histogram.ms / 1000.))
+        lines.append('mirror_request_seconds_count{prefix="%s"} %i' % (label(prefix), histogram.requests))
+    cache = snapshot.cache
+    if cache is not None:
+        lines.append("# HELP mirror_cache_hits_total Metadata answers from the memory cache.")
+        lines.append("# TYPE mirror_cache_hits_total counter")
+        lines.append("mirror_cache_hits_total %i" % cache["hits"])
+        lines.append("# HELP mirror_cache_misses_total Metadata answers read from disk.")
+        lines.append("# TYPE mirror_cache_misses_total counter")
+        lines.append("mirror_cache_misses_total %i" % cache["misses"])
+        lines.append("# HELP mirror_cache_bytes Size of the files in the memory cache.")
+        lines.append("# TYPE mirror_cache_bytes gauge")
+        lines.append("mirror_cache_bytes %i" % cache["bytes"])
+        lines.append("# HELP mirror_cache_files Number of the files in the memory cache.")
+        lines.append("# TYPE mirror_cache_files gauge")
+        lines.append("mirror_cache_files %i" % cache["files"])
+    return "\n".join(lines) + "\n"
+
+def sni_context(pemfiles):
+    """ a server context that switches to the certificate of the hostname
+        that the client asks for, from the (hostname, pemfile) pairs. The
+        first one is used when the client does not send a server name. """
+    contexts = OrderedDict((hostname, ssl_context(pemfile)) for hostname, pemfile in pemfiles)
+    context = list(contexts.values())[0]
+    def servername(sslsocket, hostname, initial):  # pylint: disable=unused-argument
+        if hostname and hostname in contexts:
+            sslsocket.context = contexts[hostname]
+    if hasattr(context, "sni_callback"):  # py3.7
+        context.sni_callback = servername
+    else:
+        context.set_servername_callback(servername)
+    return context
+
+def file_etag(st):
+    """ a strong validator from the size and mtime of a file """
+    return '"%x-%x"' % (st.st_size, int(st.st_mtime * 1000000))
+
+def http_date(text):
+    """ seconds since epoch from an http date, or None """
+    parsed = email.utils.parsedate_tz(text)
+    if not parsed:
+        return None
+    return int(email.utils.mktime_tz(parsed))
+
+def path_prefix(path, depth=2):
+    """ '/9/BaseOS/x86_64/os/Packages/a.rpm?x' -> '/9/BaseOS' """
+    parts = path.split("?", 1)[0].split("/")
+    return "/".join(parts[:depth + 1])
+
+def label(value):
+    """ escaped for a prometheus label value """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def parse_ranges(byterange, size):
+    """ the (start, end) pairs of 'bytes=a-b,c-,-n' clipped to the size,
+        or None when the header is not understood and must be ignored """
+    unit, _, spec = byterange.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    found = []
+    items = [item.strip() for item in spec.split(",") if item.strip()]
+    if not items:
+        return None
+    for item in items:
+        first, dash, last = item.partition("-")
+        first, last = first.strip(), last.strip()
+        if not dash or not (first or last):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            suffix = int(last)
+            if suffix and size:
+                found.append((max(0, size - suffix), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if end < start:
+            return None
+        if start < size:
+            found.append((start, min(end, size - 1)))
+    if len(found) > MAXRANGES:
+        return None
+    return found
@@ -0,0 +1,212 @@
+#! /usr/bin/python3
+from typing import List, Tuple, Dict, Type, BinaryIO, Optional, Callable, Union, ClassVar, Sequence
+import os
+import types
+import io
+import collections
+import optparse
+import threading
+import queue
+import socket
+import ssl
+from socketserver import TCPServer, BaseRequestHandler
+from http.server import SimpleHTTPRequestHandler
+
+THREADS: int
+BACKLOG: int
+COPYBUFSIZE: int
+SENDFILE: bool
+FADVISE: bool
+MAXRANGES: int
+IDLETIMEOUT: int
+IDLEPOLL: float
+MAXREQUESTS: int
+ACCESSLOGSIZE: int
+SUMMARY: int
+LATENCIES: List[int]
+TIMER: Callable[[], float]
+METRICSPATH: str
+METRICSDEPTH: int
+MAXPREFIXES: int
+CERTDIR: str
+HANDSHAKETIMEOUT: int
+CACHESIZE: int
+METADATA: List[str]
+METADATADIRS: List[str]
+NOPREWARMDIRS: List[str]
+WORKERS: int
+MAXWORKERS: int
+GRACE: int
+SHAREINTERVAL: int
+PIPEBUF: int
+SO_REUSEPORT: int
+
+class ThreadPoolServer(TCPServer):
+    threads: int
+    pending: queue.Queue[Tuple[Optional[socket.socket], Optional[Tuple[str, int]]]]
+    workers: List[threading.Thread]
+    context: Optional[ssl.SSLContext]
+    reuseport: bool
+    stopping: bool
+    def __init__(self, server_address: Tuple[str, int], RequestHandlerClass: Type[BaseRequestHandler], threads: int = THREADS, context: Optional[ssl.SSLContext] = None, reuseport: bool = False) -> None: ...
+    def server_bind(self) -> None: ...
+    def process_request(self, request: Union[socket.socket, Tuple[bytes, socket.socket]], client_address: Tuple[str, int]) -> None: ...
+    def process_request_worker(self) -> None: ...
+    def server_close(self) -> None: ...
+    def stop(self) -> None: ...
+    def join(self, grace: float = GRACE) -> None: ...
+
+class ServerGroup(object):
+    servers: List[ThreadPoolServer]
+    RequestHandlerClass: Callable[[socket.socket, Tuple[str, int], ThreadPoolServer], BaseRequestHandler]
+    def __init__(self, servers: List[ThreadPoolServer]) -> None: ...
+    def serve_forever(self) -> None: ...
+    def stop(self) -> None: ...
+    def server_close(self) -> None: ...
+    def join(self, grace: float = GRACE) -> None: ...
+
+class AccessLog(object):
+    filename: str
+    summary: float
+    entries: queue.Queue[Dict[str, Union[str, int, float]]]
+    lock: threading.Lock
+    dropped: int
+    histograms: Dict[str, Histogram]
+    writer: threading.Thread
+    def __init__(self, filename: str = "-", summary: float = SUMMARY, size: int = ACCESSLOGSIZE) -> None: ...
+    def log(self, entry: Dict[str, Union[str, int, float]]) -> None: ...
+    def write_entries(self) -> None: ...
+    def record(self, entry: Dict[str, Union[str, int, float]]) -> None: ...
+    def summary_lines(self) -> List[str]: ...
+
+class Metrics(object):
+    depth: int
+    shared: Optional[str]
+    lock: threading.Lock
+    inflight: int
+    histograms: Dict[str, Histogram]
+    def __init__(self, depth: int = METRICSDEPTH, shared: Optional[str] = None) -> None: ...
+    def started(self) -> None: ...
+    def finished(self, path: str, status: Optional[int], sent: int, ms: float) -> None: ...
+    def snapshot(self, cache: Optional[FileCache] = None) -> Snapshot: ...
+    def share(self, cache: Optional[FileCache] = None) -> None: ...
+    def sharing(self, cache: Optional[FileCache] = None, interval: float = SHAREINTERVAL) -> threading.Thread: # type: ignore[return]
+        def share_loop() -> None: ...
+    def collect(self, cache: Optional[FileCache] = None) -> Snapshot: ...
+    def text(self, cache: Optional[FileCache] = None) -> str: ...
+
+class Histogram(object):
+    requests: int
+    sent: int
+    notfound: int
+    ms: float
+    slowest: float
+    buckets: List[int]
+    def __init__(self, requests: int = 0, sent: int = 0, notfound: int = 0, ms: float = 0.0, slowest: float = 0.0, buckets: Optional[List[int]] = None) -> None: ...
+    def add(self, ms: float, sent: int) -> None: ...
+    def merge(self, other: Histogram) -> None: ...
+    def copy(self) -> Histogram: ...
+    def quantile(self, quantile: float) -> float: ...
+    def values(self) -> Dict[str, Union[int, float, List[int]]]: ...
+
+class Snapshot(object):
+    pid: int
+    inflight: int
+    histograms: Dict[str, Histogram]
+    cache: Optional[Dict[str, int]]
+    workers: int
+    def __init__(self, pid: int = 0, inflight: int = 0, histograms: Optional[Dict[str, Histogram]] = None, cache: Optional[Dict[str, int]] = None, workers: int = 1) -> None: ...
+    def values(self) -> Dict[str, object]: ...
+
+class FileCache(object):
+    maxsize: int
+    patterns: List[str]
+    lock: threading.Lock
+    entries: collections.OrderedDict[str, Tuple[int, float, bytes]]
+    size: int
+    hits: int
+    misses: int
+    def __init__(self, maxsize: int = CACHESIZE, patterns: Optional[List[str]] = None) -> None: ...
+    def wanted(self, path: str) -> bool: ...
+    def get(self, path: str, st: os.stat_result) -> Optional[bytes]: ...
+    def fits(self, st: os.stat_result) -> bool: ...
+    def put(self, path: str, st: os.stat_result, data: bytes, evict: bool = True) -> bool: ...
+    def open(self, path: str) -> Tuple[BinaryIO, os.stat_result]: ...
+    def prewarm(self, top: str = ".") -> threading.Thread: ...
+    def prewarm_dirs(self, top: str) -> None: ...
+    def counters(self) -> Dict[str, int]: ...
+
+class VirtualHosts(object):
+    routes: List[Type[MirrorHandler]]
+    names: Dict[str, Type[MirrorHandler]]
+    hosts: Dict[Tuple[str, bool], Type[MirrorHandler]]
+    def __init__(self) -> None: ...
+    def add(self, name: str, hosts: List[str], handler: Type[MirrorHandler], secure: bool = False) -> Type[MirrorHandler]: ...
+    def route(self, request: MirrorHandler) -> Optional[Type[MirrorHandler]]: ...
+
+class MirrorHandler(SimpleHTTPRequestHandler):
+    protocol_version: str
+    disable_nagle_algorithm: ClassVar[bool]
+    timeout: ClassVar[float]
+    maxrequests: int
+    accesslog: Optional[AccessLog]
+    metrics: Optional[Metrics]
+    cache: Optional[FileCache]
+    root: Optional[str]
+    vhosts: Optional[VirtualHosts]
+    routed: str
+    handled: int
+    answering: bool
+    status: Optional[int]
+    sent: int
+    served_as: Optional[str]
+    byteranges: Optional[List[Tuple[bytes, int, int]]]
+    def setup(self) -> None: ...
+    def handle(self) -> None: ...
+    def wait_request(self) -> bool: ...
+    def request_buffered(self) -> bool: ...
+    def handle_one_request(self) -> None: ...
+    def parse_request(self) -> bool: ...
+    def send_response(self, code: int, message: Optional[str] = None) -> None: ...
+    def send_header(self, keyword: str, value: str) -> None: ...
+    def log_request(self, code: Union[int, str] = "-", size: Union[int, str] = "-") -> None: ...
+    def end_headers(self) -> None: ...
+    def server_busy(self) -> bool: ...
+    def send_data(self, data: bytes, content_type: str = "text/plain", code: int = 200, headers: Optional[List[Tuple[str, str]]] = None) -> None: ...
+    def send_error(self, code: int, message: Optional[str] = None, explain: Optional[str] = None) -> None: ...
+    def do_GET(self) -> None: ...
+    def send_head(self) -> Optional[BinaryIO]: ... # type: ignore[override]
+    def translate_path(self, path: str) -> str: ...
+    def data_path(self, path: str) -> str: ...
+    def open_file(self, path: str) -> Tuple[BinaryIO, os.stat_result]: ...
+    def not_modified(self, etag: str, mtime: float) -> bool: ...
+    def want_ranges(self, etag: str, mtime: float, size: int) -> Optional[List[Tuple[int, int]]]: ...
+    def copyranges(self, source: BinaryIO, outputfile: io.BufferedIOBase) -> None: ...
+    def copyrange(self, source: BinaryIO, outputfile: io.BufferedIOBase, offset: int, count: Optional[int]) -> None: ...
+    def sendfile_fileno(self, source: BinaryIO, outputfile: io.BufferedIOBase) -> int: ...
+
+def make_certificate(hostname: str, certdir: str = CERTDIR) -> str: ...
+def ssl_context(pemfile: str) -> ssl.SSLContext: ...
+def cpu_quota() -> int: ...
+def serve(handler: Type[MirrorHandler], port: int, opt: optparse.Values, context: Optional[ssl.SSLContext] = None, listeners: Optional[Sequence[Tuple[int, Optional[ssl.SSLContext]]]] = None) -> None: # type: ignore[return]
+    def make_server() -> Union[ThreadPoolServer, ServerGroup]: ...
+def prefork(make_server: Callable[[], Union[ThreadPoolServer, ServerGroup]], workers: int) -> None: # type: ignore[return]
+    children: Dict[int, Tuple[int, float]]
+    def start_worker() -> None: ...
+    def restart(signum: int, frame: Optional[types.FrameType]) -> None: ...
+    def terminate(signum: int, frame: Optional[types.FrameType]) -> None: ...
+def serve_worker(make_server: Callable[[], Union[ThreadPoolServer, ServerGroup]]) -> None: ...
+def signal_worker(pid: int, signum: int) -> None: ...
+def pid_alive(pid: int) -> bool: ...
+def write_lines(fd: int, lines: List[str]) -> None: ...
+def write_all(fd: int, data: bytes) -> None: ...
+def load_snapshot(filename: str) -> Optional[Snapshot]: ...
+def merge_snapshots(snapshots: List[Snapshot]) -> Snapshot: ...
+def metrics_text(snapshot: Snapshot) -> str: ...
+def sni_context(pemfiles: List[Tuple[str, str]]) -> ssl.SSLContext: # type: ignore[return]
+    def servername(sslsocket: Union[ssl.SSLSocket, ssl.SSLObject], hostname: Optional[str], initial: Union[ssl.SSLContext, ssl.SSLSocket]) -> None: ...
+def file_etag(st: os.stat_result) -> str: ...
+def http_date(text: str) -> Optional[int]: ...
+def path_prefix(path: str, depth: int = 2) -> str: ...
+def label(value: str) -> str: ...
+def parse_ranges(byterange: str, size: int) -> Optional[List[Tuple[int, int]]]: ...
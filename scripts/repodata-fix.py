@@ -1,25 +1,130 @@
 #! /usr/bin/python3
+""" fix the repomd.xml when the repodata files were replaced by ones with another
+    checksum prefix. The repodata dir is scanned once into an index by the name
+    suffix, and each file is hashed in one streaming pass for both its compressed
+    and its decompressed checksum. The repomd.xml is replaced atomically. Given
+    directories, all the repomd.xml files below are fixed in parallel with one summary
+    at the end. The checksums are kept in a sidecar cache, so an unchanged repo is
+    fixed without hashing again. """
 
 __copyright__ = "(C) 2018-2025 Guido Draheim"
 __contact__ = "https://github.com/gdraheim/docker-mirror-packages-repo"
 __license__ = "CC0 Creative Commons Zero (Public Domain)"
 __version__ = "1.7.7122"
 
+from typing import Dict, List, Tuple, Optional
 import xml.dom.minidom as minidom
 import os.path as path
 import os
-import gzip
+import sys
+import shutil
 import hashlib
+import zlib
+import time
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from checksumcache import ChecksumCache, SIDECAR
 
 import logging
 logg = logging.getLogger("FIX")
 
+CHUNKSIZE = 1024 * 1024
+CHECKSUMS = ["sha256", "sha512"]  # the checksum type is kept when it is one of these
+DEFAULT_CHECKSUM = "sha256"
+REPOMD = "repomd.xml"
+JOBS = 0  # 0 for the number of cpus
+
+def repodata_index(repodatadir: str) -> Dict[str, str]:
+    """ the name suffix after the last '-' -> the file in the repodata dir.
+        As with the old full walk per entry, the last one found wins. """
+    index: Dict[str, str] = {}
+    for dirpath, dirnames, filenames in os.walk(repodatadir):
+        for filename in filenames:
+            if "-" in filename:
+                index[filename.split("-")[-1]] = path.join(dirpath, filename)
+    return index
+
+def file_checksums(filename: str, checksum: str = DEFAULT_CHECKSUM) -> Tuple[str, int, str, int]:
+    """ checksum and size of the gzip file and of its content, in one pass """
+    packed = hashlib.new(checksum)
+    opened = hashlib.new(checksum)
+    size = 0
+    open_size = 0
+    unzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with open(filename, "rb") as f:
+        while True:
+            chunk = f.read(CHUNKSIZE)
+            if not chunk:
+                break
+            packed.update(chunk)
+            size += len(chunk)
+            while chunk:
+                data = unzip.decompress(chunk)
+                opened.update(data)
+                open_size += len(data)
+                chunk = b""
+                if unzip.eof and unzip.unused_data:  # concatenated gzip members
+                    chunk = unzip.unused_data
+                    unzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = unzip.flush()
+    opened.update(data)
+    open_size += len(data)
+    if not unzip.eof:
+        raise EOFError("compressed file ended before the end-of-stream marker: " + filename)
+    return packed.hexdigest(), size, opened.hexdigest(), open_size
+
+def checksum_type(data: minidom.Element) -> str:
+    """ the checksum type of a repomd <data> entry, if we can keep it """
+    for checksum in data.getElementsByTagName("checksum"):
+        kind = checksum.getAttribute("type")
+        if kind in CHECKSUMS:
+            return kind
+    return DEFAULT_CHECKSUM
+
+def write_xml(dom: minidom.Document, datafile: str) -> None:
+    """ replace the datafile atomically, the previous one is kept as .old """
+    tmpfile = datafile + ".tmp"
+    with open(tmpfile, "w") as f:
+        dom.writexml(f)
+        f.flush()
+        os.fsync(f.fileno())
+    oldfile = datafile + ".old"
+    if path.exists(oldfile):
+        os.remove(oldfile)
+    try:
+        os.link(datafile, oldfile)
+    except OSError:
+        shutil.copy2(datafile, oldfile)
+    os.replace(tmpfile, datafile)
 
-def fix(datafile: str) -> None:
+def cached_checksums(cache: Optional[ChecksumCache], filename: str, checksum: str) -> Tuple[str, int, str, int, bool]:
+    """ file_checksums() unless the cache has them, the last value tells if it had """
+    if cache is not None:
+        values = cache.get(filename, checksum)
+        if values:
+            return (str(values["checksum"]), int(values["size"]),
+                    str(values["open-checksum"]), int(values["open-size"]), True)
+    checksum_gz, size_gz, checksum_xml, size_xml = file_checksums(filename, checksum)
+    if cache is not None:
+        cache.put(filename, checksum, {"checksum": checksum_gz, "size": size_gz,
+                                       "open-checksum": checksum_xml, "open-size": size_xml})
+    return checksum_gz, size_gz, checksum_xml, size_xml, False
+
+def fix(datafile: str, cachefile: Optional[str] = "") -> Tuple[int, int, int]:
+    """ returns the number of fixed entries, the bytes hashed for them and the number
+        of entries taken from the cache. The cachefile defaults to the sidecar in the
+        repodata directory, None is for no cache. """
     logg.info("reading %s", datafile)
     repodatadir = path.dirname(datafile)
     repodata = path.basename(repodatadir)
     fixes = 0
+    hashed = 0
+    cached = 0
+    cache = None
+    if cachefile is not None:
+        cache = ChecksumCache(cachefile or path.join(repodatadir, SIDECAR))
+    index = None
     dom = minidom.parse(datafile)
     for data in dom.getElementsByTagName("data"):
         kind = data.getAttribute("type")
@@ -32,41 +137,87 @@ def fix(datafile: str) -> None:
         else:
             logg.info("%s missing %s", kind, href)
             basename = path.basename(href)
-            dirsname = path.dirname(href)
+            found = ""
             if "-" in basename:
-                found = ""
-                suffix = basename.split("-")[-1]
-                for dirpath, dirnames, filenames in os.walk(repodatadir):
-                    for filename in filenames:
-                        if filename.endswith("-" + suffix):
-                            found = path.join(dirpath, filename)
+                if index is None:
+                    index = repodata_index(repodatadir)
+                found = index.get(basename.split("-")[-1], "")
             if found:
                 newhref = path.join(repodata, path.basename(found))
                 logg.info("%s having: %s", kind, newhref)
-                xmlgz = open(found, "rb").read()
-                checksum_gz = hashlib.sha256(xmlgz).hexdigest()
+                checksum = checksum_type(data)
+                checksum_gz, size_gz, checksum_xml, size_xml, incache = cached_checksums(cache, found, checksum)
                 logg.info("%s        checksum: %s", kind, checksum_gz)
-                xml = gzip.open(found, "rb").read()
-                checksum_xml = hashlib.sha256(xml).hexdigest()
                 logg.info("%s   open checksum: %s", kind, checksum_xml)
                 a = data.getElementsByTagName("location")
                 a[0].setAttribute("href", newhref)
                 b = data.getElementsByTagName("checksum")
                 b[0].firstChild.replaceWholeText(checksum_gz)  # type: ignore[union-attr]
-                if b[0].hasAttribute("type"): b[0].setAttribute("type", "sha256") # type="sha512"
+                if b[0].hasAttribute("type"): b[0].setAttribute("type", checksum)
                 c = data.getElementsByTagName("size")
-                c[0].firstChild.replaceWholeText(str(len(xmlgz)))  # type: ignore[union-attr]
+                c[0].firstChild.replaceWholeText(str(size_gz))  # type: ignore[union-attr]
                 d = data.getElementsByTagName("open-size")
-                d[0].firstChild.replaceWholeText(str(len(xml)))  # type: ignore[union-attr]
+                d[0].firstChild.replaceWholeText(str(size_xml))  # type: ignore[union-attr]
                 e = data.getElementsByTagName("open-checksum")
                 e[0].firstChild.replaceWholeText(checksum_xml)  # type: ignore[union-attr]
-                if e[0].hasAttribute("type"): e[0].setAttribute("type", "sha256") # type="sha512"
+                if e[0].hasAttribute("type"): e[0].setAttribute("type", checksum)
                 fixes += 1
+                if incache:
+                    cached += 1
+                else:
+                    hashed += size_gz
+    if cache is not None:
+        cache.save()
     if fixes:
         logg.debug("done %i fixes -> overwrite repomd.xml", fixes)
-        os.rename(datafile, datafile + ".old")
-        dom.writexml(open(datafile, "w"))
+        write_xml(dom, datafile)
         logg.warning("done %i fixes -> %s", fixes, datafile)
+    return fixes, hashed, cached
+
+def find_repomd(roots: List[str]) -> List[str]:
+    """ the repomd.xml files below the given directories (files are taken as is) """
+    found: List[str] = []
+    for root in roots:
+        if not path.isdir(root):
+            found.append(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            if REPOMD in filenames:
+                found.append(path.join(dirpath, REPOMD))
+    return found
+
+def fix_safe(datafile: str, cachefile: Optional[str] = "") -> Tuple[str, int, int, int, str]:
+    """ fix() for the process pool, an exception is reported back as text """
+    try:
+        fixes, hashed, cached = fix(datafile, cachefile)
+        return datafile, fixes, hashed, cached, ""
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return datafile, 0, 0, 0, F"{e.__class__.__name__}: {e}"
+
+def fix_all(roots: List[str], jobs: int = JOBS, cachefile: Optional[str] = "") -> int:
+    """ fix all repomd.xml below the roots and print a summary, returns the number of failures """
+    started = time.monotonic()
+    datafiles = find_repomd(roots)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(datafiles) > 1:
+        with ProcessPoolExecutor(min(jobs, len(datafiles))) as pool:
+            results = list(pool.map(functools.partial(fix_safe, cachefile=cachefile), datafiles))
+    else:
+        results = [fix_safe(datafile, cachefile) for datafile in datafiles]
+    failed = 0
+    for datafile, _, _, _, error in results:
+        if error:
+            logg.error("%s: %s", datafile, error)
+            failed += 1
+    fixes = sum(result[1] for result in results)
+    fixed = len([result for result in results if result[1]])
+    hashed = sum(result[2] for result in results)
+    cached = sum(result[3] for result in results)
+    took = time.monotonic() - started
+    print(F"repodata-fix: {len(datafiles)} repomd.xml, {fixed} fixed with {fixes} entries, "
+          F"{hashed / (1024 * 1024):.1f} MB hashed, {cached} cached, {failed} failed, {took:.2f}s")
+    return failed
 
 
 if __name__ == "__main__":
@@ -74,8 +225,17 @@ if __name__ == "__main__":
     _o = ArgumentParser()
     _o.add_argument("-v", "--verbose", action="count", default=0,
                     help="increase logging level")
-    _o.add_argument("repomd", default="repodata/repomd.xml",
-                    help="the repomd to be fixed")
+    _o.add_argument("-j", "--jobs", metavar="N", type=int, default=JOBS,
+                    help="processes for fixing repomd files in parallel, 0 for the cpus (%(default)s)")
+    _o.add_argument("--cache", metavar="FILE", default="",
+                    help="the checksum cache, instead of " + SIDECAR + " in each repodata dir")
+    _o.add_argument("--nocache", action="store_true", default=False,
+                    help="hash all files, do not use a checksum cache")
+    _o.add_argument("-k", "--keep-going", action="store_true", default=False,
+                    help="exit 0 when some repomd.xml could not be fixed, they are counted in the summary")
+    _o.add_argument("repomd", nargs="+",
+                    help="the repomd to be fixed, or directories to search for repomd.xml")
     opt = _o.parse_args()
     logging.basicConfig(level=max(0, logging.ERROR - 10 * opt.verbose))
-    fix(opt.repomd)
+    failed = fix_all(opt.repomd, opt.jobs, None if opt.nocache else opt.cache)
+    sys.exit(1 if failed and not opt.keep_going else 0)
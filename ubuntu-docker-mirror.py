@@ -27,6 +27,7 @@ NIX = ""
 TRUE = 1
 NOBASE = False
 IMAGESREPO = os.environ.get("IMAGESREPO", "localhost:5000/mirror-packages")
+LABELS = "com.github.gdraheim.docker-mirror"  # prefix of the labels on the repo images
 REPODATADIR = os.environ.get("REPODATADIR", "")
 REPODIR = os.environ.get("REPODIR", "repo.d")
 
@@ -47,6 +48,7 @@ DATADIRS = [REPODATADIR,
             "/dock/docker-mirror-packages"]
 
 DISTROPYTHON = "python3"
+THREADS = 8 # worker threads of the scripts in the repo containers
 BASELAYER = "base"
 DISTRO = "ubuntu"
 UBUNTU = "24.04"
@@ -407,13 +409,18 @@ def _sync_dist_main(distro: str, ubuntu: str, dist: str, main: str, nopackages:
         options = "--size-only --copy-links "
         sh___(F"{rsync} -rv {mirror}/pool {pooldir} {options} --files-from={tmpfile}")
 
+def ubuntu_hosts(distro: str = NIX) -> str:
+    distro = distro or DISTRO
+    if distro == "debian":
+        return "deb.debian.org"
+    return "archive.ubuntu.com,security.ubuntu.com"
 def ubuntu_http_port() -> str:
     return "80"
 def ubuntu_http_cmd() -> List[str]:
     python = DISTROPYTHON
     if "/" not in python:
         python = F"/usr/bin/{python}"
-    return [python, "/srv/scripts/filelist.py", "--data", "/srv/repo"]
+    return [python, "/srv/scripts/filelist.py", "--data", "/srv/repo", "--threads", str(THREADS)]
 def ubuntu_base(distro: str = NIX, ubuntu: str = NIX) -> str:
     return repo_image(distro, ubuntu, [])
 def ubuntu_repo(distro: str = NIX, ubuntu: str = NIX) -> str:
@@ -500,7 +507,10 @@ def repo_image(distro: str = NIX, ubuntu: str = NIX, repos: Optional[List[str]]
     base = BASELAYER
     PORT = ubuntu_http_port()
     CMD = str(ubuntu_http_cmd()).replace("'", '"')
-    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
+    labels: Dict[str, Union[str, int]] = {"distro": distro, "version": version, "baseimage": baseimage,
+                                          "hosts": ubuntu_hosts(distro), "port": PORT, "data": "/srv/repo"}
+    LABEL = commit_labels(layer=base, **labels)
+    sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
     for main in repos:
         if ONLYREPOS and main not in ONLYREPOS:
             logg.info("'%s' not in ONLYREPOS %s", main, ONLYREPOS)
@@ -521,7 +531,8 @@ def repo_image(distro: str = NIX, ubuntu: str = NIX, repos: Optional[List[str]]
                 sh___(F"{docker} cp {pooldir}  {cname}:/srv/repo/{distrodir}/")
                 base = main
         if base == main:
-            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
+            LABEL = commit_labels(layer=base, **labels)
+            sh___(F"{docker} commit -c 'CMD {CMD}' -c 'EXPOSE {PORT}' {LABEL} -m {base} {cname} {imagesrepo}/{distro}-repo/{base}:{version}")
     if base != BASELAYER:
         sh___(F"{docker} tag {imagesrepo}/{distro}-repo/{base}:{version} {imagesrepo}/{distro}-repo:{version}")
     sh___(F"{docker} rm --force {cname}")
@@ -647,6 +658,11 @@ def ubuntu_list(distro: str = NIX, ubuntu: str = NIX) -> int:
     sx3 = sx___(cmd)
     return min(sx1, sx2, sx3)
 
+def commit_labels(**labels: Union[str, int]) -> str:
+    """ the 'docker commit' changes for the LABELS of a repo image, which let
+        docker_mirror.py find the mirror for an image without its version tables """
+    return " ".join([F"-c 'LABEL {LABELS}.{name}=\"{value}\"'" for name, value in labels.items()])
+
 def ubuntu_scripts() -> str:
     me = os.path.dirname(sys.argv[0]) or "."
     dn = os.path.join(me, "scripts")
@@ -838,6 +854,7 @@ if __name__ == "__main__":
     cmdline.add_option("-D", "--docker", metavar="EXE", default=DOCKER,   help="alternative to [%default] (e.g. podman)")
     cmdline.add_option("--rsync", metavar="EXE", default=RSYNC, help="alternative to [%default]")
     cmdline.add_option("--distropython", metavar="EXE", default=DISTROPYTHON, help="alternative to ./scripts [%default] runner")
+    cmdline.add_option("--threads", metavar="NUM", default=THREADS, help="worker threads of ./scripts in the repo image [%default]")
     cmdline.add_option("-R", "--nobase", action="store_true", default=NOBASE,
                        help="rm */base when repo image is ready [%default]")
     cmdline.add_option("--repodir", metavar="DIR", default=REPODIR,
@@ -885,6 +902,7 @@ if __name__ == "__main__":
     DOCKER = opt.docker
     RSYNC = opt.rsync
     DISTROPYTHON = opt.python
+    THREADS = int(opt.threads)
     UBUNTU_set(opt.ver)
     if opt.main:
         ONLYREPOS = ["main"]